@@ -2,8 +2,9 @@ from fastapi import FastAPI, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
+import asyncio
 
-from src.config.database import engine, Base
+from src.config.database import engine, Base, SessionLocal
 from src.routes import (
     cadastros, financeiro, atividades, ocorrencias,
     estoque, monitoramento, meteorologia, produtividade
@@ -16,9 +17,28 @@ Base.metadata.create_all(bind=engine)
 async def lifespan(app: FastAPI):
     # Startup
     print("Iniciando AgroFocus API...")
+    from src.utils.ml_service import encerrar_treinos_interrompidos
+    from src.utils.metricas_erro import contabilizar_pendentes
+    with SessionLocal() as db:
+        interrompidos = encerrar_treinos_interrompidos(db)
+        contabilizados = contabilizar_pendentes(db)
+    if interrompidos:
+        print(f"{interrompidos} treino(s) interrompido(s) marcado(s) como erro")
+    if contabilizados:
+        print(f"{contabilizados} produtividade(s) real(is) incluída(s) nas métricas de erro")
+    from src.utils import atualizacao_previsao
+    job_previsao = None
+    if atualizacao_previsao.job_ativo():
+        job_previsao = asyncio.create_task(atualizacao_previsao.executar_periodicamente())
+    else:
+        print("Atualização da previsão do tempo desativada (sem OPENWEATHER_API_KEY ou intervalo 0)")
     yield
     # Shutdown
     print("Encerrando AgroFocus API...")
+    if job_previsao:
+        job_previsao.cancel()
+    from src.utils.weather_service import fechar_weather_service
+    await fechar_weather_service()
 
 app = FastAPI(
     title="AgroFocus API",
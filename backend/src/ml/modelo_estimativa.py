@@ -15,25 +15,21 @@ import json
 import sys
 import os
 import argparse
-import pickle
+import importlib.util
 import numpy as np
 from datetime import datetime
+from functools import lru_cache
 
-# Import sklearn com fallback para modo simulado
-try:
-    from sklearn.linear_model import LinearRegression
-    from sklearn.preprocessing import StandardScaler
-    from sklearn.model_selection import train_test_split
-    from sklearn.metrics import r2_score, mean_squared_error
-    SKLEARN_AVAILABLE = True
-except ImportError:
-    SKLEARN_AVAILABLE = False
-    print("⚠️  scikit-learn não instalado. Usando modo de fallback/simulação.", file=sys.stderr)
+# sklearn só é importado no treino; a predição usa apenas NumPy
+SKLEARN_AVAILABLE = importlib.util.find_spec('sklearn') is not None
 
 # Diretório para salvar modelos treinados
 MODEL_DIR = os.path.join(os.path.dirname(__file__), 'models')
 os.makedirs(MODEL_DIR, exist_ok=True)
 
+# Versão do formato do artefato JSON (incrementar ao mudar os campos)
+FORMATO_ARTEFATO = 1
+
 # Tabela de calibração inicial (fallback quando não há modelo treinado)
 TABELA_CALIBRACAO = {
     'milho': {
@@ -70,6 +66,33 @@ TABELA_CALIBRACAO = {
     }
 }
 
+@lru_cache(maxsize=None)
+def _faixas_calibracao(cultura):
+    """Faixas da tabela de calibração como arrays ordenados pelo NDVI mínimo."""
+    tabela = TABELA_CALIBRACAO.get(cultura, TABELA_CALIBRACAO['milho'])
+    faixas = sorted(tabela['faixas_ndvi'], key=lambda f: f['min'])
+    return (
+        np.array([f['min'] for f in faixas], dtype=np.float64),
+        np.array([f['max'] for f in faixas], dtype=np.float64),
+        np.array([f['produtividade'][0] for f in faixas], dtype=np.float64),
+        np.array([f['produtividade'][1] for f in faixas], dtype=np.float64),
+        np.array([f['descricao'] for f in faixas])
+    )
+
+
+def caminho_modelo(cultura):
+    """Caminho do artefato JSON do modelo da cultura."""
+    return os.path.join(MODEL_DIR, f'modelo_{cultura.lower()}.json')
+
+
+def versao_artefato(cultura):
+    """mtime (ns) do artefato da cultura, ou None se não houver modelo treinado."""
+    try:
+        return os.stat(caminho_modelo(cultura)).st_mtime_ns
+    except OSError:
+        return None
+
+
 class ModeloEstimativaProdutividade:
     """
     Modelo de regressão linear múltipla para estimar produtividade agrícola.
@@ -86,45 +109,87 @@ class ModeloEstimativaProdutividade:
     
     def __init__(self, cultura='milho'):
         self.cultura = cultura.lower()
-        self.modelo = None
-        self.scaler = None
+        # media/escala do StandardScaler e coeficientes/intercepto da regressão
+        self.parametros = None
         self.metricas = {}
         self.coeficientes = {}
         self._carregar_modelo()
     
     def _get_model_path(self):
         """Retorna caminho do arquivo do modelo para a cultura."""
-        return os.path.join(MODEL_DIR, f'modelo_{self.cultura}.pkl')
+        return caminho_modelo(self.cultura)
+    
+    def versao_artefato(self):
+        """mtime (ns) do arquivo do modelo, ou None se não houver modelo treinado."""
+        return versao_artefato(self.cultura)
     
     def _carregar_modelo(self):
         """Tenta carregar modelo treinado do disco."""
         model_path = self._get_model_path()
-        if os.path.exists(model_path):
-            try:
-                with open(model_path, 'rb') as f:
-                    dados = pickle.load(f)
-                    self.modelo = dados.get('modelo')
-                    self.scaler = dados.get('scaler')
-                    self.metricas = dados.get('metricas', {})
-                    self.coeficientes = dados.get('coeficientes', {})
-                return True
-            except Exception as e:
-                print(f"Erro ao carregar modelo: {e}", file=sys.stderr)
+        if not os.path.exists(model_path):
+            return self._migrar_pickle()
+        
+        try:
+            with open(model_path, 'r') as f:
+                dados = json.load(f)
+            if dados.get('versao_formato') != FORMATO_ARTEFATO:
+                print(f"Formato de modelo não suportado: {dados.get('versao_formato')}", file=sys.stderr)
+                return False
+            self.parametros = {
+                chave: np.asarray(dados[chave], dtype=np.float64)
+                for chave in ('media', 'escala', 'coeficientes', 'intercepto')
+            }
+            self.metricas = dados.get('metricas', {})
+            self.coeficientes = dados.get('coeficientes_nomeados', {})
+            return True
+        except Exception as e:
+            print(f"Erro ao carregar modelo: {e}", file=sys.stderr)
+        return False
+    
+    def _migrar_pickle(self):
+        """Converte um modelo .pkl do formato antigo (gerado por este módulo) para JSON."""
+        legado = os.path.join(MODEL_DIR, f'modelo_{self.cultura}.pkl')
+        if not os.path.exists(legado):
+            return False
+        try:
+            import pickle
+            with open(legado, 'rb') as f:
+                dados = pickle.load(f)
+            self.parametros = {
+                'media': dados['scaler'].mean_,
+                'escala': dados['scaler'].scale_,
+                'coeficientes': dados['modelo'].coef_,
+                'intercepto': np.asarray(dados['modelo'].intercept_)
+            }
+            self.metricas = dados.get('metricas', {})
+            self.coeficientes = dados.get('coeficientes', {})
+            self._salvar_modelo()
+            return True
+        except Exception as e:
+            print(f"Erro ao migrar modelo legado: {e}", file=sys.stderr)
         return False
     
     def _salvar_modelo(self):
-        """Salva modelo treinado no disco."""
+        """Salva os parâmetros do modelo treinado em JSON versionado."""
         model_path = self._get_model_path()
         dados = {
-            'modelo': self.modelo,
-            'scaler': self.scaler,
-            'metricas': self.metricas,
-            'coeficientes': self.coeficientes,
+            'versao_formato': FORMATO_ARTEFATO,
+            'tipo': 'regressao_linear',
+            'features': ['ndvi_mean', 'gdd_total', 'precip_total'],
+            **{chave: valor.tolist() for chave, valor in self.parametros.items()},
+            'metricas': {
+                chave: valor.item() if hasattr(valor, 'item') else valor
+                for chave, valor in self.metricas.items()
+            },
+            'coeficientes_nomeados': self.coeficientes,
             'cultura': self.cultura,
             'data_treino': datetime.now().isoformat()
         }
-        with open(model_path, 'wb') as f:
-            pickle.dump(dados, f)
+        # Escrita atômica: o servidor de predição pode estar lendo o arquivo
+        temporario = model_path + '.tmp'
+        with open(temporario, 'w') as f:
+            json.dump(dados, f, indent=2)
+        os.replace(temporario, model_path)
     
     def treinar(self, dados_treino):
         """
@@ -139,6 +204,11 @@ class ModeloEstimativaProdutividade:
         if not SKLEARN_AVAILABLE:
             return {'erro': 'scikit-learn não disponível para treinamento'}
         
+        from sklearn.linear_model import LinearRegression
+        from sklearn.preprocessing import StandardScaler
+        from sklearn.model_selection import train_test_split
+        from sklearn.metrics import r2_score, mean_squared_error
+        
         if len(dados_treino) < 5:
             return {'erro': 'Mínimo de 5 amostras necessário para treinamento'}
         
@@ -154,16 +224,16 @@ class ModeloEstimativaProdutividade:
             X_test, y_test = X, y
         
         # Normalizar features
-        self.scaler = StandardScaler()
-        X_train_scaled = self.scaler.fit_transform(X_train)
-        X_test_scaled = self.scaler.transform(X_test)
+        scaler = StandardScaler()
+        X_train_scaled = scaler.fit_transform(X_train)
+        X_test_scaled = scaler.transform(X_test)
         
         # Treinar modelo
-        self.modelo = LinearRegression()
-        self.modelo.fit(X_train_scaled, y_train)
+        modelo = LinearRegression()
+        modelo.fit(X_train_scaled, y_train)
         
         # Calcular métricas
-        y_pred = self.modelo.predict(X_test_scaled)
+        y_pred = modelo.predict(X_test_scaled)
         
         self.metricas = {
             'r2_score': r2_score(y_test, y_pred),
@@ -174,10 +244,18 @@ class ModeloEstimativaProdutividade:
         }
         
         self.coeficientes = {
-            'intercept': float(self.modelo.intercept_),
-            'ndvi_coef': float(self.modelo.coef_[0]),
-            'gdd_coef': float(self.modelo.coef_[1]),
-            'precip_coef': float(self.modelo.coef_[2])
+            'intercept': float(modelo.intercept_),
+            'ndvi_coef': float(modelo.coef_[0]),
+            'gdd_coef': float(modelo.coef_[1]),
+            'precip_coef': float(modelo.coef_[2])
+        }
+        
+        # Só os parâmetros são persistidos; a inferência não depende do sklearn
+        self.parametros = {
+            'media': scaler.mean_,
+            'escala': scaler.scale_,
+            'coeficientes': modelo.coef_,
+            'intercepto': np.asarray(modelo.intercept_)
         }
         
         # Salvar modelo
@@ -202,10 +280,8 @@ class ModeloEstimativaProdutividade:
             Dict com estimativa e intervalo de confiança
         """
         # Se tem modelo treinado, usa ele
-        if self.modelo is not None and self.scaler is not None and SKLEARN_AVAILABLE:
-            X = np.array([[ndvi_mean, gdd_total, precip_total]])
-            X_scaled = self.scaler.transform(X)
-            estimativa = float(self.modelo.predict(X_scaled)[0])
+        if self._modelo_treinado():
+            estimativa = float(self._estimar_linear(ndvi_mean, gdd_total, precip_total))
             
             # Calcular intervalo de confiança baseado no RMSE
             rmse = self.metricas.get('rmse', 1.0)
@@ -234,6 +310,65 @@ class ModeloEstimativaProdutividade:
         # Fallback: usar tabela de calibração
         return self._estimativa_fallback(ndvi_mean)
     
+    def prever_lote(self, ndvi_mean, gdd_total=None, precip_total=None):
+        """
+        Predição vetorizada para várias amostras de uma vez.
+        
+        Args:
+            ndvi_mean: Array de NDVI médio, ou DataFrame com as colunas
+                ndvi_mean, gdd_total e precip_total
+            gdd_total: Array ou escalar (replicado para todas as amostras)
+            precip_total: Array ou escalar (replicado para todas as amostras)
+        
+        Returns:
+            Dict de arrays: estimativa_ton_ha, intervalo_min, intervalo_max,
+            metodo e descricao_faixa
+        """
+        if hasattr(ndvi_mean, 'columns'):
+            tabela = ndvi_mean
+            ndvi_mean = tabela['ndvi_mean'].to_numpy()
+            if 'gdd_total' in tabela:
+                gdd_total = tabela['gdd_total'].to_numpy()
+            if 'precip_total' in tabela:
+                precip_total = tabela['precip_total'].to_numpy()
+        
+        ndvi = np.asarray(ndvi_mean, dtype=np.float64)
+        if not self._modelo_treinado():
+            return self._estimativa_fallback_lote(ndvi)
+        
+        if gdd_total is None or precip_total is None:
+            raise ValueError('gdd_total e precip_total são obrigatórios com modelo treinado')
+        
+        ndvi, gdd, precip = np.broadcast_arrays(
+            ndvi,
+            np.asarray(gdd_total, dtype=np.float64),
+            np.asarray(precip_total, dtype=np.float64)
+        )
+        estimativa = self._estimar_linear(ndvi, gdd, precip)
+        rmse = self.metricas.get('rmse', 1.0)
+        
+        return {
+            'estimativa_ton_ha': np.round(estimativa, 2),
+            'intervalo_min': np.round(np.maximum(0, estimativa - 1.96 * rmse), 2),
+            'intervalo_max': np.round(estimativa + 1.96 * rmse, 2),
+            'metodo': np.full(estimativa.shape, 'modelo_ml'),
+            'descricao_faixa': np.full(estimativa.shape, '')
+        }
+    
+    def _modelo_treinado(self):
+        return self.parametros is not None
+    
+    def _parametros_lineares(self):
+        """Pesos e intercepto com a normalização do scaler embutida."""
+        pesos = self.parametros['coeficientes'] / self.parametros['escala']
+        intercepto = float(self.parametros['intercepto']) - np.dot(pesos, self.parametros['media'])
+        return pesos, intercepto
+    
+    def _estimar_linear(self, ndvi, gdd, precip):
+        """Regressão linear aplicada elemento a elemento (escalares ou arrays)."""
+        pesos, intercepto = self._parametros_lineares()
+        return intercepto + pesos[0] * ndvi + pesos[1] * gdd + pesos[2] * precip
+    
     def _estimativa_fallback(self, ndvi_mean):
         """
         Estimativa baseada na tabela de calibração quando modelo não disponível.
@@ -269,6 +404,125 @@ class ModeloEstimativaProdutividade:
             'erro': 'NDVI fora das faixas esperadas'
         }
     
+    def _estimativa_fallback_lote(self, ndvi):
+        """
+        Tabela de calibração vetorizada: a faixa de cada amostra sai de um
+        único searchsorted sobre os mínimos (limite pertence à faixa superior,
+        como em _estimativa_fallback).
+        """
+        _, _, prod_min, prod_max, descricoes = _faixas_calibracao(self.cultura)
+        faixa, valido = self._faixa_calibracao(ndvi)
+        
+        return {
+            'estimativa_ton_ha': np.where(valido, np.round((prod_min + prod_max)[faixa] / 2, 2), 0.0),
+            'intervalo_min': np.where(valido, prod_min[faixa], 0.0),
+            'intervalo_max': np.where(valido, prod_max[faixa], 0.0),
+            'metodo': np.where(valido, 'tabela_calibracao', 'erro'),
+            'descricao_faixa': np.where(valido, descricoes[faixa], '')
+        }
+    
+    def _faixa_calibracao(self, ndvi):
+        """Índice da faixa de cada valor de NDVI e máscara dos que caem em alguma."""
+        minimos, maximos, _, _, _ = _faixas_calibracao(self.cultura)
+        faixa = np.clip(np.searchsorted(minimos, ndvi, side='right') - 1, 0, len(minimos) - 1)
+        return faixa, (ndvi >= minimos[0]) & (ndvi <= maximos[faixa])
+    
+    def _estimar_raster(self, ndvi, gdd_total, precip_total):
+        """Produtividade (ton/ha, float32) de um bloco de NDVI; NaN onde não há estimativa."""
+        if self._modelo_treinado():
+            pesos, intercepto = self._parametros_lineares()
+            constante = intercepto + pesos[1] * gdd_total + pesos[2] * precip_total
+            return (constante + pesos[0] * ndvi).astype(np.float32)
+        
+        _, _, prod_min, prod_max, _ = _faixas_calibracao(self.cultura)
+        faixa, valido = self._faixa_calibracao(ndvi)
+        return np.where(valido, ((prod_min + prod_max) / 2)[faixa], np.nan).astype(np.float32)
+    
+    def gerar_mapa_produtividade(self, ndvi, gdd_total=None, precip_total=None, zonas=None,
+                                 area_pixel_ha=None, saida=None, pixels_por_bloco=1 << 20):
+        """
+        Gera o mapa de produtividade por pixel a partir de um raster de NDVI.
+        
+        O raster é processado em blocos de linhas, então entradas .npy mapeadas
+        em memória e a saída não precisam caber inteiras na RAM.
+        
+        Args:
+            ndvi: Raster 2D de NDVI (NaN = sem dado) ou caminho de um .npy
+            gdd_total: GDD da safra, replicado para todos os pixels
+            precip_total: Precipitação da safra, replicada para todos os pixels
+            zonas: Raster de zonas de manejo (0..n-1, -1 = fora), mesmo formato do NDVI
+            area_pixel_ha: Área de um pixel em hectares (para a produção em toneladas)
+            saida: Array float32 de saída ou caminho .npy (criado mapeado em memória)
+            pixels_por_bloco: Tamanho aproximado de cada bloco processado
+        
+        Returns:
+            Dict com raster (ton/ha), totais por zona e total do talhão
+        """
+        if self._modelo_treinado() and (gdd_total is None or precip_total is None):
+            raise ValueError('gdd_total e precip_total são obrigatórios com modelo treinado')
+        
+        if isinstance(ndvi, (str, os.PathLike)):
+            ndvi = np.load(ndvi, mmap_mode='r')
+        if isinstance(zonas, (str, os.PathLike)):
+            zonas = np.load(zonas, mmap_mode='r')
+        if zonas is not None and zonas.shape != ndvi.shape:
+            raise ValueError('Raster de zonas deve ter o mesmo formato do NDVI')
+        
+        if saida is None:
+            saida = np.empty(ndvi.shape, dtype=np.float32)
+        elif isinstance(saida, (str, os.PathLike)):
+            saida = np.lib.format.open_memmap(saida, mode='w+', dtype=np.float32, shape=ndvi.shape)
+        
+        n_pixels = np.zeros(1, dtype=np.int64)
+        soma = np.zeros(1, dtype=np.float64)
+        linhas_bloco = max(1, pixels_por_bloco // max(1, ndvi.shape[1]))
+        
+        for inicio in range(0, ndvi.shape[0], linhas_bloco):
+            fatia = slice(inicio, inicio + linhas_bloco)
+            produtividade = self._estimar_raster(
+                np.asarray(ndvi[fatia], dtype=np.float32), gdd_total, precip_total
+            )
+            saida[fatia] = produtividade
+            
+            validos = np.isfinite(produtividade)
+            if zonas is not None:
+                rotulos = np.asarray(zonas[fatia])
+                validos &= rotulos >= 0
+                rotulos = rotulos[validos]
+            else:
+                rotulos = np.zeros(np.count_nonzero(validos), dtype=np.intp)
+            
+            contagem = np.bincount(rotulos, minlength=len(n_pixels))
+            if len(contagem) > len(n_pixels):
+                n_pixels = np.pad(n_pixels, (0, len(contagem) - len(n_pixels)))
+                soma = np.pad(soma, (0, len(contagem) - len(soma)))
+            n_pixels += contagem
+            soma += np.bincount(rotulos, weights=produtividade[validos], minlength=len(soma))
+        
+        if isinstance(saida, np.memmap):
+            saida.flush()
+        
+        def resumo(n, total):
+            item = {
+                'n_pixels': int(n),
+                'produtividade_media_ton_ha': round(float(total / n), 2) if n else None
+            }
+            if area_pixel_ha:
+                item['area_hectares'] = round(float(n * area_pixel_ha), 2)
+                item['producao_ton'] = round(float(total * area_pixel_ha), 2)
+            return item
+        
+        return {
+            'raster': saida,
+            'zonas': [
+                {'zona_id': i + 1, **resumo(n_pixels[i], soma[i])}
+                for i in range(len(n_pixels))
+            ] if zonas is not None else [],
+            'total': resumo(n_pixels.sum(), soma.sum()),
+            'metodo': 'modelo_ml' if self._modelo_treinado() else 'tabela_calibracao',
+            'cultura': self.cultura
+        }
+    
     def calcular_tendencia(self, dados_historicos):
         """
         Calcula tendência de produtividade ao longo dos anos.
@@ -11,6 +11,7 @@ from PIL import Image
 import requests
 from io import BytesIO
 import json
+import os
 import sys
 from skimage import morphology, segmentation, filters, measure
 from skimage.feature import canny
@@ -28,6 +29,13 @@ except ImportError:
     SAM_AVAILABLE = False
     print("AVISO: SAM não disponível. Usando watershed como fallback.", file=sys.stderr)
 
+# rasterio é opcional: só necessário para pilhas NDVI em GeoTIFF multibanda
+try:
+    import rasterio
+    RASTERIO_AVAILABLE = True
+except ImportError:
+    RASTERIO_AVAILABLE = False
+
 class SegmentadorTalhoes:
     """Classe principal para segmentação automática de talhões"""
     
@@ -284,55 +292,189 @@ class SegmentadorTalhoes:
         
         return geometrias_finais
     
-    def classificar_zonas(self, historico_ndvi):
+    def classificar_zonas(self, historico_ndvi, area_minima=500, tolerancia=2.0,
+                          nodata=None, mascaras_nuvem=None):
         """
         Classifica zonas de produtividade baseado em histórico NDVI
         Retorna: Low (< 0.4), Medium (0.4-0.7), High (> 0.7)
+        
+        As três classes são rotuladas numa única passada e cada região é
+        vetorizada pelo seu contorno (e não pelos pixels), depois simplificada.
+        
+        `historico_ndvi` pode ser uma lista/iterador de rasters, um array 3D
+        (inclusive memmap) ou o caminho de uma pilha .npy / GeoTIFF; a média é
+        acumulada banda a banda (ver `reduzir_historico_ndvi`).
         """
-        if not historico_ndvi or len(historico_ndvi) == 0:
+        if historico_ndvi is None:
+            return []
+        if isinstance(historico_ndvi, (list, tuple)) and len(historico_ndvi) == 0:
             return []
         
-        # Calcular NDVI médio por pixel ao longo dos anos
-        ndvi_medio = np.mean(historico_ndvi, axis=0)
+        # Calcular NDVI médio por pixel ao longo dos anos, uma banda por vez
+        reducao = reduzir_historico_ndvi(historico_ndvi, nodata=nodata,
+                                         mascaras=mascaras_nuvem)
+        if reducao is None:
+            return []
+        ndvi_medio, _, _ = reducao
         
-        # Classificar pixels
         zonas = {
             'low': [],      # NDVI < 0.4
             'medium': [],   # 0.4 <= NDVI <= 0.7
             'high': []      # NDVI > 0.7
         }
+        nomes_classes = {1: 'low', 2: 'medium', 3: 'high'}
         
-        # Criar máscaras para cada zona
-        mascara_low = ndvi_medio < 0.4
-        mascara_medium = (ndvi_medio >= 0.4) & (ndvi_medio <= 0.7)
-        mascara_high = ndvi_medio > 0.7
+        # Raster de classes: 1 = low, 2 = medium, 3 = high, 0 = sem dado
+        validos = np.isfinite(ndvi_medio)
+        classes = (1 + (ndvi_medio >= 0.4) + (ndvi_medio > 0.7)).astype(np.uint8)
+        classes[~validos] = 0
         
-        # Extrair geometrias para cada zona
-        for zona_nome, mascara in [('low', mascara_low), 
-                                    ('medium', mascara_medium), 
-                                    ('high', mascara_high)]:
-            # Limpar ruído
-            mascara_limpa = morphology.remove_small_objects(mascara, min_size=100)
-            mascara_limpa = morphology.remove_small_holes(mascara_limpa, area_threshold=100)
-            
-            # Encontrar regiões
-            labels = measure.label(mascara_limpa)
+        # Rotular regiões conexas de mesma classe (uma passada para as três)
+        labels = measure.label(classes, background=0, connectivity=1)
+        tamanhos = np.bincount(labels.ravel())
+        
+        # Limpar ruído: regiões e buracos pequenos herdam a classe do pixel
+        # válido mais próximo
+        ruido = validos & (tamanhos[labels] < 100)
+        if ruido.any() and not ruido[validos].all():
+            indices = ndimage.distance_transform_edt(
+                ruido | ~validos, return_distances=False, return_indices=True
+            )
+            classes = np.where(validos, classes[tuple(indices)], 0).astype(np.uint8)
+            labels = measure.label(classes, background=0, connectivity=1)
+            tamanhos = np.bincount(labels.ravel())
+        
+        # Regiões com área mínima de pixels
+        ids = np.flatnonzero(tamanhos > area_minima)
+        ids = ids[ids > 0]
+        if len(ids) == 0:
+            return zonas
+        
+        # NDVI médio de todas as regiões de uma vez
+        medias = ndimage.mean(ndvi_medio, labels=labels, index=ids)
+        fatias = ndimage.find_objects(labels)
+        
+        for label_id, media in zip(ids, medias):
+            fatia = fatias[label_id - 1]
+            mascara = labels[fatia] == label_id
+            poligono = self._poligonizar_regiao(mascara, fatia, tolerancia)
+            if poligono is None:
+                continue
             
-            for region in measure.regionprops(labels):
-                if region.area > 500:  # Mínimo de pixels
-                    # Criar polígono da região
-                    coords = region.coords
-                    if len(coords) >= 3:
-                        poligono = Polygon(coords)
-                        if poligono.is_valid:
-                            zonas[zona_nome].append({
-                                'geometry': mapping(poligono.simplify(2.0)),
-                                'area': region.area,
-                                'ndvi_medio': float(np.mean(ndvi_medio[region.coords[:,0], 
-                                                                      region.coords[:,1]]))
-                            })
+            classe = classes[fatia][mascara][0]
+            zonas[nomes_classes[classe]].append({
+                'geometry': mapping(poligono),
+                'area': int(tamanhos[label_id]),
+                'ndvi_medio': float(media)
+            })
         
         return zonas
+    
+    def _poligonizar_regiao(self, mascara, fatia, tolerancia=2.0):
+        """
+        Converte a máscara de uma região (recortada pela bounding box) em
+        polígono com buracos, em coordenadas de imagem (x = coluna, y = linha).
+        """
+        # Borda de 1 pixel para que contornos encostados no recorte fechem
+        mascara = np.pad(mascara, 1).astype(np.uint8)
+        contornos, hierarquia = cv2.findContours(mascara, cv2.RETR_CCOMP,
+                                                 cv2.CHAIN_APPROX_SIMPLE)
+        if hierarquia is None:
+            return None
+        
+        deslocamento = np.array([fatia[1].start - 1, fatia[0].start - 1])
+        exterior = None
+        furos = []
+        for contorno, (_, _, _, pai) in zip(contornos, hierarquia[0]):
+            pontos = contorno.reshape(-1, 2) + deslocamento
+            if len(pontos) < 3:
+                continue
+            if pai == -1:
+                if exterior is None or len(pontos) > len(exterior):
+                    exterior = pontos
+            else:
+                furos.append(pontos)
+        
+        if exterior is None:
+            return None
+        
+        poligono = Polygon(exterior, furos).simplify(tolerancia, preserve_topology=True)
+        if not poligono.is_valid:
+            poligono = poligono.buffer(0)
+        if poligono.is_empty:
+            return None
+        
+        return poligono
+
+
+def _iterar_bandas(fonte):
+    """Itera sobre as bandas (rasters 2D) de uma pilha sem carregá-la inteira"""
+    if isinstance(fonte, (str, os.PathLike)):
+        caminho = os.fspath(fonte)
+        if caminho.lower().endswith(('.tif', '.tiff')):
+            if not RASTERIO_AVAILABLE:
+                raise ImportError("rasterio é necessário para ler pilhas GeoTIFF")
+            with rasterio.open(caminho) as src:
+                for i in range(1, src.count + 1):
+                    # Pixels nodata do arquivo viram NaN
+                    yield src.read(i, masked=True).astype(np.float32).filled(np.nan)
+            return
+        fonte = np.load(caminho, mmap_mode='r')
+    
+    if isinstance(fonte, np.ndarray) and fonte.ndim == 2:
+        fonte = fonte[np.newaxis]
+    
+    yield from fonte
+
+
+def reduzir_historico_ndvi(historico, nodata=None, mascaras=None):
+    """
+    Reduz uma pilha multi-anual de rasters NDVI a média, variância e contagem
+    por pixel, lendo uma banda por vez (Welford em float32, memória O(um raster)).
+    
+    Args:
+        historico: lista/iterador de rasters 2D, array 3D (inclusive memmap)
+            ou caminho para pilha .npy / GeoTIFF multibanda
+        nodata: valor a ignorar, além de NaN
+        mascaras: máscaras de nuvem (True = descartar) alinhadas às bandas,
+            nas mesmas formas aceitas por `historico`
+    
+    Returns:
+        Tupla (media, variancia, contagem). Média e variância são NaN onde não
+        houve observação válida. None se a pilha estiver vazia.
+    """
+    iter_mascaras = _iterar_bandas(mascaras) if mascaras is not None else None
+    media = m2 = contagem = None
+    
+    for banda in _iterar_bandas(historico):
+        banda = np.asarray(banda, dtype=np.float32)
+        if media is None:
+            media = np.zeros(banda.shape, dtype=np.float32)
+            m2 = np.zeros(banda.shape, dtype=np.float32)
+            contagem = np.zeros(banda.shape, dtype=np.uint16)
+        
+        valido = np.isfinite(banda)
+        if nodata is not None:
+            valido &= banda != nodata
+        if iter_mascaras is not None:
+            mascara = next(iter_mascaras, None)
+            if mascara is None:
+                raise ValueError("Quantidade de máscaras menor que a de bandas")
+            valido &= ~np.asarray(mascara, dtype=bool)
+        
+        contagem += valido
+        delta = np.subtract(banda, media, out=np.zeros_like(media), where=valido)
+        media += np.divide(delta, contagem, out=np.zeros_like(media), where=valido)
+        m2 += np.multiply(delta, banda - media, out=np.zeros_like(media), where=valido)
+    
+    if media is None:
+        return None
+    
+    com_dados = contagem > 0
+    variancia = np.divide(m2, contagem, out=np.full_like(m2, np.nan), where=com_dados)
+    media[~com_dados] = np.nan
+    
+    return media, variancia, contagem
 
 
 def main():
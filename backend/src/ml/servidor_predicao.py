@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+"""
+Servidor de predição residente - AgroFocus
+
+Mantém um ModeloEstimativaProdutividade por cultura carregado em memória e o
+recarrega quando o arquivo do modelo muda (mtime), evitando subir um
+interpretador, importar sklearn e desserializar o modelo a cada estimativa.
+
+Protocolo: TCP local, uma requisição JSON por linha e uma resposta por linha.
+
+Uso:
+    python servidor_predicao.py [--host 127.0.0.1] [--porta 8765]
+
+Requisição:
+    {"cultura": "milho", "ndvi_mean": 0.75, "gdd_total": 1800, "precip_total": 450}
+"""
+
+import argparse
+import json
+import os
+import re
+import socketserver
+import sys
+import threading
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from modelo_estimativa import ModeloEstimativaProdutividade, TABELA_CALIBRACAO, versao_artefato
+
+HOST_PADRAO = os.getenv('AGROFOCUS_PREDICAO_HOST', '127.0.0.1')
+PORTA_PADRAO = int(os.getenv('AGROFOCUS_PREDICAO_PORTA', '8765'))
+MAX_MODELOS = int(os.getenv('AGROFOCUS_PREDICAO_MAX_MODELOS', '32'))
+CULTURA_VALIDA = re.compile(r'^[a-z_]{1,50}$')
+
+
+class CacheModelos:
+    """Um modelo por cultura (LRU), recarregado quando o artefato em disco muda."""
+    
+    def __init__(self, max_modelos=MAX_MODELOS):
+        self._modelos = OrderedDict()
+        self._max_modelos = max_modelos
+        self._lock = threading.Lock()
+    
+    def _validar(self, cultura):
+        """Aceita culturas da tabela de calibração ou com modelo treinado em disco."""
+        cultura = str(cultura).lower()
+        if not CULTURA_VALIDA.match(cultura) or (
+            cultura not in TABELA_CALIBRACAO and versao_artefato(cultura) is None
+        ):
+            raise ValueError(f"Cultura desconhecida: {cultura}")
+        return cultura
+    
+    def obter(self, cultura):
+        cultura = self._validar(cultura)
+        # Versão lida antes da carga: se o arquivo mudar durante a carga, a
+        # próxima chamada vê mtime diferente e recarrega
+        versao = versao_artefato(cultura)
+        
+        with self._lock:
+            entrada = self._modelos.get(cultura)
+            if entrada is not None and entrada[1] == versao:
+                self._modelos.move_to_end(cultura)
+                return entrada[0]
+            
+            modelo = ModeloEstimativaProdutividade(cultura=cultura)
+            self._modelos[cultura] = (modelo, versao)
+            self._modelos.move_to_end(cultura)
+            while len(self._modelos) > self._max_modelos:
+                self._modelos.popitem(last=False)
+            print(f"Modelo '{cultura}' carregado ({versao})", file=sys.stderr)
+            return modelo
+    
+    def culturas(self):
+        """Culturas com modelo em cache, em ordem alfabética"""
+        with self._lock:
+            return sorted(self._modelos)
+
+
+class PredicaoHandler(socketserver.StreamRequestHandler):
+    """Atende requisições JSON por linha até o cliente fechar a conexão."""
+    
+    def handle(self):
+        for linha in self.rfile:
+            if not linha.strip():
+                continue
+            try:
+                dados = json.loads(linha)
+                if dados.get('acao') == 'ping':
+                    resposta = {'sucesso': True, 'culturas': self.server.modelos.culturas()}
+                else:
+                    modelo = self.server.modelos.obter(dados.get('cultura', 'milho'))
+                    resposta = modelo.prever(
+                        ndvi_mean=dados.get('ndvi_mean', 0.5),
+                        gdd_total=dados.get('gdd_total', 1500),
+                        precip_total=dados.get('precip_total', 400)
+                    )
+            except Exception as e:
+                resposta = {'sucesso': False, 'erro': str(e)}
+            
+            self.wfile.write((json.dumps(resposta) + '\n').encode('utf-8'))
+
+
+class ServidorPredicao(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+    
+    def __init__(self, endereco):
+        super().__init__(endereco, PredicaoHandler)
+        self.modelos = CacheModelos()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor de predição AgroFocus')
+    parser.add_argument('--host', default=HOST_PADRAO)
+    parser.add_argument('--porta', type=int, default=PORTA_PADRAO)
+    args = parser.parse_args()
+    
+    with ServidorPredicao((args.host, args.porta)) as servidor:
+        # Pré-carregar as culturas da tabela de calibração
+        for cultura in ('milho', 'soja', 'trigo', 'algodao'):
+            servidor.modelos.obter(cultura)
+        print(f"🌾 Servidor de predição em {args.host}:{args.porta}", file=sys.stderr)
+        servidor.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
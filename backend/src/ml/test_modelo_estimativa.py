@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+"""
+Script de exemplo para testar o modelo de estimativa de produtividade
+e o servidor de predição residente
+"""
+
+import sys
+import os
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import modelo_estimativa
+from modelo_estimativa import ModeloEstimativaProdutividade, gerar_dados_exemplo
+from servidor_predicao import CacheModelos
+
+def testar_recarga_servidor():
+    """Testa que o cache mantém o modelo em memória e recarrega quando o arquivo muda"""
+
+    print("\n📊 Testando Recarga do Servidor de Predição...")
+    print("-" * 40)
+
+    model_dir_original = modelo_estimativa.MODEL_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        modelo_estimativa.MODEL_DIR = tmp
+        try:
+            cache = CacheModelos()
+            modelo = cache.obter('milho')
+            assert cache.obter('MILHO') is modelo
+            assert modelo.prever(0.75, 1800, 450)['metodo'] == 'tabela_calibracao'
+
+            if not modelo_estimativa.SKLEARN_AVAILABLE:
+                print("⚠️  scikit-learn não instalado, recarga não testada")
+                return True
+
+            ModeloEstimativaProdutividade('milho').treinar(gerar_dados_exemplo())
+            recarregado = cache.obter('milho')
+            assert recarregado is not modelo
+            assert recarregado.prever(0.75, 1800, 450)['metodo'] == 'modelo_ml'
+            assert cache.obter('milho') is recarregado
+            print("✅ Modelo recarregado após novo treino")
+
+            # Artefato substituído durante a carga: a versão guardada é a de antes
+            import servidor_predicao
+            construtor = servidor_predicao.ModeloEstimativaProdutividade
+
+            def carregar_e_substituir(cultura):
+                carregado = construtor(cultura)
+                info = os.stat(carregado._get_model_path())
+                os.utime(carregado._get_model_path(), ns=(info.st_atime_ns, info.st_mtime_ns + 10**9))
+                return carregado
+
+            cache = CacheModelos()
+            servidor_predicao.ModeloEstimativaProdutividade = carregar_e_substituir
+            try:
+                durante_troca = cache.obter('milho')
+            finally:
+                servidor_predicao.ModeloEstimativaProdutividade = construtor
+            assert cache.obter('milho') is not durante_troca
+            print("✅ Artefato trocado durante a carga é recarregado")
+
+            # Culturas desconhecidas são recusadas e o cache é limitado (LRU)
+            for invalida in ('inexistente', '../modelo_milho'):
+                try:
+                    cache.obter(invalida)
+                    raise AssertionError(f"cultura {invalida!r} deveria ser recusada")
+                except ValueError:
+                    pass
+            pequeno = CacheModelos(max_modelos=2)
+            for cultura in ('milho', 'soja', 'trigo'):
+                pequeno.obter(cultura)
+            assert list(pequeno._modelos) == ['soja', 'trigo']
+            assert pequeno.culturas() == ['soja', 'trigo']
+            print("✅ Cultura validada e cache limitado")
+        finally:
+            modelo_estimativa.MODEL_DIR = model_dir_original
+
+    return True
+
+def testar_prever_lote():
+    """Testa que prever_lote reproduz prever amostra a amostra"""
+
+    print("\n📊 Testando Predição em Lote...")
+    print("-" * 40)
+
+    ndvi = np.array([-0.1, 0.0, 0.25, 0.4, 0.55, 0.6, 0.8, 0.93, 1.0, 1.2, np.nan])
+    gdd = np.linspace(1200, 2200, len(ndvi))
+
+    model_dir_original = modelo_estimativa.MODEL_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        modelo_estimativa.MODEL_DIR = tmp
+        try:
+            modelos = [ModeloEstimativaProdutividade('soja')]
+            if modelo_estimativa.SKLEARN_AVAILABLE:
+                treinado = ModeloEstimativaProdutividade('milho')
+                treinado.treinar(gerar_dados_exemplo())
+                modelos.append(treinado)
+        finally:
+            modelo_estimativa.MODEL_DIR = model_dir_original
+
+    for modelo in modelos:
+        lote = modelo.prever_lote(ndvi, gdd, 450)
+        for i in range(len(ndvi)):
+            if modelo.parametros is not None and np.isnan(ndvi[i]):
+                continue
+            individual = modelo.prever(ndvi[i], gdd[i], 450)
+            assert lote['metodo'][i] == individual['metodo']
+            assert np.isclose(lote['estimativa_ton_ha'][i], individual['estimativa_ton_ha'])
+            assert np.isclose(lote['intervalo_min'][i], individual['intervalo_confianca']['min'])
+            assert np.isclose(lote['intervalo_max'][i], individual['intervalo_confianca']['max'])
+        print(f"✅ {modelo.cultura}: {len(ndvi)} amostras conferem com prever")
+
+    try:
+        import pandas as pd
+    except ImportError:
+        return True
+
+    tabela = pd.DataFrame({'ndvi_mean': ndvi, 'gdd_total': gdd, 'precip_total': 450.0})
+    assert np.array_equal(modelos[-1].prever_lote(tabela)['estimativa_ton_ha'],
+                          modelos[-1].prever_lote(ndvi, gdd, 450)['estimativa_ton_ha'], equal_nan=True)
+
+    return True
+
+def testar_mapa_produtividade():
+    """Testa o mapa por pixel em blocos sobre .npy mapeado em memória"""
+
+    print("\n📊 Testando Mapa de Produtividade...")
+    print("-" * 40)
+
+    import time
+
+    rng = np.random.default_rng(5)
+    ndvi = rng.uniform(0.3, 0.95, (2000, 2000)).astype(np.float32)
+    ndvi[:10] = np.nan
+    zonas = np.searchsorted([0.5, 0.75], ndvi).astype(np.int16)
+    zonas[:10] = -1
+
+    modelo = ModeloEstimativaProdutividade('milho')
+    modelo.parametros = None
+
+    with tempfile.TemporaryDirectory() as tmp:
+        caminho_ndvi = os.path.join(tmp, 'ndvi.npy')
+        np.save(caminho_ndvi, ndvi)
+
+        inicio = time.perf_counter()
+        mapa = modelo.gerar_mapa_produtividade(
+            caminho_ndvi, zonas=zonas, area_pixel_ha=0.01,
+            saida=os.path.join(tmp, 'produtividade.npy'), pixels_por_bloco=500_000
+        )
+        duracao = time.perf_counter() - inicio
+
+        raster = np.load(os.path.join(tmp, 'produtividade.npy'))
+        amostra = rng.integers(10, 2000, (200, 2))
+        esperado = modelo.prever_lote(ndvi[amostra[:, 0], amostra[:, 1]])['estimativa_ton_ha']
+        assert np.allclose(raster[amostra[:, 0], amostra[:, 1]], esperado)
+        assert np.isnan(raster[:10]).all()
+
+        assert len(mapa['zonas']) == 3
+        assert mapa['total']['n_pixels'] == 1990 * 2000
+        assert np.isclose(sum(z['producao_ton'] for z in mapa['zonas']),
+                          mapa['total']['producao_ton'], rtol=1e-6)
+        assert np.isclose(mapa['total']['producao_ton'], np.nansum(raster) * 0.01, rtol=1e-4)
+        del raster, mapa
+
+    print(f"✅ 4 milhões de pixels em {duracao * 1000:.0f} ms")
+    return True
+
+def testar_artefato_json():
+    """Testa que o modelo salvo em JSON versionado é recarregado sem sklearn"""
+
+    print("\n📊 Testando Artefato JSON...")
+    print("-" * 40)
+
+    if not modelo_estimativa.SKLEARN_AVAILABLE:
+        print("⚠️  scikit-learn não instalado, treino não testado")
+        return True
+
+    import json
+
+    model_dir_original = modelo_estimativa.MODEL_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        modelo_estimativa.MODEL_DIR = tmp
+        try:
+            treinado = ModeloEstimativaProdutividade('trigo')
+            treinado.treinar(gerar_dados_exemplo())
+
+            caminho = treinado._get_model_path()
+            with open(caminho) as f:
+                artefato = json.load(f)
+            assert artefato['versao_formato'] == modelo_estimativa.FORMATO_ARTEFATO
+            assert len(artefato['coeficientes']) == len(artefato['features']) == 3
+
+            carregado = ModeloEstimativaProdutividade('trigo')
+            assert carregado.prever(0.7, 1700, 500) == treinado.prever(0.7, 1700, 500)
+
+            artefato['versao_formato'] = modelo_estimativa.FORMATO_ARTEFATO + 1
+            with open(caminho, 'w') as f:
+                json.dump(artefato, f)
+            assert ModeloEstimativaProdutividade('trigo').parametros is None
+        finally:
+            modelo_estimativa.MODEL_DIR = model_dir_original
+
+    print(f"✅ Artefato JSON com {len(artefato)} campos recarregado")
+    return True
+
+def testar_tempo_importacao():
+    """Testa que a predição não importa sklearn e cabe no orçamento de importação"""
+
+    print("\n📊 Testando Tempo de Importação...")
+    print("-" * 40)
+
+    import subprocess
+
+    # Orçamento (cumulativo, em microssegundos) para importar o módulo
+    orcamento_us = 500_000
+
+    script = (
+        "import sys, modelo_estimativa as m; "
+        "m.ModeloEstimativaProdutividade('milho').prever(0.75, 1800, 450); "
+        "print(sorted(n for n in sys.modules if n.split('.')[0] in ('sklearn', 'scipy')))"
+    )
+    processo = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', script],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        capture_output=True, text=True, check=True
+    )
+
+    assert processo.stdout.strip() == '[]', processo.stdout
+    cumulativo = next(
+        int(linha.split('|')[1])
+        for linha in processo.stderr.splitlines()
+        if linha.startswith('import time:') and linha.split('|')[2].strip() == 'modelo_estimativa'
+    )
+    assert cumulativo < orcamento_us, f"importação levou {cumulativo / 1000:.0f} ms"
+
+    print(f"✅ modelo_estimativa importado em {cumulativo / 1000:.0f} ms, sem sklearn")
+    return True
+
+def main():
+    resultados = [
+        ("Recarga do Servidor", testar_recarga_servidor()),
+        ("Predição em Lote", testar_prever_lote()),
+        ("Mapa de Produtividade", testar_mapa_produtividade()),
+        ("Artefato JSON", testar_artefato_json()),
+        ("Tempo de Importação", testar_tempo_importacao()),
+    ]
+
+    for nome, sucesso in resultados:
+        status = "✅ PASSOU" if sucesso else "❌ FALHOU"
+        print(f"{nome}: {status}")
+
+    return 0 if all(r[1] for r in resultados) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
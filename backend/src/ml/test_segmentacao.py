@@ -105,6 +105,86 @@ def testar_classificacao_zonas():
     
     return True
 
+def testar_poligonos_zonas():
+    """Testa a vetorização das zonas de manejo pelo contorno das regiões"""
+    
+    print("\n📊 Testando Polígonos das Zonas...")
+    print("-" * 40)
+    
+    import numpy as np
+    from shapely.geometry import shape
+    
+    # Talhão 200x200 com três faixas bem definidas e um buraco na faixa média
+    ndvi = np.full((200, 200), 0.55)
+    ndvi[:, :60] = 0.3
+    ndvi[:, 140:] = 0.8
+    ndvi[90:110, 90:110] = 0.85
+    historico_ndvi = [ndvi + np.random.uniform(-0.02, 0.02, ndvi.shape) for _ in range(3)]
+    
+    segmentador = SegmentadorTalhoes()
+    zonas = segmentador.classificar_zonas(historico_ndvi)
+    
+    for nome in ('low', 'medium', 'high'):
+        assert len(zonas[nome]) >= 1, f"Zona {nome} não encontrada"
+        for zona in zonas[nome]:
+            poligono = shape(zona['geometry'])
+            assert poligono.is_valid
+            # Vértices proporcionais ao contorno, não à quantidade de pixels
+            assert len(poligono.exterior.coords) < 50
+    
+    media = zonas['medium'][0]
+    assert abs(media['ndvi_medio'] - 0.55) < 0.01
+    assert len(shape(media['geometry']).interiors) == 1
+    assert abs(zonas['low'][0]['area'] - 60 * 200) == 0
+    
+    print(f"✅ Zonas vetorizadas")
+    for nome in ('low', 'medium', 'high'):
+        print(f"   {nome}: {len(zonas[nome])} polígono(s)")
+    
+    return True
+
+def testar_reducao_streaming():
+    """Testa a redução banda a banda do histórico NDVI (memmap + máscaras)"""
+    
+    print("\n📊 Testando Redução Streaming do Histórico...")
+    print("-" * 40)
+    
+    import tempfile
+    import numpy as np
+    from segmentacao import reduzir_historico_ndvi
+    
+    rng = np.random.default_rng(0)
+    pilha = rng.uniform(0.2, 0.9, (8, 60, 80)).astype(np.float32)
+    pilha[2, :10, :10] = np.nan      # falha de leitura
+    pilha[3, 20:30, :] = -9999       # nodata
+    nuvens = np.zeros(pilha.shape, dtype=bool)
+    nuvens[5, :, 40:] = True
+    nuvens[:, 0, 0] = True           # pixel sempre encoberto
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        caminho = os.path.join(tmp, 'historico.npy')
+        np.save(caminho, pilha)
+        media, variancia, contagem = reduzir_historico_ndvi(
+            caminho, nodata=-9999, mascaras=nuvens
+        )
+    
+    referencia = np.where(nuvens | (pilha == -9999), np.nan, pilha).astype(np.float64)
+    assert media.dtype == np.float32 and media.shape == (60, 80)
+    assert np.isnan(media[0, 0]) and contagem[0, 0] == 0
+    assert np.array_equal(contagem, np.sum(np.isfinite(referencia), axis=0))
+    assert np.allclose(media, np.nanmean(referencia, axis=0), atol=1e-5, equal_nan=True)
+    assert np.allclose(variancia, np.nanvar(referencia, axis=0), atol=1e-5, equal_nan=True)
+    
+    # Iterador (gerador) produz o mesmo resultado da pilha em memória
+    zonas_gerador = SegmentadorTalhoes().classificar_zonas(b for b in pilha[:2])
+    zonas_lista = SegmentadorTalhoes().classificar_zonas(list(pilha[:2]))
+    assert zonas_gerador == zonas_lista
+    
+    print(f"✅ Média/variância/contagem conferem com NumPy")
+    print(f"   Bandas: {pilha.shape[0]}  Pixels: {media.size}")
+    
+    return True
+
 def main():
     """Executa todos os testes"""
     
@@ -117,6 +197,8 @@ def main():
     resultados.append(("Watershed", testar_com_imagem_exemplo()))
     resultados.append(("Edge Detection", testar_edge_detection()))
     resultados.append(("Classificação Zonas", testar_classificacao_zonas()))
+    resultados.append(("Polígonos Zonas", testar_poligonos_zonas()))
+    resultados.append(("Redução Streaming", testar_reducao_streaming()))
     
     # Resumo
     print("\n" + "=" * 60)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, Float, DateTime, Date, Boolean, Text, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, String, Integer, Float, DateTime, Date, Boolean, Text, ForeignKey, UniqueConstraint, LargeBinary
 from sqlalchemy.dialects.postgresql import UUID, JSONB
 from sqlalchemy.orm import relationship
 from geoalchemy2 import Geometry
@@ -313,6 +313,50 @@ class DadosMeteorologicos(Base):
     
     __table_args__ = (UniqueConstraint('fazenda_id', 'talhao_id', 'data', name='uix_meteo_fazenda_talhao_data'),)
 
+class ResumoMeteorologicoDiario(Base):
+    __tablename__ = "resumo_meteorologico_diario"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True)
+    fazenda_id = Column(UUID(as_uuid=True), ForeignKey("fazendas.id", ondelete="CASCADE"), nullable=False)
+    data = Column(Date, nullable=False)
+    n_registros = Column(Integer, default=0)
+    n_temp_max = Column(Integer, default=0)
+    soma_temp_max = Column(Float, default=0)
+    max_temp_max = Column(Float)
+    n_temp_min = Column(Integer, default=0)
+    soma_temp_min = Column(Float, default=0)
+    min_temp_min = Column(Float)
+    n_temp_media = Column(Integer, default=0)
+    soma_temp_media = Column(Float, default=0)
+    soma_precipitacao = Column(Float, default=0)
+    n_umidade = Column(Integer, default=0)
+    soma_umidade = Column(Float, default=0)
+    updated_at = Column(DateTime, default="CURRENT_TIMESTAMP")
+    
+    __table_args__ = (UniqueConstraint('fazenda_id', 'data', name='uix_resumo_diario_fazenda_data'),)
+
+class ResumoMeteorologicoMensal(Base):
+    __tablename__ = "resumo_meteorologico_mensal"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True)
+    fazenda_id = Column(UUID(as_uuid=True), ForeignKey("fazendas.id", ondelete="CASCADE"), nullable=False)
+    mes = Column(Date, nullable=False)
+    n_registros = Column(Integer, default=0)
+    n_temp_max = Column(Integer, default=0)
+    soma_temp_max = Column(Float, default=0)
+    max_temp_max = Column(Float)
+    n_temp_min = Column(Integer, default=0)
+    soma_temp_min = Column(Float, default=0)
+    min_temp_min = Column(Float)
+    n_temp_media = Column(Integer, default=0)
+    soma_temp_media = Column(Float, default=0)
+    soma_precipitacao = Column(Float, default=0)
+    n_umidade = Column(Integer, default=0)
+    soma_umidade = Column(Float, default=0)
+    updated_at = Column(DateTime, default="CURRENT_TIMESTAMP")
+    
+    __table_args__ = (UniqueConstraint('fazenda_id', 'mes', name='uix_resumo_mensal_fazenda_mes'),)
+
 class PrevisaoTempo(Base):
     __tablename__ = "previsao_tempo"
     
@@ -329,6 +373,24 @@ class PrevisaoTempo(Base):
     icone = Column(String(50))
     vento_velocidade = Column(Float)
     created_at = Column(DateTime, default="CURRENT_TIMESTAMP")
+    
+    __table_args__ = (UniqueConstraint('fazenda_id', 'data_previsao', name='uix_previsao_fazenda_data'),)
+
+class ClimatologiaFazenda(Base):
+    __tablename__ = "climatologia_fazenda"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True)
+    fazenda_id = Column(UUID(as_uuid=True), ForeignKey("fazendas.id", ondelete="CASCADE"), nullable=False)
+    cultura = Column(String(100), nullable=False)
+    temperatura_base = Column(Float)
+    gdd_normal = Column(JSONB)
+    precipitacao_normal = Column(JSONB)
+    n_anos = Column(Integer)
+    data_inicio = Column(Date)
+    data_fim = Column(Date)
+    updated_at = Column(DateTime, default="CURRENT_TIMESTAMP")
+    
+    __table_args__ = (UniqueConstraint('fazenda_id', 'cultura', name='uix_climatologia_fazenda_cultura'),)
 
 class ImagemSatelite(Base):
     __tablename__ = "imagens_satelite"
@@ -356,6 +418,42 @@ class ImagemSatelite(Base):
     processado = Column(Boolean, default=False)
     created_at = Column(DateTime, default="CURRENT_TIMESTAMP")
 
+class UltimaImagemTalhao(Base):
+    __tablename__ = "ultima_imagem_talhao"
+    
+    talhao_id = Column(UUID(as_uuid=True), ForeignKey("talhoes.id", ondelete="CASCADE"), primary_key=True)
+    fazenda_id = Column(UUID(as_uuid=True), ForeignKey("fazendas.id", ondelete="CASCADE"), nullable=False)
+    safra_id = Column(UUID(as_uuid=True), ForeignKey("safras.id", ondelete="SET NULL"))
+    imagem_id = Column(UUID(as_uuid=True), ForeignKey("imagens_satelite.id", ondelete="CASCADE"), nullable=False)
+    data_imagem = Column(Date, nullable=False)
+    ndvi_mean = Column(Float)
+    ndre_mean = Column(Float)
+    msavi_mean = Column(Float)
+    status_saude = Column(String(20))
+    updated_at = Column(DateTime, default="CURRENT_TIMESTAMP")
+
+class SerieIndiceTalhao(Base):
+    __tablename__ = "series_indices_talhao"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True)
+    talhao_id = Column(UUID(as_uuid=True), ForeignKey("talhoes.id", ondelete="CASCADE"), nullable=False)
+    indice = Column(String(20), nullable=False)
+    data_base = Column(Date, nullable=False)
+    data_ultima = Column(Date, nullable=False)
+    n_pontos = Column(Integer, default=0)
+    offsets = Column(LargeBinary, nullable=False)
+    valores = Column(LargeBinary, nullable=False)
+    updated_at = Column(DateTime, default="CURRENT_TIMESTAMP")
+    
+    __table_args__ = (UniqueConstraint('talhao_id', 'indice', name='uix_serie_talhao_indice'),)
+
+class AgregadoPopulado(Base):
+    __tablename__ = "agregados_populados"
+    
+    agregado = Column(String(50), primary_key=True)
+    chave = Column(UUID(as_uuid=True), primary_key=True)
+    populado_em = Column(DateTime, default="CURRENT_TIMESTAMP")
+
 class ModeloML(Base):
     __tablename__ = "modelos_ml"
     
@@ -387,9 +485,58 @@ class PredicaoProdutividade(Base):
     confianca = Column(Float)
     produtividade_real = Column(Float)
     erro_absoluto = Column(Float)
+    contabilizado = Column(Boolean, default=False)
     data_predicao = Column(DateTime, default="CURRENT_TIMESTAMP")
     created_at = Column(DateTime, default="CURRENT_TIMESTAMP")
 
+class MetricaErroModelo(Base):
+    __tablename__ = "metricas_erro_modelo"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True)
+    escopo = Column(String(20), nullable=False)
+    chave = Column(String(150), nullable=False)
+    n = Column(Integer, default=0)
+    soma_erro_abs = Column(Float, default=0)
+    soma_erro_quadrado = Column(Float, default=0)
+    soma_erro_percentual = Column(Float, default=0)
+    n_percentual = Column(Integer, default=0)
+    media_real = Column(Float, default=0)
+    m2_real = Column(Float, default=0)
+    updated_at = Column(DateTime, default="CURRENT_TIMESTAMP")
+    
+    __table_args__ = (UniqueConstraint('escopo', 'chave', name='uix_metricas_erro_escopo_chave'),)
+
+class FeaturesProdutividade(Base):
+    __tablename__ = "features_produtividade"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True)
+    talhao_id = Column(UUID(as_uuid=True), ForeignKey("talhoes.id", ondelete="CASCADE"), nullable=False)
+    safra_id = Column(UUID(as_uuid=True), ForeignKey("safras.id", ondelete="CASCADE"), nullable=False)
+    n_imagens = Column(Integer, default=0)
+    n_ndvi = Column(Integer, default=0)
+    n_ndre = Column(Integer, default=0)
+    n_msavi = Column(Integer, default=0)
+    data_primeira_imagem = Column(Date)
+    data_ultima_imagem = Column(Date)
+    ndvi_medio = Column(Float)
+    ndvi_pico = Column(Float)
+    ndvi_integral = Column(Float)
+    ndvi_ultimo = Column(Float)
+    ndre_medio = Column(Float)
+    ndre_pico = Column(Float)
+    ndre_integral = Column(Float)
+    ndre_ultimo = Column(Float)
+    msavi_medio = Column(Float)
+    msavi_pico = Column(Float)
+    msavi_integral = Column(Float)
+    msavi_ultimo = Column(Float)
+    gdd_acumulado = Column(Float, default=0)
+    precipitacao_acumulada = Column(Float, default=0)
+    data_ultimo_clima = Column(Date)
+    updated_at = Column(DateTime, default="CURRENT_TIMESTAMP")
+    
+    __table_args__ = (UniqueConstraint('talhao_id', 'safra_id', name='uix_features_talhao_safra'),)
+
 class Delineamento(Base):
     __tablename__ = "delineamentos"
     
@@ -402,6 +549,7 @@ class Delineamento(Base):
     indice_base = Column(String(20), default="ndvi")
     geom = Column(Geometry('MULTIPOLYGON', 4326))
     estatisticas_zonas = Column(JSONB)
+    fonte = Column(String(50))
     processado = Column(Boolean, default=False)
     url_visualizacao = Column(Text)
     created_at = Column(DateTime, default="CURRENT_TIMESTAMP")
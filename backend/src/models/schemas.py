@@ -513,6 +513,32 @@ class PredicaoProdutividade(PredicaoProdutividadeBase):
     class Config:
         from_attributes = True
 
+class FeaturesProdutividade(BaseModel):
+    id: UUID
+    talhao_id: UUID
+    safra_id: UUID
+    n_imagens: int = 0
+    n_ndvi: Optional[int] = None
+    n_ndre: Optional[int] = None
+    n_msavi: Optional[int] = None
+    data_primeira_imagem: Optional[date] = None
+    data_ultima_imagem: Optional[date] = None
+    ndvi_medio: Optional[float] = None
+    ndvi_pico: Optional[float] = None
+    ndvi_integral: Optional[float] = None
+    ndre_medio: Optional[float] = None
+    ndre_pico: Optional[float] = None
+    ndre_integral: Optional[float] = None
+    msavi_medio: Optional[float] = None
+    msavi_pico: Optional[float] = None
+    msavi_integral: Optional[float] = None
+    gdd_acumulado: Optional[float] = None
+    precipitacao_acumulada: Optional[float] = None
+    data_ultimo_clima: Optional[date] = None
+
+    class Config:
+        from_attributes = True
+
 # Delineamento Schemas
 class DelineamentoBase(BaseModel):
     talhao_id: UUID
@@ -528,6 +554,7 @@ class DelineamentoCreate(DelineamentoBase):
 
 class Delineamento(DelineamentoBase):
     id: UUID
+    fonte: Optional[str] = None
     processado: bool = False
     url_visualizacao: Optional[str] = None
     created_at: datetime
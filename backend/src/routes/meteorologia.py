@@ -1,9 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, UploadFile, File
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import Date, cast, func, literal
 from typing import List, Optional
 from uuid import UUID
 from datetime import date, datetime, timedelta
+import numpy as np
 from src.config.database import get_db
 from src.models import models, schemas
 
@@ -32,13 +33,14 @@ def listar_dados_meteorologicos(
 
 @router.post("/dados", response_model=schemas.DadosMeteorologicos)
 def criar_dado_meteorologico(dado: schemas.DadosMeteorologicosCreate, db: Session = Depends(get_db)):
-    # Calcular GDD se temperaturas foram fornecidas
-    if dado.temp_max and dado.temp_min:
-        t_base = 10.0  # Temperatura base para cálculo
-        t_max_efetiva = min(dado.temp_max, 30.0)  # Limite superior
-        t_min_efetiva = max(dado.temp_min, t_base)  # Limite inferior
-        gdd_dia = ((t_max_efetiva + t_min_efetiva) / 2) - t_base
-        dado.gdd_dia = max(0, gdd_dia)
+    # Calcular GDD se temperaturas foram fornecidas (parâmetros da cultura do talhão)
+    if dado.temp_max is not None and dado.temp_min is not None:
+        from src.utils import graus_dia
+        talhao = db.get(models.Talhao, dado.talhao_id) if dado.talhao_id else None
+        gdd_dia = graus_dia.calcular_gdd(
+            [dado.temp_max], [dado.temp_min], cultura=talhao.cultura if talhao else None
+        )
+        dado.gdd_dia = round(float(gdd_dia[0]), 2)
     
     db_dado = models.DadosMeteorologicos(**dado.dict())
     db.add(db_dado)
@@ -46,68 +48,228 @@ def criar_dado_meteorologico(dado: schemas.DadosMeteorologicosCreate, db: Sessio
     db.refresh(db_dado)
     
     # Atualizar GDD acumulado
-    atualizar_gdd_acumulado(db, db_dado.fazenda_id, db_dado.talhao_id)
+    atualizar_gdd_acumulado(db, db_dado.fazenda_id, db_dado.talhao_id, a_partir_de=db_dado.data)
+    
+    from src.utils import resumo_meteorologico
+    resumo_meteorologico.atualizar(db, db_dado.fazenda_id, db_dado.data, db_dado.data)
+    
+    from src.utils import feature_store
+    feature_store.registrar_clima(db, db_dado)
     
     return db_dado
 
+# Agrupamentos da série de GDD -> unidade do date_trunc
+AGRUPAMENTOS_GDD = {"semana": "week", "mes": "month"}
+
+def _agrupar_gdd(datas: np.ndarray, gdd: np.ndarray, agrupamento: str):
+    """Soma do GDD por semana (início na segunda, como date_trunc) ou mês"""
+    dias = datas.astype("datetime64[D]")
+    if agrupamento == "semana":
+        numero = dias.astype(np.int64)
+        periodos = (numero - (numero + 3) % 7).astype("datetime64[D]")
+    else:
+        periodos = dias.astype("datetime64[M]").astype("datetime64[D]")
+    
+    inicios = np.flatnonzero(np.r_[True, periodos[1:] != periodos[:-1]])
+    soma = np.add.reduceat(np.nan_to_num(gdd), inicios) if gdd.size else gdd
+    contagem = np.diff(np.r_[inicios, gdd.size])
+    return periodos[inicios], soma, contagem
+
 @router.get("/gdd-acumulado")
 def gdd_acumulado(
     fazenda_id: UUID,
     talhao_id: Optional[UUID] = None,
     safra_id: Optional[UUID] = None,
+    cultura: Optional[str] = None,
+    metodo: Optional[str] = None,
+    agrupamento: Optional[str] = Query(None, description="semana ou mes"),
     db: Session = Depends(get_db)
 ):
-    """Retorna o GDD acumulado para o período"""
-    query = db.query(models.DadosMeteorologicos).filter(
-        models.DadosMeteorologicos.fazenda_id == fazenda_id
-    )
+    """
+    Retorna o GDD acumulado para o período. A soma acumulada sai do banco
+    (SUM() OVER); com cultura ou método, o GDD é recalculado das temperaturas
+    com os parâmetros da cultura. `agrupamento` reduz a série a semanas ou meses.
+    """
+    if agrupamento and agrupamento not in AGRUPAMENTOS_GDD:
+        raise HTTPException(status_code=400, detail=f"Agrupamento inválido. Use: {list(AGRUPAMENTOS_GDD)}")
+    
+    DM = models.DadosMeteorologicos
+    filtros = [DM.fazenda_id == fazenda_id]
     if talhao_id:
-        query = query.filter(models.DadosMeteorologicos.talhao_id == talhao_id)
+        filtros.append(DM.talhao_id == talhao_id)
     
     # Se tiver safra, usar data de início da safra
     if safra_id:
         safra = db.query(models.Safra).filter(models.Safra.id == safra_id).first()
         if safra and safra.data_inicio:
-            query = query.filter(models.DadosMeteorologicos.data >= safra.data_inicio)
+            filtros.append(DM.data >= safra.data_inicio)
     
-    dados = query.order_by(models.DadosMeteorologicos.data).all()
+    gdd_dia = func.coalesce(DM.gdd_dia, 0)
     
-    gdd_acumulado = 0
-    serie_gdd = []
+    if cultura or metodo:
+        from src.utils import graus_dia
+        linhas = db.query(DM.data, DM.temp_max, DM.temp_min).filter(*filtros).order_by(DM.data, DM.id).all()
+        colunas = list(zip(*linhas)) or [(), (), ()]
+        datas = np.asarray(colunas[0], dtype="datetime64[D]")
+        try:
+            gdd = graus_dia.calcular_gdd(colunas[1], colunas[2], cultura=cultura, datas=datas, metodo=metodo)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        gdd = np.round(gdd, 2)
+        if agrupamento:
+            datas, gdd, contagem = _agrupar_gdd(datas, gdd, agrupamento)
+            gdd = np.round(gdd, 2)
+        linhas = zip(
+            datas.tolist(),
+            np.where(np.isnan(gdd), None, gdd).tolist(),
+            np.round(np.cumsum(np.nan_to_num(gdd)), 2).tolist(),
+            contagem.tolist() if agrupamento else [1] * len(gdd)
+        )
+    elif agrupamento:
+        periodo = cast(func.date_trunc(AGRUPAMENTOS_GDD[agrupamento], DM.data), Date).label("periodo")
+        soma = func.sum(gdd_dia)
+        linhas = db.query(
+            periodo,
+            soma,
+            func.sum(soma).over(order_by=periodo),
+            func.count(DM.id)
+        ).filter(*filtros).group_by(periodo).order_by(periodo).all()
+    else:
+        linhas = db.query(
+            DM.data,
+            DM.gdd_dia,
+            func.sum(gdd_dia).over(order_by=(DM.data, DM.id)),
+            literal(1)
+        ).filter(*filtros).order_by(DM.data, DM.id).all()
     
-    for dado in dados:
-        if dado.gdd_dia:
-            gdd_acumulado += dado.gdd_dia
-        serie_gdd.append({
-            "data": dado.data.isoformat(),
-            "gdd_dia": dado.gdd_dia,
-            "gdd_acumulado": gdd_acumulado
-        })
+    campo = "gdd_periodo" if agrupamento else "gdd_dia"
+    serie_gdd = []
+    dias_monitorados = 0
+    for data, gdd_periodo, total, dias in linhas:
+        item = {
+            "data": data.isoformat(),
+            campo: float(gdd_periodo) if gdd_periodo is not None else None,
+            "gdd_acumulado": float(total or 0)
+        }
+        if agrupamento:
+            item["dias"] = dias
+        serie_gdd.append(item)
+        dias_monitorados += dias
     
     return {
-        "gdd_acumulado": gdd_acumulado,
-        "dias_monitorados": len(dados),
+        "gdd_acumulado": serie_gdd[-1]["gdd_acumulado"] if serie_gdd else 0,
+        "dias_monitorados": dias_monitorados,
+        "agrupamento": agrupamento,
         "serie_temporal": serie_gdd
     }
 
-def atualizar_gdd_acumulado(db: Session, fazenda_id: UUID, talhao_id: Optional[UUID] = None):
-    """Atualiza o GDD acumulado para todos os registros após uma nova inserção"""
-    query = db.query(models.DadosMeteorologicos).filter(
-        models.DadosMeteorologicos.fazenda_id == fazenda_id
-    )
+def atualizar_gdd_acumulado(
+    db: Session,
+    fazenda_id: UUID,
+    talhao_id: Optional[UUID] = None,
+    a_partir_de: Optional[date] = None
+):
+    """
+    Atualiza o GDD acumulado dos registros após uma nova inserção com um único
+    UPDATE (soma acumulada por função de janela); só regrava de `a_partir_de` em diante.
+    """
+    DM = models.DadosMeteorologicos
+    filtros = [DM.fazenda_id == fazenda_id]
     if talhao_id:
-        query = query.filter(models.DadosMeteorologicos.talhao_id == talhao_id)
+        filtros.append(DM.talhao_id == talhao_id)
     
-    dados = query.order_by(models.DadosMeteorologicos.data).all()
+    acumulado = db.query(
+        DM.id.label("id"),
+        func.sum(func.coalesce(DM.gdd_dia, 0)).over(order_by=(DM.data, DM.id)).label("gdd_acumulado")
+    ).filter(*filtros).subquery()
     
-    gdd_acumulado = 0
-    for dado in dados:
-        if dado.gdd_dia:
-            gdd_acumulado += dado.gdd_dia
-        dado.gdd_acumulado = gdd_acumulado
+    query = db.query(DM).filter(DM.id == acumulado.c.id)
+    if a_partir_de:
+        query = query.filter(DM.data >= a_partir_de)
+    query.update({DM.gdd_acumulado: acumulado.c.gdd_acumulado}, synchronize_session=False)
     
     db.commit()
 
+# ==================== HISTÓRICO E CLIMATOLOGIA ====================
+@router.post("/historico/importar")
+def importar_historico(
+    fazenda_id: UUID,
+    arquivo: UploadFile = File(...),
+    fonte: str = "historico",
+    cultura: Optional[str] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Importa série diária histórica (CSV ERA5/INMET) sem sobrescrever dias
+    existentes; o GDD usa a cultura informada ou a principal da fazenda
+    """
+    from src.utils import climatologia
+    
+    fazenda = db.query(models.Fazenda).filter(models.Fazenda.id == fazenda_id).first()
+    if not fazenda:
+        raise HTTPException(status_code=404, detail="Fazenda não encontrada")
+    
+    try:
+        serie = climatologia.ler_csv(arquivo.file)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    cultura = cultura or climatologia.cultura_principal(db, fazenda_id)
+    resultado = climatologia.importar_historico(db, fazenda_id, serie, fonte=fonte, cultura=cultura)
+    if resultado["importados"]:
+        from src.utils import resumo_meteorologico
+        atualizar_gdd_acumulado(db, fazenda_id)
+        resumo_meteorologico.atualizar(db, fazenda_id, serie["data"].min().item(), serie["data"].max().item())
+    return resultado
+
+@router.get("/gdd-projecao")
+def gdd_projecao(
+    fazenda_id: UUID,
+    talhao_id: Optional[UUID] = None,
+    cultura: Optional[str] = None,
+    data_inicio: Optional[date] = None,
+    db: Session = Depends(get_db)
+):
+    """GDD acumulado da cultura desde o plantio e data prevista de maturação pela climatologia"""
+    from src.utils import climatologia
+    
+    if talhao_id:
+        talhao = db.query(models.Talhao).filter(models.Talhao.id == talhao_id).first()
+        if not talhao:
+            raise HTTPException(status_code=404, detail="Talhão não encontrado")
+        cultura = cultura or talhao.cultura
+        data_inicio = data_inicio or talhao.data_plantio
+    
+    if not cultura or not data_inicio:
+        raise HTTPException(status_code=400, detail="Informe cultura e data_inicio (ou um talhão com plantio)")
+    cultura = cultura.lower()
+    
+    hoje = date.today()
+    resultado = climatologia.gdd_ate_data(db, fazenda_id, cultura, data_inicio, hoje)
+    gdd_requerido = climatologia.GDD_MATURACAO.get(cultura)
+    
+    data_maturacao, dias_restantes = None, None
+    normal = resultado["climatologia"]
+    if normal is not None and gdd_requerido:
+        data_maturacao, dias_restantes = climatologia.projetar_maturacao(
+            normal.gdd_normal, resultado["gdd_acumulado"], gdd_requerido, hoje
+        )
+    
+    return {
+        "cultura": cultura,
+        "temperatura_base": climatologia.temperatura_base(cultura),
+        "data_inicio": data_inicio,
+        "gdd_acumulado": resultado["gdd_acumulado"],
+        "dias_observados": resultado["dias_observados"],
+        "dias_climatologia": resultado["dias_climatologia"],
+        "gdd_requerido": gdd_requerido,
+        "gdd_restante": max(gdd_requerido - resultado["gdd_acumulado"], 0) if gdd_requerido else None,
+        "data_maturacao_prevista": data_maturacao,
+        "dias_restantes": dias_restantes,
+        "anos_climatologia": normal.n_anos if normal is not None else 0
+    }
+
 # ==================== PREVISÃO DO TEMPO ====================
 @router.get("/previsao", response_model=List[schemas.PrevisaoTempo])
 def obter_previsao(
@@ -115,45 +277,42 @@ def obter_previsao(
     dias: int = 7,
     db: Session = Depends(get_db)
 ):
-    """Obtém previsão do tempo para os próximos dias"""
-    # Verificar se já temos previsão atualizada
+    """Obtém previsão do tempo para os próximos dias (atualizada pelo job periódico)"""
     hoje = date.today()
-    previsao_existente = db.query(models.PrevisaoTempo).filter(
+    query = db.query(models.PrevisaoTempo).filter(
         models.PrevisaoTempo.fazenda_id == fazenda_id,
         models.PrevisaoTempo.data_previsao >= hoje
-    ).order_by(models.PrevisaoTempo.data_previsao).all()
+    ).order_by(models.PrevisaoTempo.data_previsao)
     
-    if len(previsao_existente) >= dias:
-        return previsao_existente[:dias]
+    previsao_existente = query.limit(dias).all()
+    if previsao_existente:
+        return previsao_existente
     
-    # Buscar nova previsão da API externa
-    from src.utils.weather_service import WeatherService
-    weather_service = WeatherService()
+    # Fazenda ainda não coberta pelo job: buscar agora
+    from anyio import from_thread
+    from src.utils import atualizacao_previsao
+    from src.utils.weather_service import obter_weather_service
+    weather_service = obter_weather_service()
     
     fazenda = db.query(models.Fazenda).filter(models.Fazenda.id == fazenda_id).first()
     if not fazenda or not fazenda.latitude or not fazenda.longitude:
         raise HTTPException(status_code=400, detail="Fazenda sem coordenadas cadastradas")
     
-    previsao = weather_service.obter_previsao(
-        lat=fazenda.latitude,
-        lon=fazenda.longitude,
-        dias=dias
+    # Rota síncrona (threadpool): a chamada assíncrona roda no loop da aplicação
+    previsao = from_thread.run(
+        weather_service.obter_previsao,
+        fazenda.latitude,
+        fazenda.longitude,
+        atualizacao_previsao.DIAS_PREVISAO
+    )
+    previsao = atualizacao_previsao.descartar_simuladas(previsao)
+    if not previsao:
+        raise HTTPException(status_code=503, detail="Previsão do tempo indisponível (API não configurada ou fora do ar)")
+    atualizacao_previsao.gravar_previsoes(
+        db, atualizacao_previsao.linhas_previsao(fazenda_id, previsao)
     )
     
-    # Salvar previsão no banco
-    for dia in previsao:
-        db_previsao = models.PrevisaoTempo(
-            fazenda_id=fazenda_id,
-            **dia
-        )
-        db.add(db_previsao)
-    
-    db.commit()
-    
-    return db.query(models.PrevisaoTempo).filter(
-        models.PrevisaoTempo.fazenda_id == fazenda_id,
-        models.PrevisaoTempo.data_previsao >= hoje
-    ).order_by(models.PrevisaoTempo.data_previsao).all()[:dias]
+    return query.limit(dias).all()
 
 @router.get("/clima-atual")
 def clima_atual(fazenda_id: UUID, db: Session = Depends(get_db)):
@@ -162,12 +321,14 @@ def clima_atual(fazenda_id: UUID, db: Session = Depends(get_db)):
     if not fazenda or not fazenda.latitude or not fazenda.longitude:
         raise HTTPException(status_code=400, detail="Fazenda sem coordenadas cadastradas")
     
-    from src.utils.weather_service import WeatherService
-    weather_service = WeatherService()
+    from anyio import from_thread
+    from src.utils.weather_service import obter_weather_service
+    weather_service = obter_weather_service()
     
-    return weather_service.obter_clima_atual(
-        lat=fazenda.latitude,
-        lon=fazenda.longitude
+    return from_thread.run(
+        weather_service.obter_clima_atual,
+        fazenda.latitude,
+        fazenda.longitude
     )
 
 # ==================== RESUMO ====================
@@ -177,33 +338,24 @@ def resumo_meteorologico(
     dias: int = 30,
     db: Session = Depends(get_db)
 ):
-    """Resumo dos dados meteorológicos dos últimos dias"""
-    data_inicio = date.today() - timedelta(days=dias)
-    
-    query = db.query(
-        func.avg(models.DadosMeteorologicos.temp_max).label('temp_max_media'),
-        func.avg(models.DadosMeteorologicos.temp_min).label('temp_min_media'),
-        func.avg(models.DadosMeteorologicos.temp_media).label('temp_media'),
-        func.sum(models.DadosMeteorologicos.precipitacao).label('precipitacao_total'),
-        func.avg(models.DadosMeteorologicos.umidade_media).label('umidade_media'),
-        func.max(models.DadosMeteorologicos.temp_max).label('temp_max_abs'),
-        func.min(models.DadosMeteorologicos.temp_min).label('temp_min_abs')
-    ).filter(
-        models.DadosMeteorologicos.fazenda_id == fazenda_id,
-        models.DadosMeteorologicos.data >= data_inicio
-    )
+    """Resumo dos dados meteorológicos dos últimos dias (a partir dos resumos pré-agregados)"""
+    from src.utils import resumo_meteorologico as resumos
+    
+    resumos.garantir(db, fazenda_id)
+    total = resumos.resumir(db, fazenda_id, date.today() - timedelta(days=dias))
     
-    resultado = query.first()
+    def media(soma, n):
+        return round(total[soma] / total[n], 1) if total[n] else None
     
     return {
         "periodo_dias": dias,
         "temperatura": {
-            "media_maxima": round(resultado.temp_max_media, 1) if resultado.temp_max_media else None,
-            "media_minima": round(resultado.temp_min_media, 1) if resultado.temp_min_media else None,
-            "media": round(resultado.temp_media, 1) if resultado.temp_media else None,
-            "maxima_absoluta": resultado.temp_max_abs,
-            "minima_absoluta": resultado.temp_min_abs
+            "media_maxima": media("soma_temp_max", "n_temp_max"),
+            "media_minima": media("soma_temp_min", "n_temp_min"),
+            "media": media("soma_temp_media", "n_temp_media"),
+            "maxima_absoluta": total["max_temp_max"],
+            "minima_absoluta": total["min_temp_min"]
         },
-        "precipitacao_total": round(resultado.precipitacao_total, 1) if resultado.precipitacao_total else 0,
-        "umidade_media": round(resultado.umidade_media, 1) if resultado.umidade_media else None
+        "precipitacao_total": round(total["soma_precipitacao"], 1) if total["soma_precipitacao"] else 0,
+        "umidade_media": media("soma_umidade", "n_umidade")
     }
@@ -6,6 +6,7 @@ from datetime import date, datetime, timedelta
 from src.config.database import get_db
 from src.models import models, schemas
 from src.utils.gee_service import GEEService
+from src.utils import feature_store, saude_talhoes, series_indices
 
 router = APIRouter(prefix="/api/v1/monitoramento", tags=["monitoramento"])
 
@@ -39,6 +40,10 @@ def criar_imagem(imagem: schemas.ImagemSateliteCreate, db: Session = Depends(get
     db.add(db_imagem)
     db.commit()
     db.refresh(db_imagem)
+    
+    saude_talhoes.registrar_imagem(db, db_imagem)
+    series_indices.registrar_imagem(db, db_imagem)
+    feature_store.registrar_imagem(db, db_imagem)
     return db_imagem
 
 @router.get("/talhoes/{talhao_id}/serie-temporal")
@@ -49,24 +54,9 @@ def serie_temporal_indices(
     data_fim: Optional[date] = None,
     db: Session = Depends(get_db)
 ):
-    query = db.query(models.ImagemSatelite).filter(
-        models.ImagemSatelite.talhao_id == talhao_id
-    )
-    if data_inicio:
-        query = query.filter(models.ImagemSatelite.data_imagem >= data_inicio)
-    if data_fim:
-        query = query.filter(models.ImagemSatelite.data_imagem <= data_fim)
-    
-    imagens = query.order_by(models.ImagemSatelite.data_imagem).all()
-    
-    if indice == "ndvi":
-        serie = [{"data": i.data_imagem.isoformat(), "valor": i.ndvi_mean} for i in imagens if i.ndvi_mean]
-    elif indice == "ndre":
-        serie = [{"data": i.data_imagem.isoformat(), "valor": i.ndre_mean} for i in imagens if i.ndre_mean]
-    elif indice == "msavi":
-        serie = [{"data": i.data_imagem.isoformat(), "valor": i.msavi_mean} for i in imagens if i.msavi_mean]
-    else:
-        serie = []
+    # Série compacta do talhão: uma linha lida e fatiada pelo intervalo
+    dias, valores = series_indices.obter_serie(db, talhao_id, indice, data_inicio, data_fim)
+    serie = series_indices.serie_json(dias, valores)
     
     return {"indice": indice, "talhao_id": str(talhao_id), "dados": serie}
 
@@ -98,6 +88,10 @@ def processar_imagem_gee(talhao_id: UUID, data_imagem: date, db: Session = Depen
     db.commit()
     db.refresh(imagem)
     
+    saude_talhoes.registrar_imagem(db, imagem)
+    series_indices.registrar_imagem(db, imagem)
+    feature_store.registrar_imagem(db, imagem)
+    
     return {"sucesso": True, "imagem_id": str(imagem.id), "resultado": resultado}
 
 # ==================== MAP TILES ====================
@@ -144,39 +138,25 @@ def dashboard_monitoramento(
     safra_id: Optional[UUID] = None,
     db: Session = Depends(get_db)
 ):
-    # Talhões por status de saúde (baseado no último NDVI)
-    from sqlalchemy import func, desc
-    
-    # Subquery para última imagem de cada talhão
-    ultimas_imagens = db.query(
-        models.ImagemSatelite.talhao_id,
-        func.max(models.ImagemSatelite.data_imagem).label('max_data')
-    ).group_by(models.ImagemSatelite.talhao_id).subquery()
-    
-    query_imagens = db.query(models.ImagemSatelite).join(
-        ultimas_imagens,
-        (models.ImagemSatelite.talhao_id == ultimas_imagens.c.talhao_id) &
-        (models.ImagemSatelite.data_imagem == ultimas_imagens.c.max_data)
-    )
-    
-    imagens = query_imagens.all()
+    # Talhões por status de saúde (última imagem de cada talhão, mantida na ingestão)
+    saude_talhoes.garantir(db, fazenda_id)
+    contagens = saude_talhoes.contar_status(db, fazenda_id, safra_id)
     
-    saudaveis = sum(1 for i in imagens if i.ndvi_mean and i.ndvi_mean > 0.6)
-    atencao = sum(1 for i in imagens if i.ndvi_mean and 0.3 <= i.ndvi_mean <= 0.6)
-    criticos = sum(1 for i in imagens if i.ndvi_mean and i.ndvi_mean < 0.3)
+    ultimas = saude_talhoes.ultimas_atualizacoes(db, fazenda_id, safra_id)
     
     return {
-        "talhoes_saudaveis": saudaveis,
-        "talhoes_atencao": atencao,
-        "talhoes_criticos": criticos,
+        "talhoes_saudaveis": contagens["saudavel"],
+        "talhoes_atencao": contagens["atencao"],
+        "talhoes_criticos": contagens["critico"],
         "ultimas_atualizacoes": [
             {
                 "talhao_id": str(i.talhao_id),
                 "data": i.data_imagem.isoformat(),
                 "ndvi": i.ndvi_mean,
                 "ndre": i.ndre_mean,
-                "msavi": i.msavi_mean
+                "msavi": i.msavi_mean,
+                "status_saude": i.status_saude
             }
-            for i in imagens[:10]
+            for i in ultimas
         ]
     }
@@ -1,14 +1,24 @@
+import json
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from itertools import groupby
 from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import FileResponse
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import and_, func, insert, text
+from geoalchemy2.shape import from_shape
 from typing import List, Optional, Dict, Any
-from uuid import UUID
-from datetime import date
+from uuid import UUID, uuid4
+from datetime import date, datetime
 from src.config.database import get_db
 from src.models import models, schemas
 
 router = APIRouter(prefix="/api/v1/produtividade", tags=["produtividade"])
 
+# Variabilidade: imagens por página e rasters buscados em paralelo no GEE
+MAX_IMAGENS_VARIABILIDADE = 200
+CONCORRENCIA_GEE = 4
+
 # ==================== PREDIÇÕES ====================
 @router.get("/predicoes", response_model=List[schemas.PredicaoProdutividade])
 def listar_predicoes(
@@ -39,36 +49,35 @@ def prever_produtividade_ml(talhao_id: UUID, db: Session = Depends(get_db)):
     if not talhao:
         raise HTTPException(status_code=404, detail="Talhão não encontrado")
     
-    # Obter dados para predição
-    ultima_imagem = db.query(models.ImagemSatelite).filter(
-        models.ImagemSatelite.talhao_id == talhao_id
-    ).order_by(models.ImagemSatelite.data_imagem.desc()).first()
-    
-    ultimo_dado_meteo = db.query(models.DadosMeteorologicos).filter(
-        models.DadosMeteorologicos.talhao_id == talhao_id
-    ).order_by(models.DadosMeteorologicos.data.desc()).first()
+    # Features materializadas do talhão na safra atual
+    from src.utils import feature_store
+    features = feature_store.vetor_features(feature_store.obter_features(db, talhao), talhao)
     
-    # Simular predição ML
+    # Modelo treinado da fazenda/cultura (ou fórmula de referência)
     from src.utils.ml_service import MLService
     ml_service = MLService()
+    ml_service.usar_modelo(db, talhao.fazenda_id, talhao.cultura)
     
     resultado = ml_service.prever_produtividade({
-        "ndvi": ultima_imagem.ndvi_mean if ultima_imagem else 0.5,
-        "ndre": ultima_imagem.ndre_mean if ultima_imagem else 0.4,
-        "msavi": ultima_imagem.msavi_mean if ultima_imagem else 0.3,
-        "gdd": ultimo_dado_meteo.gdd_acumulado if ultimo_dado_meteo else 1000,
+        "ndvi": features["ndvi_medio"],
+        "ndre": features["ndre_medio"],
+        "msavi": features["msavi_medio"],
+        "gdd": features["gdd_acumulado"] or None,
+        "precipitacao": features["precipitacao_acumulada"] or None,
         "area": talhao.area_hectares,
         "cultura": talhao.cultura
     })
     
     # Salvar predição
     predicao = models.PredicaoProdutividade(
+        modelo_id=ml_service.modelo_id,
         talhao_id=talhao_id,
         safra_id=talhao.safra_id,
-        ndvi_medio=ultima_imagem.ndvi_mean if ultima_imagem else None,
-        ndre_medio=ultima_imagem.ndre_mean if ultima_imagem else None,
-        msavi_medio=ultima_imagem.msavi_mean if ultima_imagem else None,
-        gdd_acumulado=ultimo_dado_meteo.gdd_acumulado if ultimo_dado_meteo else None,
+        ndvi_medio=features["ndvi_medio"],
+        ndre_medio=features["ndre_medio"],
+        msavi_medio=features["msavi_medio"],
+        gdd_acumulado=features["gdd_acumulado"],
+        precipitacao_acumulada=features["precipitacao_acumulada"],
         produtividade_predita=resultado["produtividade"],
         confianca=resultado["confianca"]
     )
@@ -81,9 +90,131 @@ def prever_produtividade_ml(talhao_id: UUID, db: Session = Depends(get_db)):
         "predicao_id": str(predicao.id),
         "produtividade_predita": resultado["produtividade"],
         "confianca": resultado["confianca"],
+        "metodo": resultado["metodo"],
         "unidade": "kg/ha"
     }
 
+@router.post("/fazendas/{fazenda_id}/prever")
+def prever_produtividade_fazenda(
+    fazenda_id: UUID,
+    safra_id: Optional[UUID] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Executa predição para todos os talhões da fazenda (ou da safra) de uma vez.
+
+    As entradas vêm de uma consulta (talhões + feature store; linhas
+    faltantes calculadas em lote por feature_store.recalcular_lote), a predição é
+    uma chamada vetorizada por cultura e as predições são gravadas num único INSERT.
+    """
+    from src.utils import feature_store
+    from src.utils.ml_service import MLService
+
+    query = db.query(models.Talhao, models.FeaturesProdutividade).outerjoin(
+        models.FeaturesProdutividade,
+        and_(
+            models.FeaturesProdutividade.talhao_id == models.Talhao.id,
+            models.FeaturesProdutividade.safra_id == models.Talhao.safra_id
+        )
+    ).filter(models.Talhao.fazenda_id == fazenda_id)
+    if safra_id:
+        query = query.filter(models.Talhao.safra_id == safra_id)
+
+    linhas = query.all()
+    if not linhas:
+        raise HTTPException(status_code=404, detail="Nenhum talhão encontrado")
+
+    # Talhões ainda sem linha na feature store: calculadas todas de uma vez
+    if feature_store.recalcular_lote(db, [talhao for talhao, f in linhas if f is None]):
+        linhas = query.all()
+    talhoes = [talhao for talhao, _ in linhas]
+    features = [feature_store.vetor_features(f, talhao) for talhao, f in linhas]
+
+    # Uma chamada vetorizada por cultura, cada uma com o modelo da cultura
+    produtividades = np.zeros(len(talhoes))
+    confiancas = np.zeros(len(talhoes))
+    modelos_ids = [None] * len(talhoes)
+    for cultura in {t.cultura for t in talhoes}:
+        indices = [i for i, t in enumerate(talhoes) if t.cultura == cultura]
+        ml_service = MLService()
+        ml_service.usar_modelo(db, fazenda_id, cultura)
+
+        resultado = ml_service.prever_produtividade_lote({
+            "ndvi": [features[i]["ndvi_medio"] for i in indices],
+            "ndre": [features[i]["ndre_medio"] for i in indices],
+            "msavi": [features[i]["msavi_medio"] for i in indices],
+            "gdd": [features[i]["gdd_acumulado"] or None for i in indices],
+            "precipitacao": [features[i]["precipitacao_acumulada"] or None for i in indices],
+            "area": [talhoes[i].area_hectares for i in indices],
+            "cultura": [cultura] * len(indices)
+        })
+        produtividades[indices] = resultado["produtividade"]
+        confiancas[indices] = resultado["confianca"]
+        for i in indices:
+            modelos_ids[i] = ml_service.modelo_id
+
+    agora = datetime.utcnow()
+    predicoes = [
+        {
+            "id": uuid4(),
+            "modelo_id": modelo_id,
+            "talhao_id": talhao.id,
+            "safra_id": talhao.safra_id,
+            "ndvi_medio": f["ndvi_medio"],
+            "ndre_medio": f["ndre_medio"],
+            "msavi_medio": f["msavi_medio"],
+            "gdd_acumulado": f["gdd_acumulado"],
+            "precipitacao_acumulada": f["precipitacao_acumulada"],
+            "produtividade_predita": float(produtividade),
+            "confianca": float(confianca),
+            "data_predicao": agora,
+            "created_at": agora
+        }
+        for talhao, f, produtividade, confianca, modelo_id in zip(
+            talhoes, features, produtividades, confiancas, modelos_ids
+        )
+    ]
+    db.execute(insert(models.PredicaoProdutividade), predicoes)
+    db.commit()
+
+    return {
+        "total": len(predicoes),
+        "predicoes": [
+            {
+                "talhao_id": str(talhao.id),
+                "talhao_nome": talhao.nome,
+                "predicao_id": str(predicao["id"]),
+                "produtividade_predita": predicao["produtividade_predita"],
+                "confianca": predicao["confianca"],
+                "unidade": "kg/ha"
+            }
+            for talhao, predicao in zip(talhoes, predicoes)
+        ]
+    }
+
+@router.get("/talhoes/{talhao_id}/features", response_model=schemas.FeaturesProdutividade)
+def obter_features_talhao(
+    talhao_id: UUID,
+    safra_id: Optional[UUID] = None,
+    recalcular: bool = False,
+    db: Session = Depends(get_db)
+):
+    """Features materializadas do talhão na safra (padrão: safra atual)"""
+    from src.utils import feature_store
+    
+    talhao = db.query(models.Talhao).filter(models.Talhao.id == talhao_id).first()
+    if not talhao:
+        raise HTTPException(status_code=404, detail="Talhão não encontrado")
+    
+    if recalcular:
+        linha = feature_store.recalcular(db, talhao.id, safra_id or talhao.safra_id)
+    else:
+        linha = feature_store.obter_features(db, talhao, safra_id)
+    if linha is None:
+        raise HTTPException(status_code=404, detail="Talhão sem safra definida")
+    
+    return linha
+
 @router.patch("/predicoes/{predicao_id}/atualizar-real")
 def atualizar_produtividade_real(
     predicao_id: UUID,
@@ -91,16 +222,23 @@ def atualizar_produtividade_real(
     db: Session = Depends(get_db)
 ):
     """Atualiza a produtividade real para comparar com a predição"""
+    # Bloqueada até o commit: duas atualizações simultâneas não contam o real duas vezes
     predicao = db.query(models.PredicaoProdutividade).filter(
         models.PredicaoProdutividade.id == predicao_id
-    ).first()
+    ).with_for_update().first()
     
     if not predicao:
         raise HTTPException(status_code=404, detail="Predição não encontrada")
     
+    real_anterior = predicao.produtividade_real
     predicao.produtividade_real = produtividade_real
     predicao.erro_absoluto = abs(predicao.produtividade_predita - produtividade_real)
     
+    # Métricas acumuladas do modelo, da cultura e da safra
+    from src.utils import metricas_erro
+    talhao = db.query(models.Talhao).filter(models.Talhao.id == predicao.talhao_id).first()
+    metricas_erro.registrar_real(db, predicao, talhao, real_anterior)
+    
     db.commit()
     
     return {
@@ -116,66 +254,75 @@ def listar_modelos(
     cultura: Optional[str] = None,
     db: Session = Depends(get_db)
 ):
+    from src.utils import metricas_erro
+    
     query = db.query(models.ModeloML)
     if fazenda_id:
         query = query.filter(models.ModeloML.fazenda_id == fazenda_id)
     if cultura:
         query = query.filter(models.ModeloML.cultura == cultura)
     
-    return query.all()
+    modelos = query.all()
+    metricas = metricas_erro.obter(db, "modelo", [str(m.id) for m in modelos])
+    
+    return [
+        {
+            **{coluna.name: getattr(m, coluna.name) for coluna in models.ModeloML.__table__.columns},
+            "metricas_erro": metricas.get(str(m.id))
+        }
+        for m in modelos
+    ]
 
-@router.post("/modelos/treinar")
+@router.post("/modelos/treinar", status_code=202)
 def treinar_modelo(
     fazenda_id: UUID,
     cultura: str,
     nome: str,
+    k_folds: int = Query(5, ge=2, le=20),
     db: Session = Depends(get_db)
 ):
-    """Inicia treinamento de um novo modelo ML"""
+    """
+    Inicia treinamento de um novo modelo ML.
+
+    O treino roda em segundo plano; o modelo fica com status "treinando" até
+    concluir (consulte GET /modelos).
+    """
     from src.utils.ml_service import MLService
     ml_service = MLService()
     
-    # Buscar dados históricos para treinamento
-    dados_treinamento = db.query(
-        models.PredicaoProdutividade,
-        models.Talhao
-    ).join(
-        models.Talhao,
-        models.PredicaoProdutividade.talhao_id == models.Talhao.id
-    ).filter(
-        models.Talhao.fazenda_id == fazenda_id,
-        models.Talhao.cultura == cultura,
-        models.PredicaoProdutividade.produtividade_real.isnot(None)
-    ).all()
+    # Buscar dados históricos para treinamento (uma consulta)
+    X, y = ml_service.extrair_dados_treinamento(db, fazenda_id, cultura)
     
-    if len(dados_treinamento) < 10:
+    if len(y) < 10:
         raise HTTPException(
             status_code=400, 
-            detail=f"Dados insuficientes para treinamento. Necessário mínimo 10 registros, encontrados {len(dados_treinamento)}"
+            detail=f"Dados insuficientes para treinamento. Necessário mínimo 10 registros, encontrados {len(y)}"
         )
     
-    # Treinar modelo
-    resultado = ml_service.treinar_modelo(dados_treinamento)
+    from src.utils.ml_service import dono_treinamento, reservar_versao
     
-    # Salvar modelo
     modelo = models.ModeloML(
         fazenda_id=fazenda_id,
         nome=nome,
         tipo="produtividade",
         cultura=cultura,
-        versao="1.0",
-        acuracia=resultado["acuracia"],
-        parametros=resultado["parametros"],
-        status="ativo"
+        versao=reservar_versao(db, fazenda_id, cultura),
+        parametros={"k_folds": k_folds, "registros_treinamento": int(len(y)), "dono": dono_treinamento()},
+        status="treinando"
     )
     db.add(modelo)
     db.commit()
+    db.refresh(modelo)
+    
+    modelo.arquivo_modelo_url = ml_service.iniciar_treinamento(modelo.id, X, y, k_folds=k_folds)
+    db.commit()
     
     return {
         "sucesso": True,
         "modelo_id": str(modelo.id),
-        "acuracia": resultado["acuracia"],
-        "mensagem": "Modelo treinado com sucesso"
+        "status": "treinando",
+        "registros_treinamento": int(len(y)),
+        "mensagem": "Treinamento iniciado"
     }
 
 # ==================== DELINEAMENTOS ====================
@@ -207,6 +354,7 @@ def gerar_delineamento(
     num_zonas: int = 3,
     indice_base: str = "ndvi",
     metodo: str = "kmeans",
+    limiares: Optional[List[float]] = Query(None),
     db: Session = Depends(get_db)
 ):
     """Gera delineamento automático baseado em índices de vegetação"""
@@ -223,27 +371,55 @@ def gerar_delineamento(
     if not imagem:
         raise HTTPException(status_code=400, detail="Nenhuma imagem processada disponível para o talhão")
     
+    # Raster do índice por pixel, recortado no talhão
+    geometria_talhao = None
+    if talhao.geom is not None:
+        geometria_talhao = json.loads(db.scalar(func.ST_AsGeoJSON(talhao.geom)))
+    
+    from src.utils.gee_service import GEEService, ErroGEE
+    try:
+        raster = GEEService().obter_raster_indice(
+            talhao_id=str(talhao_id),
+            geometry=geometria_talhao,
+            data=str(imagem.data_imagem),
+            indice=indice_base
+        )
+    except ErroGEE as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     # Gerar delineamento
     from src.utils.delineamento_service import DelineamentoService
     service = DelineamentoService()
     
-    resultado = service.gerar_delineamento(
-        talhao_id=str(talhao_id),
-        indice_valor=getattr(imagem, f"{indice_base}_mean", 0.5),
-        num_zonas=num_zonas,
-        metodo=metodo
-    )
+    try:
+        resultado = service.gerar_delineamento(
+            talhao_id=str(talhao_id),
+            raster=raster["valores"],
+            num_zonas=num_zonas,
+            metodo=metodo,
+            transform=raster["transform"],
+            area_pixel_ha=raster["escala"] ** 2 / 10000,
+            limiares=limiares
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    # Salvar delineamento
+    # Salvar delineamento (raster simulado, sem GEE, não conta como processado)
+    simulado = raster["fonte"] == "simulado"
+    geometria = resultado["geometria"]
     delineamento = models.Delineamento(
         talhao_id=talhao_id,
         safra_id=talhao.safra_id,
         nome=f"Delineamento {indice_base.upper()} - {imagem.data_imagem}",
         metodo=metodo,
-        num_zonas=num_zonas,
+        num_zonas=len(resultado["zonas"]),
         indice_base=indice_base,
+        geom=from_shape(geometria, srid=4326) if geometria is not None else None,
         estatisticas_zonas=resultado["estatisticas"],
-        processado=True
+        fonte=raster["fonte"],
+        processado=not simulado
     )
     db.add(delineamento)
     db.commit()
@@ -252,6 +428,8 @@ def gerar_delineamento(
     return {
         "sucesso": True,
         "delineamento_id": str(delineamento.id),
+        "fonte": raster["fonte"],
+        "processado": delineamento.processado,
         "zonas": resultado["zonas"],
         "estatisticas": resultado["estatisticas"]
     }
@@ -274,6 +452,152 @@ def obter_zonas_delineamento(delineamento_id: UUID, db: Session = Depends(get_db
         "zonas": delineamento.estatisticas_zonas.get("zonas", []) if delineamento.estatisticas_zonas else []
     }
 
+@router.get("/delineamentos/{delineamento_id}/download")
+def baixar_prescricao(
+    delineamento_id: UUID,
+    formato: str = "shapefile",
+    taxa_base: float = 100.0,
+    estrategia: str = "compensatoria",
+    unidade: str = "kg/ha",
+    db: Session = Depends(get_db)
+):
+    """Exporta o mapa de prescrição (taxa variável) das zonas do delineamento"""
+    delineamento = db.query(models.Delineamento).filter(
+        models.Delineamento.id == delineamento_id
+    ).first()
+    
+    if not delineamento:
+        raise HTTPException(status_code=404, detail="Delineamento não encontrado")
+    if delineamento.geom is None:
+        raise HTTPException(status_code=400, detail="Delineamento sem geometria de zonas")
+    if delineamento.fonte == "simulado":
+        raise HTTPException(status_code=400, detail="Delineamento gerado com raster simulado (GEE indisponível)")
+    
+    from src.utils.delineamento_service import DelineamentoService
+    service = DelineamentoService()
+    
+    versao = delineamento.updated_at or delineamento.created_at
+    try:
+        exportacao = service.exportar_prescricao(
+            delineamento_id=str(delineamento_id),
+            formato=formato,
+            estatisticas=delineamento.estatisticas_zonas,
+            partes=_partes_delineamento(db, delineamento_id),
+            versao=versao.strftime("%Y%m%d%H%M%S") if versao else "0",
+            taxa_base=taxa_base,
+            estrategia=estrategia,
+            unidade=unidade
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return FileResponse(
+        exportacao["caminho"],
+        media_type=exportacao["media_type"],
+        filename=exportacao["nome_arquivo"]
+    )
+
+def _partes_delineamento(db: Session, delineamento_id: UUID):
+    """Lê as partes de Delineamento.geom uma a uma (ordem de ST_Dump), sob demanda"""
+    resultado = db.execute(
+        text(
+            "SELECT ST_AsGeoJSON((d).geom) FROM ("
+            "  SELECT ST_Dump(geom) AS d FROM delineamentos WHERE id = :id"
+            ") AS partes ORDER BY (d).path[1]"
+        ),
+        {"id": delineamento_id},
+        execution_options={"yield_per": 100}
+    )
+    for (geojson,) in resultado:
+        yield json.loads(geojson)
+
+@router.get("/fazendas/{fazenda_id}/variabilidade")
+def variabilidade_fazenda(
+    fazenda_id: UUID,
+    indice: str = "ndvi",
+    data_inicio: Optional[date] = None,
+    data_fim: Optional[date] = None,
+    skip: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=MAX_IMAGENS_VARIABILIDADE),
+    db: Session = Depends(get_db)
+):
+    """Variabilidade espacial (CV, assimetria, curtose) de cada talhão da fazenda em cada data de imagem (paginada)"""
+    from src.utils.gee_service import GEEService, ErroGEE
+    from src.utils.delineamento_service import DelineamentoService
+    gee_service = GEEService()
+    service = DelineamentoService()
+    
+    # Raster simulado é o mesmo em todas as datas: estatísticas temporais sem sentido
+    if not gee_service.initialized:
+        raise HTTPException(status_code=503, detail="GEE indisponível: variabilidade exige rasters reais")
+    
+    query = db.query(
+        models.ImagemSatelite.talhao_id,
+        models.ImagemSatelite.data_imagem
+    ).join(
+        models.Talhao,
+        models.ImagemSatelite.talhao_id == models.Talhao.id
+    ).filter(
+        models.Talhao.fazenda_id == fazenda_id,
+        models.Talhao.geom.isnot(None),
+        models.ImagemSatelite.processado == True
+    )
+    if data_inicio:
+        query = query.filter(models.ImagemSatelite.data_imagem >= data_inicio)
+    if data_fim:
+        query = query.filter(models.ImagemSatelite.data_imagem <= data_fim)
+    
+    total = query.count()
+    imagens = query.order_by(
+        models.ImagemSatelite.talhao_id, models.ImagemSatelite.data_imagem
+    ).offset(skip).limit(limit).all()
+    
+    geometrias = dict(db.query(models.Talhao.id, func.ST_AsGeoJSON(models.Talhao.geom)).filter(
+        models.Talhao.id.in_({talhao_id for talhao_id, _ in imagens})
+    ).all()) if imagens else {}
+    
+    def raster(talhao_id, data_imagem):
+        return gee_service.obter_raster_indice(
+            talhao_id=str(talhao_id),
+            geometry=json.loads(geometrias[talhao_id]),
+            data=str(data_imagem),
+            indice=indice
+        )["valores"]
+    
+    # Um talhão por vez: rasters (float32) buscados em paralelo e reduzidos em lote
+    analises = []
+    with ThreadPoolExecutor(max_workers=CONCORRENCIA_GEE) as executor:
+        for talhao_id, grupo in groupby(imagens, key=lambda imagem: imagem[0]):
+            datas = [data_imagem for _, data_imagem in grupo]
+            try:
+                rasters = list(executor.map(raster, [talhao_id] * len(datas), datas))
+            except ErroGEE as e:
+                raise HTTPException(status_code=502, detail=str(e))
+            
+            estatisticas = service.analisar_variabilidade_lote(*service.montar_segmentos(rasters))
+            del rasters
+            analises.extend(
+                {
+                    "talhao_id": str(talhao_id),
+                    "data": data_imagem.isoformat(),
+                    "n_pixels": int(estatisticas["n"][i]),
+                    **{
+                        chave: service._arredondar(serie[i])
+                        for chave, serie in estatisticas.items() if chave != "n"
+                    }
+                }
+                for i, data_imagem in enumerate(datas)
+            )
+    
+    return {
+        "fazenda_id": str(fazenda_id),
+        "indice": indice,
+        "total": total,
+        "skip": skip,
+        "limit": limit,
+        "analises": analises
+    }
+
 # ==================== DASHBOARD ====================
 @router.get("/dashboard")
 def dashboard_produtividade(
@@ -313,11 +637,20 @@ def dashboard_produtividade(
     produtividade_media = sum(p["produtividade"] for p in predicoes) / len(predicoes) if predicoes else 0
     produtividade_total = sum(p["produtividade_total"] for p in predicoes)
     
+    # Acurácia acumulada das predições (sem reler as predições)
+    from src.utils import metricas_erro
+    culturas = sorted({t.cultura for t in talhoes if t.cultura})
+    metricas_culturas = metricas_erro.obter(db, "cultura", [f"{fazenda_id}:{c}" for c in culturas])
+    
     return {
         "total_talhoes": total_talhoes,
         "area_total_hectares": round(area_total, 2),
         "talhoes_com_predicao": len(predicoes),
         "produtividade_media_kg_ha": round(produtividade_media, 2),
         "produtividade_total_estimada_kg": round(produtividade_total, 2),
+        "acuracia": {
+            "culturas": {c: metricas_culturas.get(f"{fazenda_id}:{c}") for c in culturas},
+            "safra": metricas_erro.obter(db, "safra", [str(safra_id)]).get(str(safra_id)) if safra_id else None
+        },
         "predicoes": predicoes
     }
@@ -9,6 +9,7 @@
  */
 
 const { exec } = require('child_process');
+const net = require('net');
 const path = require('path');
 const fs = require('fs').promises;
 
@@ -23,12 +24,63 @@ class ProdutividadeService {
   constructor() {
     this.pythonScriptPath = path.join(__dirname, '..', 'ml', 'modelo_estimativa.py');
     this.modelsDir = path.join(__dirname, '..', 'ml', 'models');
+    // Servidor Python residente (src/ml/servidor_predicao.py)
+    this.servidorPredicao = {
+      host: process.env.AGROFOCUS_PREDICAO_HOST || '127.0.0.1',
+      port: parseInt(process.env.AGROFOCUS_PREDICAO_PORTA || '8765', 10)
+    };
+  }
+
+  /**
+   * Predição via servidor residente (modelos já carregados em memória)
+   */
+  preverViaServidor(dados, cultura) {
+    return new Promise((resolve, reject) => {
+      const socket = net.createConnection(this.servidorPredicao);
+      let buffer = '';
+
+      socket.setEncoding('utf8');
+      socket.setTimeout(2000);
+      socket.on('connect', () => {
+        socket.write(JSON.stringify({ ...dados, cultura }) + '\n');
+      });
+      socket.on('data', (chunk) => {
+        buffer += chunk;
+        const fim = buffer.indexOf('\n');
+        if (fim === -1) return;
+
+        socket.end();
+        try {
+          const resultado = JSON.parse(buffer.slice(0, fim));
+          if (resultado.sucesso === false) {
+            reject(new Error(resultado.erro));
+          } else {
+            resolve(resultado);
+          }
+        } catch (parseError) {
+          reject(parseError);
+        }
+      });
+      socket.on('timeout', () => {
+        socket.destroy();
+        reject(new Error('Timeout no servidor de predição'));
+      });
+      socket.on('error', reject);
+    });
   }
 
   /**
    * Executa script Python para predição
    */
   async executarModeloPython(acao, dados, cultura = 'milho') {
+    if (acao === 'predict') {
+      try {
+        return await this.preverViaServidor(dados, cultura);
+      } catch (erro) {
+        console.warn('Servidor de predição indisponível, usando subprocesso:', erro.message);
+      }
+    }
+
     return new Promise((resolve, reject) => {
       let comando;
       
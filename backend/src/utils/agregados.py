@@ -0,0 +1,41 @@
+"""
+Marcadores de tabelas derivadas já populadas.
+
+As tabelas derivadas (resumos meteorológicos, última imagem, séries de
+índices) são mantidas na ingestão, mas dados gravados antes delas precisam de
+um cálculo completo por fazenda ou talhão. `agregados_populados` registra esse
+cálculo: a existência de uma linha derivada não prova que o histórico entrou.
+"""
+from datetime import datetime
+from typing import Iterable, List
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from src.models import models
+
+
+def pendentes(db: Session, agregado: str, chaves: Iterable) -> List:
+    """Chaves ainda não populadas para o agregado"""
+    chaves = list(chaves)
+    if not chaves:
+        return []
+    A = models.AgregadoPopulado
+    populadas = {chave for (chave,) in db.query(A.chave).filter(
+        A.agregado == agregado, A.chave.in_(chaves)
+    )}
+    return [chave for chave in chaves if chave not in populadas]
+
+
+def populado(db: Session, agregado: str, chave) -> bool:
+    return not pendentes(db, agregado, [chave])
+
+
+def marcar_populado(db: Session, agregado: str, *chaves) -> None:
+    """Registra as chaves como populadas (sem commit)"""
+    if not chaves:
+        return
+    agora = datetime.utcnow()
+    db.execute(insert(models.AgregadoPopulado).values([
+        {"agregado": agregado, "chave": chave, "populado_em": agora} for chave in chaves
+    ]).on_conflict_do_nothing(index_elements=["agregado", "chave"]))
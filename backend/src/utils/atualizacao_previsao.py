@@ -0,0 +1,140 @@
+"""
+Atualização periódica da previsão do tempo de todas as fazendas.
+
+O job busca a previsão das fazendas com coordenadas com concorrência limitada
+(fazendas na mesma célula da grade compartilham a consulta do WeatherService),
+agrega todos os payloads numa única chamada vetorizada e grava em lotes com
+upsert por (fazenda_id, data_previsao). Previsões de dias passados são
+removidas, e a rota /previsao apenas lê a tabela. Previsões simuladas (sem
+chave da API ou com a API fora do ar) nunca são gravadas; sem chave o job
+nem é iniciado.
+"""
+import asyncio
+import os
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from src.models import models
+
+INTERVALO_MINUTOS = float(os.getenv("PREVISAO_INTERVALO_MINUTOS", "60"))
+DIAS_PREVISAO = int(os.getenv("PREVISAO_DIAS", "7"))
+CONCORRENCIA = int(os.getenv("PREVISAO_CONCORRENCIA", "10"))
+TAMANHO_LOTE = 500
+
+# Colunas regravadas quando a previsão do dia já existe
+CAMPOS = (
+    "hora_previsao",
+    "temp_max",
+    "temp_min",
+    "umidade",
+    "precipitacao_probabilidade",
+    "precipitacao_volume",
+    "descricao",
+    "icone",
+    "vento_velocidade"
+)
+
+
+def job_ativo(service=None) -> bool:
+    """O job só roda com intervalo positivo e chave da API configurada"""
+    from src.utils.weather_service import obter_weather_service
+    return INTERVALO_MINUTOS > 0 and bool((service or obter_weather_service()).api_key)
+
+
+def descartar_simuladas(previsao: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Dias obtidos da API (simulado indica falta de chave ou falha: mantém a previsão gravada)"""
+    return [dia for dia in previsao if dia.get("fonte") != "simulado"]
+
+
+def linhas_previsao(fazenda_id, previsao: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Linhas de previsao_tempo a partir do resultado de WeatherService.obter_previsao"""
+    agora = datetime.utcnow()
+    return [
+        {
+            "id": uuid4(),
+            "fazenda_id": fazenda_id,
+            "data_previsao": date.fromisoformat(str(dia["data_previsao"])[:10]),
+            **{campo: dia.get(campo) for campo in CAMPOS},
+            "created_at": agora
+        }
+        for dia in previsao
+    ]
+
+
+def montar_upsert(linhas: List[Dict[str, Any]]):
+    """INSERT ... ON CONFLICT (fazenda_id, data_previsao) DO UPDATE"""
+    stmt = insert(models.PrevisaoTempo).values(linhas)
+    return stmt.on_conflict_do_update(
+        index_elements=["fazenda_id", "data_previsao"],
+        set_={campo: stmt.excluded[campo] for campo in CAMPOS + ("created_at",)}
+    )
+
+
+def gravar_previsoes(db: Session, linhas: List[Dict[str, Any]]) -> int:
+    """Upsert das linhas em lotes de TAMANHO_LOTE"""
+    for inicio in range(0, len(linhas), TAMANHO_LOTE):
+        db.execute(montar_upsert(linhas[inicio:inicio + TAMANHO_LOTE]))
+    db.commit()
+    return len(linhas)
+
+
+async def buscar_previsoes(
+    fazendas: List[Any],
+    service,
+    dias: int = DIAS_PREVISAO,
+    concorrencia: int = CONCORRENCIA
+) -> List[Dict[str, Any]]:
+    """Previsão de cada fazenda (id, latitude, longitude) já em linhas da tabela"""
+    previsoes = await service.obter_previsoes(
+        [(fazenda.latitude, fazenda.longitude) for fazenda in fazendas], dias, concorrencia
+    )
+
+    linhas = []
+    for fazenda, previsao in zip(fazendas, previsoes):
+        linhas.extend(linhas_previsao(fazenda.id, descartar_simuladas(previsao)))
+    return linhas
+
+
+async def atualizar_previsoes(dias: int = DIAS_PREVISAO, service=None) -> int:
+    """Atualiza a previsão de todas as fazendas; retorna o número de dias gravados"""
+    from src.config.database import SessionLocal
+    from src.utils.weather_service import obter_weather_service
+
+    service = service or obter_weather_service()
+
+    def carregar_fazendas():
+        with SessionLocal() as db:
+            return db.query(
+                models.Fazenda.id, models.Fazenda.latitude, models.Fazenda.longitude
+            ).filter(
+                models.Fazenda.latitude.isnot(None),
+                models.Fazenda.longitude.isnot(None)
+            ).all()
+
+    def gravar(linhas):
+        with SessionLocal() as db:
+            db.query(models.PrevisaoTempo).filter(
+                models.PrevisaoTempo.data_previsao < date.today()
+            ).delete(synchronize_session=False)
+            return gravar_previsoes(db, linhas)
+
+    # Sessões síncronas fora do loop de eventos
+    fazendas = await asyncio.to_thread(carregar_fazendas)
+    linhas = await buscar_previsoes(fazendas, service, dias)
+    return await asyncio.to_thread(gravar, linhas)
+
+
+async def executar_periodicamente(intervalo_minutos: Optional[float] = None):
+    """Laço do job (iniciado no lifespan da aplicação)"""
+    intervalo = (intervalo_minutos or INTERVALO_MINUTOS) * 60
+    while True:
+        try:
+            n = await atualizar_previsoes()
+            print(f"Previsão do tempo atualizada: {n} dias gravados")
+        except Exception as e:
+            print(f"Erro ao atualizar previsão do tempo: {e}")
+        await asyncio.sleep(intervalo)
@@ -0,0 +1,338 @@
+"""
+Histórico meteorológico e climatologia das fazendas para GDD.
+
+Séries diárias históricas (CSV de ERA5, INMET ou similar) entram em
+`dados_meteorologicos` sem sobrescrever dados já lançados. A partir delas a
+normal climatológica de cada fazenda e cultura (GDD e chuva médios por dia do
+ano, 365 valores com 29/02 somado a 28/02) fica em `climatologia_fazenda`.
+GDD até a data lê as temperaturas diárias já agregadas em
+`resumo_meteorologico_diario` e completa os dias sem observação com a normal;
+a projeção da maturação acumula a normal a partir de hoje.
+"""
+from datetime import date, datetime
+from typing import Any, BinaryIO, Dict, Optional, Tuple, Union
+from uuid import uuid4
+
+import numpy as np
+from sqlalchemy import func, insert
+from sqlalchemy.orm import Session
+
+from src.models import models
+from src.utils import graus_dia
+
+# GDD acumulado até a maturação (último estágio fenológico do gdd.service.js)
+GDD_MATURACAO = {
+    "milho": 1400,
+    "soja": 1200,
+    "trigo": 1100,
+    "algodao": 1400,
+    "cana": 2000,
+    "arroz": 1000,
+    "cafe": 1500,
+    "laranja": 1400
+}
+
+DIAS_ANO = 365
+TAMANHO_LOTE = 1000
+
+# Nomes aceitos para cada coluna do CSV (minúsculas)
+COLUNAS_CSV = {
+    "data": ("data", "date", "time", "dia"),
+    "temp_max": ("temp_max", "tmax", "tx", "temperature_2m_max", "t2m_max"),
+    "temp_min": ("temp_min", "tmin", "tn", "temperature_2m_min", "t2m_min"),
+    "precipitacao": ("precipitacao", "precip", "chuva", "prec", "tp", "precipitation_sum"),
+    "umidade_media": ("umidade_media", "umidade", "rh", "relative_humidity_2m_mean"),
+    "radiacao_solar": ("radiacao_solar", "radiacao", "ssrd", "shortwave_radiation_sum")
+}
+
+Serie = Dict[str, np.ndarray]
+
+
+def temperatura_base(cultura: Optional[str]) -> float:
+    return graus_dia.parametros(cultura)["temperatura_base"]
+
+
+def dia_do_ano(datas: np.ndarray) -> np.ndarray:
+    """Índice 0..364 do dia no ano; 29/02 ocupa o índice de 28/02"""
+    datas = np.asarray(datas, dtype="datetime64[D]")
+    inicio_ano = datas.astype("datetime64[Y]")
+    dia = (datas - inicio_ano.astype("datetime64[D]")).astype(np.int64)
+    ano = inicio_ano.astype(np.int64) + 1970
+    bissexto = (ano % 4 == 0) & ((ano % 100 != 0) | (ano % 400 == 0))
+    return dia - (bissexto & (dia >= 59))
+
+
+def _media_por_dia(indices: np.ndarray, valores: np.ndarray) -> np.ndarray:
+    """Média por dia do ano; dias sem dado interpolados (circularmente) dos vizinhos"""
+    validos = np.isfinite(valores)
+    n = np.bincount(indices[validos], minlength=DIAS_ANO)
+    soma = np.bincount(indices[validos], weights=valores[validos], minlength=DIAS_ANO)
+    com_dado = n > 0
+    if not com_dado.any():
+        return np.full(DIAS_ANO, np.nan)
+
+    media = np.full(DIAS_ANO, np.nan)
+    media[com_dado] = soma[com_dado] / n[com_dado]
+    x = np.arange(DIAS_ANO)
+    return np.interp(x, x[com_dado], media[com_dado], period=DIAS_ANO)
+
+
+def calcular_normais(serie: Serie, cultura: Optional[str] = None) -> Dict[str, Any]:
+    """Normais diárias de GDD (parâmetros da cultura) e precipitação de uma série histórica"""
+    datas = np.asarray(serie["data"], dtype="datetime64[D]")
+    if datas.size == 0:
+        raise ValueError("Série histórica vazia")
+
+    indices = dia_do_ano(datas)
+    gdd = graus_dia.calcular_gdd(serie["temp_max"], serie["temp_min"], cultura, datas=datas)
+    gdd_normal = _media_por_dia(indices, gdd)
+    if np.isnan(gdd_normal).any():
+        raise ValueError("Série histórica sem temperaturas")
+
+    precipitacao = np.asarray(serie.get("precipitacao", np.full(datas.size, np.nan)), dtype=np.float64)
+    precipitacao_normal = _media_por_dia(indices, precipitacao)
+
+    return {
+        "gdd_normal": gdd_normal,
+        "precipitacao_normal": precipitacao_normal,
+        "n_anos": int(np.unique(datas.astype("datetime64[Y]")).size),
+        "data_inicio": datas.min().item(),
+        "data_fim": datas.max().item()
+    }
+
+
+def projetar_maturacao(
+    gdd_normal: np.ndarray,
+    gdd_atual: float,
+    gdd_requerido: float,
+    a_partir_de: date,
+    horizonte_dias: int = 2 * DIAS_ANO
+) -> Tuple[Optional[date], Optional[int]]:
+    """Data em que a normal acumulada a partir do dia seguinte atinge o requerido"""
+    if gdd_atual >= gdd_requerido:
+        return a_partir_de, 0
+
+    dias = np.datetime64(a_partir_de, "D") + np.arange(1, horizonte_dias + 1)
+    acumulado = gdd_atual + np.cumsum(np.asarray(gdd_normal)[dia_do_ano(dias)])
+    i = int(np.searchsorted(acumulado, gdd_requerido))
+    if i >= horizonte_dias:
+        return None, None
+    return dias[i].item(), i + 1
+
+
+def ler_csv(arquivo: Union[str, BinaryIO]) -> Serie:
+    """
+    Série diária de um CSV (separador detectado, vírgula decimal aceita).
+    Temperaturas em Kelvin (ERA5) são convertidas para °C.
+    """
+    import pandas as pd
+
+    tabela = pd.read_csv(arquivo, sep=None, engine="python", dtype=str)
+    tabela.columns = [str(c).strip().lower() for c in tabela.columns]
+
+    serie: Serie = {}
+    for campo, nomes in COLUNAS_CSV.items():
+        coluna = next((n for n in nomes if n in tabela.columns), None)
+        if coluna is None:
+            continue
+        if campo == "data":
+            serie[campo] = pd.to_datetime(tabela[coluna].str.strip(), errors="coerce").to_numpy("datetime64[D]")
+        else:
+            serie[campo] = pd.to_numeric(
+                tabela[coluna].str.strip().str.replace(",", ".", regex=False), errors="coerce"
+            ).to_numpy(np.float64)
+
+    faltando = [c for c in ("data", "temp_max", "temp_min") if c not in serie]
+    if faltando:
+        raise ValueError(f"CSV sem as colunas obrigatórias: {faltando}")
+
+    for campo in ("temp_max", "temp_min"):
+        if np.nanmean(serie[campo]) > 150:
+            serie[campo] = serie[campo] - 273.15
+
+    validas = ~np.isnat(serie["data"])
+    return {campo: valores[validas] for campo, valores in serie.items()}
+
+
+def serie_diaria(db: Session, fazenda_id, data_inicio: Optional[date] = None, data_fim: Optional[date] = None) -> Serie:
+    """Série diária da fazenda (média dos registros do mesmo dia)"""
+    DM = models.DadosMeteorologicos
+    query = db.query(
+        DM.data, func.avg(DM.temp_max), func.avg(DM.temp_min), func.avg(DM.precipitacao)
+    ).filter(DM.fazenda_id == fazenda_id)
+    if data_inicio:
+        query = query.filter(DM.data >= data_inicio)
+    if data_fim:
+        query = query.filter(DM.data <= data_fim)
+    linhas = query.group_by(DM.data).order_by(DM.data).all()
+
+    colunas = list(zip(*linhas)) or [(), (), (), ()]
+    return {
+        "data": np.asarray(colunas[0], dtype="datetime64[D]"),
+        "temp_max": np.asarray(colunas[1], dtype=np.float64),
+        "temp_min": np.asarray(colunas[2], dtype=np.float64),
+        "precipitacao": np.asarray(colunas[3], dtype=np.float64)
+    }
+
+
+def temperaturas_diarias(db: Session, fazenda_id, data_inicio: date, data_fim: date) -> Serie:
+    """Máxima e mínima médias por dia a partir do resumo diário (sem varrer os registros)"""
+    from src.utils import resumo_meteorologico
+
+    resumo_meteorologico.garantir(db, fazenda_id)
+    RD = models.ResumoMeteorologicoDiario
+    linhas = db.query(
+        RD.data,
+        RD.soma_temp_max / func.nullif(RD.n_temp_max, 0),
+        RD.soma_temp_min / func.nullif(RD.n_temp_min, 0)
+    ).filter(
+        RD.fazenda_id == fazenda_id, RD.data >= data_inicio, RD.data <= data_fim
+    ).order_by(RD.data).all()
+
+    colunas = list(zip(*linhas)) or [(), (), ()]
+    return {
+        "data": np.asarray(colunas[0], dtype="datetime64[D]"),
+        "temp_max": np.asarray(colunas[1], dtype=np.float64),
+        "temp_min": np.asarray(colunas[2], dtype=np.float64)
+    }
+
+
+def cultura_principal(db: Session, fazenda_id) -> Optional[str]:
+    """Cultura com mais talhões na fazenda"""
+    T = models.Talhao
+    return db.query(T.cultura).filter(
+        T.fazenda_id == fazenda_id, T.cultura.isnot(None)
+    ).group_by(T.cultura).order_by(func.count(T.id).desc()).limit(1).scalar()
+
+
+def atualizar_climatologia(db: Session, fazenda_id, cultura: str) -> Optional[models.ClimatologiaFazenda]:
+    """Recalcula a normal da fazenda para a cultura (None sem histórico)"""
+    try:
+        normais = calcular_normais(serie_diaria(db, fazenda_id), cultura)
+    except ValueError:
+        return None
+
+    linha = db.query(models.ClimatologiaFazenda).filter(
+        models.ClimatologiaFazenda.fazenda_id == fazenda_id,
+        models.ClimatologiaFazenda.cultura == cultura
+    ).with_for_update().first()
+    if linha is None:
+        linha = models.ClimatologiaFazenda(id=uuid4(), fazenda_id=fazenda_id, cultura=cultura)
+        db.add(linha)
+
+    linha.temperatura_base = temperatura_base(cultura)
+    linha.gdd_normal = np.round(normais["gdd_normal"], 3).tolist()
+    linha.precipitacao_normal = np.round(np.nan_to_num(normais["precipitacao_normal"]), 3).tolist()
+    linha.n_anos = normais["n_anos"]
+    linha.data_inicio = normais["data_inicio"]
+    linha.data_fim = normais["data_fim"]
+    linha.updated_at = datetime.utcnow()
+    db.commit()
+    return linha
+
+
+def obter_climatologia(db: Session, fazenda_id, cultura: str) -> Optional[models.ClimatologiaFazenda]:
+    """Normal gravada (calculada na primeira consulta)"""
+    linha = db.query(models.ClimatologiaFazenda).filter(
+        models.ClimatologiaFazenda.fazenda_id == fazenda_id,
+        models.ClimatologiaFazenda.cultura == cultura
+    ).first()
+    return linha or atualizar_climatologia(db, fazenda_id, cultura)
+
+
+def importar_historico(
+    db: Session,
+    fazenda_id,
+    serie: Serie,
+    fonte: str = "historico",
+    cultura: Optional[str] = None
+) -> Dict[str, int]:
+    """
+    Grava a série diária em dados_meteorologicos (nível fazenda), com gdd_dia
+    pela base e teto da cultura. Dias que já têm registro são mantidos; as
+    normais existentes da fazenda são refeitas.
+    """
+    datas = np.asarray(serie["data"], dtype="datetime64[D]")
+    if datas.size == 0:
+        return {"importados": 0, "ignorados": 0}
+
+    existentes = db.query(models.DadosMeteorologicos.data).filter(
+        models.DadosMeteorologicos.fazenda_id == fazenda_id,
+        models.DadosMeteorologicos.data >= datas.min().item(),
+        models.DadosMeteorologicos.data <= datas.max().item()
+    ).distinct().all()
+    _, primeira = np.unique(datas, return_index=True)
+    novos = np.zeros(datas.size, dtype=bool)
+    novos[primeira] = True
+    novos &= ~np.isin(datas, np.asarray([d for (d,) in existentes], dtype="datetime64[D]"))
+
+    temp_max = np.asarray(serie["temp_max"], dtype=np.float64)
+    temp_min = np.asarray(serie["temp_min"], dtype=np.float64)
+    colunas = {
+        "temp_max": temp_max,
+        "temp_min": temp_min,
+        "temp_media": (temp_max + temp_min) / 2,
+        "gdd_dia": graus_dia.calcular_gdd(temp_max, temp_min, cultura, datas=datas)
+    }
+    for campo in ("precipitacao", "umidade_media", "radiacao_solar"):
+        if campo in serie:
+            colunas[campo] = np.asarray(serie[campo], dtype=np.float64)
+
+    # NaN -> None coluna a coluna, antes de montar as linhas
+    valores = {
+        campo: np.where(np.isnan(v[novos]), None, np.round(v[novos], 2)).tolist()
+        for campo, v in colunas.items()
+    }
+    agora = datetime.utcnow()
+    linhas = [
+        {
+            "id": uuid4(),
+            "fazenda_id": fazenda_id,
+            "talhao_id": None,
+            "data": dia,
+            "fonte": fonte,
+            "created_at": agora,
+            **{campo: valores[campo][i] for campo in valores}
+        }
+        for i, dia in enumerate(datas[novos].tolist())
+    ]
+    for inicio in range(0, len(linhas), TAMANHO_LOTE):
+        db.execute(insert(models.DadosMeteorologicos), linhas[inicio:inicio + TAMANHO_LOTE])
+    db.commit()
+
+    culturas = db.query(models.ClimatologiaFazenda.cultura).filter(
+        models.ClimatologiaFazenda.fazenda_id == fazenda_id
+    ).all()
+    for (cultura,) in culturas:
+        atualizar_climatologia(db, fazenda_id, cultura)
+
+    return {"importados": len(linhas), "ignorados": int(datas.size - len(linhas))}
+
+
+def gdd_ate_data(
+    db: Session,
+    fazenda_id,
+    cultura: str,
+    data_inicio: date,
+    data_fim: Optional[date] = None
+) -> Dict[str, Any]:
+    """GDD acumulado da cultura no período; dias sem observação usam a normal"""
+    data_fim = data_fim or date.today()
+    serie = temperaturas_diarias(db, fazenda_id, data_inicio, data_fim)
+
+    dias = np.arange(np.datetime64(data_inicio, "D"), np.datetime64(data_fim, "D") + 1)
+    gdd = np.full(dias.size, np.nan)
+    posicoes = (serie["data"] - dias[0]).astype(np.int64) if dias.size else np.array([], dtype=np.int64)
+    gdd[posicoes] = graus_dia.calcular_gdd(serie["temp_max"], serie["temp_min"], cultura, datas=serie["data"])
+
+    observados = np.isfinite(gdd)
+    climatologia = obter_climatologia(db, fazenda_id, cultura)
+    if climatologia is not None:
+        gdd[~observados] = np.asarray(climatologia.gdd_normal)[dia_do_ano(dias[~observados])]
+
+    return {
+        "gdd_acumulado": round(float(np.nansum(gdd)), 1),
+        "dias_observados": int(observados.sum()),
+        "dias_climatologia": int((~observados & np.isfinite(gdd)).sum()),
+        "climatologia": climatologia
+    }
@@ -1,7 +1,13 @@
-import random
+import os
 import numpy as np
-from typing import Dict, Any, List
-from scipy import stats
+from typing import Dict, Any, Iterable, List, Optional, Sequence
+from urllib.parse import urlencode
+
+from .exportacao_prescricao import EXPORTADORES, caminho_cache, calcular_taxas, exportar, gerar_feicoes, limpar_cache
+from .zoneamento import VETORIZACAO_DISPONIVEL, vetorizar_zonas, zonear
+
+if VETORIZACAO_DISPONIVEL:
+    from shapely.geometry import MultiPolygon
 
 class DelineamentoService:
     """Serviço para geração de delineamentos/zonas de manejo"""
@@ -12,111 +18,86 @@ class DelineamentoService:
     def gerar_delineamento(
         self, 
         talhao_id: str, 
-        indice_valor: float, 
+        raster: np.ndarray, 
         num_zonas: int = 3,
-        metodo: str = "kmeans"
+        metodo: str = "kmeans",
+        transform: Optional[Sequence[float]] = None,
+        area_pixel_ha: Optional[float] = None,
+        **config
     ) -> Dict[str, Any]:
-        """Gera zonas de manejo baseadas em índices de vegetação"""
+        """
+        Gera zonas de manejo a partir do raster de índice do talhão
         
-        # Simulação de delineamento
-        # Na implementação real, usar dados reais do talhão
+        Args:
+            raster: índice de vegetação por pixel (NaN fora do talhão)
+            metodo: kmeans, quantil, jenks ou limiares (ver utils.zoneamento)
+            transform: (x0, largura_pixel, y0, altura_pixel) para vetorizar as zonas
+            area_pixel_ha: área de um pixel em hectares
+            config: parâmetros do método (ex.: limiares=[0.4, 0.7])
+        """
+        resultado = zonear(raster, num_zonas=num_zonas, metodo=metodo, **config)
         
-        if metodo == "kmeans":
-            return self._delineamento_kmeans(talhao_id, indice_valor, num_zonas)
-        elif metodo == "quantil":
-            return self._delineamento_quantil(talhao_id, indice_valor, num_zonas)
-        else:
-            return self._delineamento_kmeans(talhao_id, indice_valor, num_zonas)
-    
-    def _delineamento_kmeans(
-        self, 
-        talhao_id: str, 
-        indice_valor: float, 
-        num_zonas: int
-    ) -> Dict[str, Any]:
-        """Gera zonas usando método K-means (simulado)"""
+        n_pixels = resultado["n_pixels"]
+        total_pixels = resultado["n_pixels_validos"]
+        n_zonas = len(n_pixels)
+        cores = ["#d73027", "#fee08b", "#1a9852"] if n_zonas == 3 else \
+                ["#d73027", "#fc8d59", "#fee08b", "#91cf60", "#1a9852"][:n_zonas]
         
-        # Simular valores de NDVI para diferentes zonas
-        # Na prática, isso viria de pixels reais da imagem
+        geometrias = None
+        if transform is not None:
+            geometrias = vetorizar_zonas(resultado["raster_zonas"], transform, n_zonas=n_zonas)
         
         zonas = []
-        cores = ["#d73027", "#fee08b", "#1a9852"] if num_zonas == 3 else \
-                ["#d73027", "#fc8d59", "#fee08b", "#91cf60", "#1a9852"][:num_zonas]
-        
-        # Dividir o índice em zonas
-        faixa = 1.0 / num_zonas
-        
-        for i in range(num_zonas):
-            limite_inf = i * faixa
-            limite_sup = (i + 1) * faixa
-            valor_medio = (limite_inf + limite_sup) / 2
-            
-            # Simular área da zona
-            area_percentual = random.uniform(20, 40)
-            
-            zonas.append({
+        partes = []
+        for i in range(n_zonas):
+            media = resultado["media"][i]
+            desvio = resultado["desvio_padrao"][i]
+            zona = {
                 "zona_id": i + 1,
-                "nome": self._nomear_zona(i, num_zonas),
-                "indice_min": round(limite_inf, 2),
-                "indice_max": round(limite_sup, 2),
-                "indice_medio": round(valor_medio, 2),
-                "area_percentual": round(area_percentual, 1),
+                "nome": self._nomear_zona(i, n_zonas),
+                "indice_min": self._arredondar(resultado["minimo"][i]),
+                "indice_max": self._arredondar(resultado["maximo"][i]),
+                "indice_medio": self._arredondar(media),
+                "desvio_padrao": self._arredondar(desvio),
+                "coeficiente_variacao": self._arredondar(desvio / media if media else None),
+                "n_pixels": int(n_pixels[i]),
+                "area_percentual": round(float(n_pixels[i] / total_pixels * 100), 1),
                 "cor": cores[i] if i < len(cores) else "#808080",
-                "recomendacao": self._gerar_recomendacao(i, num_zonas)
-            })
-        
-        # Normalizar percentuais
-        total = sum(z["area_percentual"] for z in zonas)
-        for z in zonas:
-            z["area_percentual"] = round((z["area_percentual"] / total) * 100, 1)
+                "recomendacao": self._gerar_recomendacao(i, n_zonas)
+            }
+            if area_pixel_ha:
+                zona["area_hectares"] = round(float(n_pixels[i] * area_pixel_ha), 2)
+            
+            # Polígonos da zona ficam em geom; a zona guarda o intervalo [inicio, fim)
+            if geometrias and geometrias[i] is not None:
+                zona["partes"] = [len(partes), len(partes) + len(geometrias[i].geoms)]
+                partes.extend(geometrias[i].geoms)
+            
+            zonas.append(zona)
         
         estatisticas = {
-            "indice_medio_geral": round(indice_valor, 4),
-            "coeficiente_variacao": round(random.uniform(0.1, 0.3), 2),
+            "indice_medio_geral": round(resultado["media_geral"], 4),
+            "desvio_padrao": round(resultado["desvio_padrao_geral"], 4),
+            "coeficiente_variacao": round(resultado["coeficiente_variacao"], 4),
+            "n_pixels": total_pixels,
+            "limites": [round(float(l), 4) for l in resultado["limites"]],
             "zonas": zonas,
-            "metodo": "kmeans"
+            "metodo": metodo
         }
         
         return {
             "sucesso": True,
             "talhao_id": talhao_id,
             "zonas": zonas,
-            "estatisticas": estatisticas
+            "estatisticas": estatisticas,
+            "geometria": MultiPolygon(partes) if partes else None
         }
     
-    def _delineamento_quantil(
-        self, 
-        talhao_id: str, 
-        indice_valor: float, 
-        num_zonas: int
-    ) -> Dict[str, Any]:
-        """Gera zonas usando método de quantis"""
-        
-        zonas = []
-        percentis = np.linspace(0, 100, num_zonas + 1)
-        
-        for i in range(num_zonas):
-            p_inf = percentis[i]
-            p_sup = percentis[i + 1]
-            
-            zonas.append({
-                "zona_id": i + 1,
-                "nome": f"Zona {i + 1} (P{p_inf:.0f}-P{p_sup:.0f})",
-                "percentil_min": p_inf,
-                "percentil_max": p_sup,
-                "indice_estimado": round(indice_valor * (p_inf + p_sup) / 200, 2),
-                "cor": self._cor_zona(i, num_zonas)
-            })
-        
-        return {
-            "sucesso": True,
-            "talhao_id": talhao_id,
-            "zonas": zonas,
-            "estatisticas": {
-                "metodo": "quantil",
-                "num_zonas": num_zonas
-            }
-        }
+    def _arredondar(self, valor: Optional[float], casas: int = 4) -> Optional[float]:
+        """Arredonda valores numéricos, mantendo None para zonas vazias"""
+        if valor is None or not np.isfinite(valor):
+            return None
+        return round(float(valor), casas)
     
     def _nomear_zona(self, indice: int, total: int) -> str:
         """Retorna nome descritivo para a zona"""
@@ -140,45 +121,147 @@ class DelineamentoService:
         else:  # Média
             return "Adubação balanceada. Monitorar desenvolvimento."
     
-    def _cor_zona(self, indice: int, total: int) -> str:
-        """Retorna cor para visualização da zona"""
-        cores = ["#d73027", "#fc8d59", "#fee08b", "#d9ef8b", "#91cf60", "#1a9852"]
-        
-        if total <= len(cores):
-            passo = len(cores) // total
-            return cores[indice * passo]
-        else:
-            return "#808080"
-    
-    def analisar_variabilidade(self, valores: List[float]) -> Dict[str, Any]:
+    def analisar_variabilidade(self, valores: Sequence[float]) -> Dict[str, Any]:
         """Analisa variabilidade espacial dos índices"""
         
-        if not valores:
+        if valores is None or len(valores) == 0:
             return {"erro": "Nenhum valor fornecido"}
         
-        valores_array = np.array(valores)
+        lote = self.analisar_variabilidade_lote([0, len(valores)], valores)
         
-        return {
-            "media": round(np.mean(valores_array), 4),
-            "desvio_padrao": round(np.std(valores_array), 4),
-            "minimo": round(np.min(valores_array), 4),
-            "maximo": round(np.max(valores_array), 4),
-            "coeficiente_variacao": round(np.std(valores_array) / np.mean(valores_array), 4),
-            "assimetria": round(stats.skew(valores_array), 4),
-            "curtose": round(stats.kurtosis(valores_array), 4)
-        }
+        return {chave: self._arredondar(serie[0]) for chave, serie in lote.items() if chave != "n"}
+    
+    def analisar_variabilidade_lote(
+        self,
+        offsets: Sequence[int],
+        valores: Sequence[float]
+    ) -> Dict[str, np.ndarray]:
+        """
+        Variabilidade de vários conjuntos de pixels (talhões x datas) de uma vez
+        
+        Args:
+            offsets: início de cada segmento em `valores`, mais o fim do último
+                (len = n_segmentos + 1, crescente)
+            valores: buffer com os pixels de todos os segmentos concatenados;
+                NaN são descartados
+        
+        Returns:
+            Dict de arrays (um valor por segmento): n, media, desvio_padrao,
+            minimo, maximo, coeficiente_variacao, assimetria e curtose (Fisher,
+            mesmas definições de scipy.stats). Segmentos vazios recebem NaN.
+        """
+        offsets = np.asarray(offsets, dtype=np.int64)
+        valores = np.asarray(valores, dtype=np.float64)
+        
+        # Descartar NaN reposicionando os offsets pela contagem acumulada de válidos
+        validos = np.isfinite(valores)
+        if not validos.all():
+            acumulado = np.concatenate(([0], np.cumsum(validos)))
+            offsets = acumulado[offsets]
+            valores = valores[validos]
+        
+        n = np.diff(offsets)
+        com_dados = n > 0
+        # reduceat só nos segmentos com dados: em vazios ele repete o elemento
+        # do índice e não aceita índice == len (que cortaria o segmento anterior)
+        inicios = offsets[:-1][com_dados]
+        
+        def por_segmento(reducao, dados):
+            resultado = np.full(len(n), np.nan)
+            if len(inicios):
+                resultado[com_dados] = reducao.reduceat(dados, inicios)
+            return resultado
+        
+        with np.errstate(divide="ignore", invalid="ignore"):
+            media = por_segmento(np.add, valores) / n
+            
+            # Momentos centrais em uma segunda passada (estável numericamente)
+            desvios = valores - np.repeat(media[com_dados], n[com_dados])
+            quadrados = desvios ** 2
+            m2 = por_segmento(np.add, quadrados) / n
+            m3 = por_segmento(np.add, quadrados * desvios) / n
+            m4 = por_segmento(np.add, quadrados ** 2) / n
+            
+            desvio_padrao = np.sqrt(m2)
+            return {
+                "n": n,
+                "media": media,
+                "desvio_padrao": desvio_padrao,
+                "minimo": por_segmento(np.minimum, valores),
+                "maximo": por_segmento(np.maximum, valores),
+                "coeficiente_variacao": desvio_padrao / media,
+                "assimetria": m3 / m2 ** 1.5,
+                "curtose": m4 / m2 ** 2 - 3
+            }
+    
+    @staticmethod
+    def montar_segmentos(conjuntos: Iterable[Sequence[float]]):
+        """Concatena arrays de pixels em (offsets, valores float32) para o cálculo em lote"""
+        arrays = [np.ravel(np.asarray(c, dtype=np.float32)) for c in conjuntos]
+        offsets = np.concatenate(([0], np.cumsum([len(a) for a in arrays]))).astype(np.int64)
+        valores = np.concatenate(arrays) if arrays else np.empty(0, dtype=np.float32)
+        return offsets, valores
     
-    def exportar_prescricao(self, delineamento_id: str, formato: str = "shapefile") -> Dict[str, Any]:
-        """Exporta mapa de prescrição em formato específico"""
+    def exportar_prescricao(
+        self,
+        delineamento_id: str,
+        formato: str = "shapefile",
+        estatisticas: Optional[Dict[str, Any]] = None,
+        partes: Optional[Iterable[Dict[str, Any]]] = None,
+        versao: str = "0",
+        taxa_base: float = 100.0,
+        estrategia: str = "compensatoria",
+        unidade: str = "kg/ha",
+        taxas: Optional[Dict[int, float]] = None
+    ) -> Dict[str, Any]:
+        """
+        Exporta mapa de prescrição em formato específico
         
-        formatos_suportados = ["shapefile", "geojson", "kml", "csv"]
+        Args:
+            estatisticas: estatisticas_zonas do delineamento
+            partes: geometrias GeoJSON das partes de geom (consumidas sob demanda)
+            versao: versão do delineamento (chave do cache junto com as taxas)
+            taxa_base, estrategia, taxas: ver exportacao_prescricao.calcular_taxas
+        """
+        formatos_suportados = list(EXPORTADORES)
         
         if formato not in formatos_suportados:
             raise ValueError(f"Formato não suportado. Use: {formatos_suportados}")
         
+        zonas = (estatisticas or {}).get("zonas", [])
+        taxas_zona = calcular_taxas(zonas, taxa_base, estrategia, taxas)
+        caminho = caminho_cache(delineamento_id, versao, formato, {
+            "taxas": taxas_zona,
+            "unidade": unidade
+        })
+        
+        # Artefato já gerado para esta versão: as partes nem chegam a ser lidas
+        em_cache = os.path.exists(caminho)
+        if em_cache:
+            # mtime marca o último uso (ordem de remoção do cache)
+            os.utime(caminho)
+        else:
+            if partes is None:
+                raise ValueError("Delineamento sem geometria de zonas para exportar")
+            exportar(gerar_feicoes(partes, zonas, taxas_zona, unidade), formato, caminho)
+            limpar_cache(manter=caminho)
+        
+        extensao, media_type, _ = EXPORTADORES[formato]
+        parametros = urlencode({
+            "formato": formato,
+            "taxa_base": taxa_base,
+            "estrategia": estrategia,
+            "unidade": unidade
+        })
+        
         return {
             "delineamento_id": delineamento_id,
             "formato": formato,
-            "url_download": f"/api/v1/delineamentos/{delineamento_id}/download?formato={formato}",
+            "url_download": f"/api/v1/produtividade/delineamentos/{delineamento_id}/download?{parametros}",
+            "caminho": caminho,
+            "nome_arquivo": f"prescricao_{delineamento_id}.{extensao}",
+            "media_type": media_type,
+            "taxas": taxas_zona,
+            "cache": em_cache,
             "status": "pronto"
         }
@@ -0,0 +1,281 @@
+"""
+Exportação de mapas de prescrição (taxa variável) a partir dos delineamentos.
+
+As partes de `Delineamento.geom` chegam como um iterável de geometrias GeoJSON
+(na ordem de ST_Dump) e são escritas em disco uma a uma, sem montar o arquivo
+em memória. Os artefatos ficam em cache por delineamento, versão e parâmetros,
+limitado por idade e tamanho total.
+"""
+import csv
+import hashlib
+import json
+import math
+import os
+import tempfile
+import time
+import zipfile
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Diretório dos arquivos gerados (reaproveitados em novos downloads)
+CACHE_DIR = os.getenv(
+    "PRESCRICAO_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "agrofocus_prescricoes")
+)
+# Limites do cache: artefatos sem uso há mais de CACHE_MAX_DIAS saem primeiro,
+# depois os menos usados até o diretório caber em CACHE_MAX_MB
+CACHE_MAX_DIAS = float(os.getenv("PRESCRICAO_CACHE_MAX_DIAS", "7"))
+CACHE_MAX_MB = float(os.getenv("PRESCRICAO_CACHE_MAX_MB", "512"))
+
+METROS_POR_GRAU = 111320.0
+
+# pyshp só é necessário para o formato shapefile
+try:
+    import shapefile
+    PYSHP_AVAILABLE = True
+except ImportError:
+    PYSHP_AVAILABLE = False
+
+PRJ_WGS84 = (
+    'GEOGCS["GCS_WGS_1984",DATUM["D_WGS_1984",SPHEROID["WGS_1984",6378137.0,'
+    '298.257223563]],PRIMEM["Greenwich",0.0],UNIT["Degree",0.0174532925199433]]'
+)
+
+CAMPOS = ["zona_id", "nome", "parte", "indice_medio", "area_ha", "taxa", "unidade"]
+
+Feicao = Tuple[Dict[str, Any], Dict[str, Any]]
+
+
+def calcular_taxas(
+    zonas: List[Dict[str, Any]],
+    taxa_base: float,
+    estrategia: str = "compensatoria",
+    taxas: Optional[Dict[int, float]] = None
+) -> Dict[int, float]:
+    """
+    Calcula a taxa de aplicação por zona.
+
+    compensatoria: mais insumo onde o índice é menor (taxa_base * média / zona)
+    proporcional: mais insumo onde o índice é maior (taxa_base * zona / média)
+    uniforme: taxa_base em todas as zonas
+    `taxas` sobrescreve zonas específicas ({zona_id: taxa}).
+    """
+    com_indice = [z for z in zonas if z.get("indice_medio")]
+    total_pixels = sum(z.get("n_pixels", 1) for z in com_indice)
+    media = (
+        sum(z["indice_medio"] * z.get("n_pixels", 1) for z in com_indice) / total_pixels
+        if total_pixels else None
+    )
+
+    resultado = {}
+    for zona in zonas:
+        indice = zona.get("indice_medio")
+        if estrategia == "uniforme" or not indice or not media:
+            taxa = taxa_base
+        elif estrategia == "compensatoria":
+            taxa = taxa_base * media / indice
+        elif estrategia == "proporcional":
+            taxa = taxa_base * indice / media
+        else:
+            raise ValueError("Estratégia não suportada. Use: compensatoria, proporcional, uniforme")
+        resultado[zona["zona_id"]] = round(taxa, 2)
+
+    if taxas:
+        resultado.update({int(k): float(v) for k, v in taxas.items()})
+
+    return resultado
+
+
+def area_hectares(geometria: Dict[str, Any]) -> float:
+    """Área (ha) de um polígono em graus (WGS84), com a escala local na latitude do centroide"""
+    from shapely.geometry import shape
+
+    forma = shape(geometria)
+    escala = METROS_POR_GRAU ** 2 * math.cos(math.radians(forma.centroid.y))
+    return round(forma.area * escala / 10000, 4)
+
+
+def gerar_feicoes(
+    partes: Iterable[Dict[str, Any]],
+    zonas: List[Dict[str, Any]],
+    taxas: Dict[int, float],
+    unidade: str
+) -> Iterator[Feicao]:
+    """Associa cada parte de geom à sua zona (pelo intervalo `partes` da zona)"""
+    zona_por_parte = {}
+    for zona in zonas:
+        inicio, fim = zona.get("partes", (0, 0))
+        for indice in range(inicio, fim):
+            zona_por_parte[indice] = zona
+
+    for indice, geometria in enumerate(partes):
+        zona = zona_por_parte.get(indice)
+        if zona is None:
+            continue
+        propriedades = {
+            "zona_id": zona["zona_id"],
+            "nome": zona.get("nome"),
+            "parte": indice,
+            "indice_medio": zona.get("indice_medio"),
+            # Área da própria parte: somar area_ha no SIG/CSV dá a área da zona
+            "area_ha": area_hectares(geometria),
+            "taxa": taxas.get(zona["zona_id"]),
+            "unidade": unidade
+        }
+        yield propriedades, geometria
+
+
+def escrever_geojson(feicoes: Iterable[Feicao], caminho: str) -> None:
+    with open(caminho, "w", encoding="utf-8") as f:
+        f.write('{"type": "FeatureCollection", "features": [\n')
+        for n, (propriedades, geometria) in enumerate(feicoes):
+            if n:
+                f.write(",\n")
+            json.dump({"type": "Feature", "properties": propriedades, "geometry": geometria}, f)
+        f.write("\n]}\n")
+
+
+def escrever_csv(feicoes: Iterable[Feicao], caminho: str) -> None:
+    from shapely.geometry import shape
+
+    with open(caminho, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(CAMPOS + ["wkt"])
+        for propriedades, geometria in feicoes:
+            writer.writerow([propriedades[c] for c in CAMPOS] + [shape(geometria).wkt])
+
+
+def escrever_kml(feicoes: Iterable[Feicao], caminho: str) -> None:
+    from xml.sax.saxutils import escape
+
+    def coordenadas(anel):
+        return " ".join(f"{x},{y}" for x, y, *_ in anel)
+
+    with open(caminho, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<kml xmlns="http://www.opengis.net/kml/2.2"><Document>\n')
+        for propriedades, geometria in feicoes:
+            dados = "".join(
+                f'<Data name="{c}"><value>{escape(str(propriedades[c]))}</value></Data>'
+                for c in CAMPOS
+            )
+            poligonos = geometria["coordinates"] if geometria["type"] == "MultiPolygon" \
+                else [geometria["coordinates"]]
+            f.write(f"<Placemark><name>{escape(str(propriedades['nome']))}</name>"
+                    f"<ExtendedData>{dados}</ExtendedData><MultiGeometry>")
+            for exterior, *furos in poligonos:
+                f.write("<Polygon><outerBoundaryIs><LinearRing><coordinates>"
+                        f"{coordenadas(exterior)}</coordinates></LinearRing></outerBoundaryIs>")
+                for furo in furos:
+                    f.write("<innerBoundaryIs><LinearRing><coordinates>"
+                            f"{coordenadas(furo)}</coordinates></LinearRing></innerBoundaryIs>")
+                f.write("</Polygon>")
+            f.write("</MultiGeometry></Placemark>\n")
+        f.write("</Document></kml>\n")
+
+
+def escrever_shapefile(feicoes: Iterable[Feicao], caminho: str) -> None:
+    """Shapefile (.shp/.shx/.dbf/.prj/.cpg) compactado em .zip"""
+    if not PYSHP_AVAILABLE:
+        raise RuntimeError("pyshp não instalado: exportação shapefile indisponível")
+
+    from shapely.geometry import shape
+    from shapely.geometry.polygon import orient
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(caminho)) as tmp:
+        base = os.path.join(tmp, "prescricao")
+        writer = shapefile.Writer(base, shapeType=shapefile.POLYGON, encoding="utf-8")
+        writer.field("zona_id", "N", size=4)
+        writer.field("nome", "C", size=64)
+        writer.field("parte", "N", size=8)
+        writer.field("indice_med", "N", size=12, decimal=4)
+        writer.field("area_ha", "N", size=14, decimal=2)
+        writer.field("taxa", "N", size=14, decimal=2)
+        writer.field("unidade", "C", size=16)
+
+        for propriedades, geometria in feicoes:
+            # Shapefile exige exterior no sentido horário e furos no anti-horário
+            forma = shape(geometria)
+            aneis = []
+            for poligono in getattr(forma, "geoms", [forma]):
+                poligono = orient(poligono, sign=-1.0)
+                aneis.append(list(poligono.exterior.coords))
+                aneis.extend(list(furo.coords) for furo in poligono.interiors)
+            writer.poly(aneis)
+            writer.record(*[propriedades[c] for c in CAMPOS])
+        writer.close()
+
+        with open(base + ".prj", "w") as f:
+            f.write(PRJ_WGS84)
+        with open(base + ".cpg", "w") as f:
+            f.write("UTF-8")
+
+        with zipfile.ZipFile(caminho, "w", zipfile.ZIP_DEFLATED) as zf:
+            for ext in ("shp", "shx", "dbf", "prj", "cpg"):
+                zf.write(f"{base}.{ext}", f"prescricao.{ext}")
+
+
+# formato -> (extensão, media type, escritor)
+EXPORTADORES: Dict[str, Tuple[str, str, Callable[[Iterable[Feicao], str], None]]] = {
+    "shapefile": ("zip", "application/zip", escrever_shapefile),
+    "geojson": ("geojson", "application/geo+json", escrever_geojson),
+    "kml": ("kml", "application/vnd.google-earth.kml+xml", escrever_kml),
+    "csv": ("csv", "text/csv", escrever_csv),
+}
+
+
+def caminho_cache(delineamento_id: str, versao: str, formato: str, parametros: Dict[str, Any]) -> str:
+    """Caminho do artefato para o delineamento, versão e parâmetros de taxa"""
+    assinatura = hashlib.sha1(
+        json.dumps(parametros, sort_keys=True, default=str).encode()
+    ).hexdigest()[:12]
+    extensao = EXPORTADORES[formato][0]
+    return os.path.join(CACHE_DIR, f"{delineamento_id}_{versao}_{assinatura}.{extensao}")
+
+
+def exportar(feicoes: Iterable[Feicao], formato: str, caminho: str) -> None:
+    """Escreve o artefato num arquivo temporário e o publica com rename atômico"""
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    escritor = EXPORTADORES[formato][2]
+
+    fd, temporario = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix=".parcial")
+    os.close(fd)
+    try:
+        escritor(feicoes, temporario)
+        os.replace(temporario, caminho)
+    finally:
+        if os.path.exists(temporario):
+            os.remove(temporario)
+
+
+def limpar_cache(diretorio: Optional[str] = None, manter: Optional[str] = None) -> int:
+    """
+    Remove artefatos expirados e, acima de CACHE_MAX_MB, os de uso mais antigo
+    (exceto `manter`, o artefato que está sendo servido); retorna quantos.
+    """
+    diretorio = diretorio or CACHE_DIR
+    if not os.path.isdir(diretorio):
+        return 0
+
+    agora = time.time()
+    arquivos = []
+    for entrada in os.scandir(diretorio):
+        if entrada.is_file() and entrada.path != manter:
+            info = entrada.stat()
+            arquivos.append((info.st_mtime, info.st_size, entrada.path))
+    arquivos.sort()
+
+    total = sum(tamanho for _, tamanho, _ in arquivos)
+    limite = CACHE_MAX_MB * 1024 * 1024
+    removidos = 0
+    for mtime, tamanho, caminho in arquivos:
+        expirado = agora - mtime > CACHE_MAX_DIAS * 86400
+        # Arquivos .parcial recentes ainda estão sendo escritos
+        if not expirado and (total <= limite or caminho.endswith(".parcial")):
+            continue
+        try:
+            os.remove(caminho)
+        except FileNotFoundError:
+            pass
+        total -= tamanho
+        removidos += 1
+    return removidos
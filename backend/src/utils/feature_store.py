@@ -0,0 +1,270 @@
+"""
+Feature store das entradas do modelo de produtividade.
+
+Uma linha de `features_produtividade` por talhão e safra guarda os agregados
+dos índices (média, pico e integral no tempo) e o clima acumulado desde o
+plantio. Cada imagem ou dado meteorológico novo atualiza a linha em O(1);
+dados que chegam fora de ordem refazem a linha a partir das tabelas de origem.
+Predição e treino leem a mesma linha.
+"""
+from datetime import date, datetime
+from typing import Any, Dict, Optional, Tuple
+from uuid import uuid4
+
+from sqlalchemy import and_, func, or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from src.models import models
+
+INDICES = ("ndvi", "ndre", "msavi")
+
+
+def _periodo(talhao: models.Talhao, safra: Optional[models.Safra]) -> Tuple[Optional[date], Optional[date]]:
+    """Janela da safra do talhão: do plantio (ou início da safra) ao fim da safra"""
+    inicio = talhao.data_plantio or (safra.data_inicio if safra else None)
+    fim = safra.data_fim if safra else None
+    return inicio, fim
+
+
+def _no_periodo(data: date, periodo: Tuple[Optional[date], Optional[date]]) -> bool:
+    inicio, fim = periodo
+    return (inicio is None or data >= inicio) and (fim is None or data <= fim)
+
+
+def _linha(db: Session, talhao_id, safra_id) -> models.FeaturesProdutividade:
+    """Linha do talhão/safra bloqueada para atualização (criada se não existir)"""
+    # ON CONFLICT: duas gravações simultâneas do mesmo talhão/safra não duplicam a linha
+    db.execute(insert(models.FeaturesProdutividade).values(
+        id=uuid4(), talhao_id=talhao_id, safra_id=safra_id, n_imagens=0, gdd_acumulado=0.0,
+        precipitacao_acumulada=0.0, updated_at=datetime.utcnow(), **{f"n_{indice}": 0 for indice in INDICES}
+    ).on_conflict_do_nothing(index_elements=["talhao_id", "safra_id"]))
+    return db.query(models.FeaturesProdutividade).filter(
+        models.FeaturesProdutividade.talhao_id == talhao_id,
+        models.FeaturesProdutividade.safra_id == safra_id
+    ).with_for_update().one()
+
+
+def _zerar(linha: models.FeaturesProdutividade) -> None:
+    linha.n_imagens = 0
+    linha.data_primeira_imagem = linha.data_ultima_imagem = None
+    for indice in INDICES:
+        setattr(linha, f"n_{indice}", 0)
+        for campo in ("medio", "pico", "integral", "ultimo"):
+            setattr(linha, f"{indice}_{campo}", None)
+    linha.gdd_acumulado = 0.0
+    linha.precipitacao_acumulada = 0.0
+    linha.data_ultimo_clima = None
+
+
+def _acumular_imagem(linha: models.FeaturesProdutividade, data: date, valores: Dict[str, Optional[float]]) -> None:
+    """
+    Incorpora uma imagem posterior à última. Média, pico e contagem usam só
+    as observações do índice; na integral (trapézios), índice ausente na
+    imagem repete o último valor conhecido.
+    """
+    dias = (data - linha.data_ultima_imagem).days if linha.data_ultima_imagem else 0
+    linha.n_imagens = (linha.n_imagens or 0) + 1
+    linha.data_primeira_imagem = linha.data_primeira_imagem or data
+    linha.data_ultima_imagem = data
+
+    for indice in INDICES:
+        ultimo = getattr(linha, f"{indice}_ultimo")
+        valor = valores.get(indice)
+        integral = getattr(linha, f"{indice}_integral") or 0.0
+        if valor is None:
+            if ultimo is not None:
+                setattr(linha, f"{indice}_integral", integral + dias * ultimo)
+            continue
+
+        valor = float(valor)
+        medio = getattr(linha, f"{indice}_medio")
+        pico = getattr(linha, f"{indice}_pico")
+        n = (getattr(linha, f"n_{indice}") or 0) + 1
+
+        setattr(linha, f"n_{indice}", n)
+        setattr(linha, f"{indice}_medio", valor if medio is None else medio + (valor - medio) / n)
+        setattr(linha, f"{indice}_pico", valor if pico is None else max(pico, valor))
+        setattr(linha, f"{indice}_integral", integral + (dias * (valor + ultimo) / 2 if ultimo is not None else 0.0))
+        setattr(linha, f"{indice}_ultimo", valor)
+
+
+def _valores_imagem(imagem: models.ImagemSatelite) -> Dict[str, Optional[float]]:
+    return {indice: getattr(imagem, f"{indice}_mean") for indice in INDICES}
+
+
+def recalcular(db: Session, talhao_id, safra_id) -> Optional[models.FeaturesProdutividade]:
+    """Refaz a linha do talhão/safra a partir das imagens e dados meteorológicos"""
+    talhao = db.get(models.Talhao, talhao_id)
+    if talhao is None or safra_id is None:
+        return None
+    inicio, fim = _periodo(talhao, db.get(models.Safra, safra_id))
+
+    linha = _linha(db, talhao_id, safra_id)
+    _zerar(linha)
+
+    imagens = db.query(models.ImagemSatelite).filter(
+        models.ImagemSatelite.talhao_id == talhao_id,
+        or_(models.ImagemSatelite.safra_id == safra_id, models.ImagemSatelite.safra_id.is_(None))
+    )
+    clima = db.query(
+        func.sum(models.DadosMeteorologicos.gdd_dia),
+        func.sum(models.DadosMeteorologicos.precipitacao),
+        func.max(models.DadosMeteorologicos.data)
+    ).filter(models.DadosMeteorologicos.talhao_id == talhao_id)
+
+    if inicio:
+        imagens = imagens.filter(models.ImagemSatelite.data_imagem >= inicio)
+        clima = clima.filter(models.DadosMeteorologicos.data >= inicio)
+    if fim:
+        imagens = imagens.filter(models.ImagemSatelite.data_imagem <= fim)
+        clima = clima.filter(models.DadosMeteorologicos.data <= fim)
+
+    data_anterior = None
+    for imagem in imagens.order_by(models.ImagemSatelite.data_imagem):
+        # Duas imagens no mesmo dia: vale a primeira, como no caminho incremental
+        if imagem.data_imagem != data_anterior:
+            _acumular_imagem(linha, imagem.data_imagem, _valores_imagem(imagem))
+            data_anterior = imagem.data_imagem
+
+    gdd, precipitacao, ultima_data = clima.one()
+    linha.gdd_acumulado = float(gdd or 0.0)
+    linha.precipitacao_acumulada = float(precipitacao or 0.0)
+    linha.data_ultimo_clima = ultima_data
+    linha.updated_at = datetime.utcnow()
+
+    db.commit()
+    return linha
+
+
+def recalcular_lote(db: Session, talhoes) -> int:
+    """
+    Calcula de uma vez as linhas (safra atual) de vários talhões: uma consulta
+    de imagens e uma de clima para todos, e um único INSERT (ON CONFLICT DO
+    NOTHING: linha gravada pela ingestão no meio tempo prevalece). Retorna
+    quantas linhas foram calculadas.
+    """
+    talhoes = [t for t in talhoes if t.safra_id is not None]
+    if not talhoes:
+        return 0
+    IS = models.ImagemSatelite
+    DM = models.DadosMeteorologicos
+    safras = {s.id: s for s in db.query(models.Safra).filter(
+        models.Safra.id.in_({t.safra_id for t in talhoes})
+    )}
+    periodos = {t.id: _periodo(t, safras.get(t.safra_id)) for t in talhoes}
+
+    def no_periodo(coluna_talhao, coluna_data, talhao):
+        inicio, fim = periodos[talhao.id]
+        condicoes = [coluna_talhao == talhao.id]
+        if inicio:
+            condicoes.append(coluna_data >= inicio)
+        if fim:
+            condicoes.append(coluna_data <= fim)
+        return and_(*condicoes)
+
+    imagens = db.query(IS.talhao_id, IS.data_imagem, *[getattr(IS, f"{i}_mean") for i in INDICES]).filter(or_(*[
+        and_(no_periodo(IS.talhao_id, IS.data_imagem, t),
+             or_(IS.safra_id == t.safra_id, IS.safra_id.is_(None)))
+        for t in talhoes
+    ])).order_by(IS.talhao_id, IS.data_imagem, IS.created_at).all()
+    clima = {
+        talhao_id: (gdd, precipitacao, ultima_data)
+        for talhao_id, gdd, precipitacao, ultima_data in db.query(
+            DM.talhao_id, func.sum(DM.gdd_dia), func.sum(DM.precipitacao), func.max(DM.data)
+        ).filter(or_(*[no_periodo(DM.talhao_id, DM.data, t) for t in talhoes])).group_by(DM.talhao_id)
+    }
+
+    linhas = {}
+    for talhao in talhoes:
+        linha = models.FeaturesProdutividade(talhao_id=talhao.id, safra_id=talhao.safra_id)
+        _zerar(linha)
+        gdd, precipitacao, ultima_data = clima.get(talhao.id, (None, None, None))
+        linha.gdd_acumulado = float(gdd or 0.0)
+        linha.precipitacao_acumulada = float(precipitacao or 0.0)
+        linha.data_ultimo_clima = ultima_data
+        linhas[talhao.id] = linha
+    for talhao_id, data, *valores in imagens:
+        linha = linhas[talhao_id]
+        # Duas imagens no mesmo dia: vale a primeira, como no caminho incremental
+        if data != linha.data_ultima_imagem:
+            _acumular_imagem(linha, data, dict(zip(INDICES, valores)))
+
+    agora = datetime.utcnow()
+    colunas = [c.name for c in models.FeaturesProdutividade.__table__.columns if c.name not in ("id", "updated_at")]
+    db.execute(insert(models.FeaturesProdutividade).values([
+        {"id": uuid4(), "updated_at": agora, **{c: getattr(linha, c) for c in colunas}}
+        for linha in linhas.values()
+    ]).on_conflict_do_nothing(index_elements=["talhao_id", "safra_id"]))
+    db.commit()
+    return len(linhas)
+
+
+def registrar_imagem(db: Session, imagem: models.ImagemSatelite) -> Optional[models.FeaturesProdutividade]:
+    """Atualiza a linha do talhão/safra com uma imagem recém-gravada"""
+    talhao = db.get(models.Talhao, imagem.talhao_id)
+    safra_id = imagem.safra_id or (talhao.safra_id if talhao else None)
+    if talhao is None or safra_id is None:
+        return None
+    if not _no_periodo(imagem.data_imagem, _periodo(talhao, db.get(models.Safra, safra_id))):
+        return None
+
+    linha = _linha(db, talhao.id, safra_id)
+    if linha.data_ultima_imagem and imagem.data_imagem <= linha.data_ultima_imagem:
+        return recalcular(db, talhao.id, safra_id)
+    if any(getattr(linha, f"{indice}_medio") is not None and not getattr(linha, f"n_{indice}")
+           for indice in INDICES):
+        # Linha gravada antes das contagens por índice
+        return recalcular(db, talhao.id, safra_id)
+
+    _acumular_imagem(linha, imagem.data_imagem, _valores_imagem(imagem))
+    linha.updated_at = datetime.utcnow()
+    db.commit()
+    return linha
+
+
+def registrar_clima(db: Session, dado: models.DadosMeteorologicos) -> Optional[models.FeaturesProdutividade]:
+    """Atualiza a linha da safra atual do talhão com um dado meteorológico recém-gravado"""
+    if dado.talhao_id is None:
+        return None
+    talhao = db.get(models.Talhao, dado.talhao_id)
+    if talhao is None or talhao.safra_id is None:
+        return None
+    if not _no_periodo(dado.data, _periodo(talhao, db.get(models.Safra, talhao.safra_id))):
+        return None
+
+    linha = _linha(db, talhao.id, talhao.safra_id)
+    if linha.data_ultimo_clima and dado.data <= linha.data_ultimo_clima:
+        return recalcular(db, talhao.id, talhao.safra_id)
+
+    linha.gdd_acumulado = (linha.gdd_acumulado or 0.0) + (dado.gdd_dia or 0.0)
+    linha.precipitacao_acumulada = (linha.precipitacao_acumulada or 0.0) + (dado.precipitacao or 0.0)
+    linha.data_ultimo_clima = dado.data
+    linha.updated_at = datetime.utcnow()
+    db.commit()
+    return linha
+
+
+def obter_features(db: Session, talhao: models.Talhao, safra_id=None) -> Optional[models.FeaturesProdutividade]:
+    """Linha materializada do talhão/safra (calculada na primeira leitura)"""
+    safra_id = safra_id or talhao.safra_id
+    if safra_id is None:
+        return None
+
+    linha = db.query(models.FeaturesProdutividade).filter(
+        models.FeaturesProdutividade.talhao_id == talhao.id,
+        models.FeaturesProdutividade.safra_id == safra_id
+    ).first()
+    return linha or recalcular(db, talhao.id, safra_id)
+
+
+def vetor_features(linha: Optional[models.FeaturesProdutividade], talhao: models.Talhao) -> Dict[str, Any]:
+    """Entradas do modelo (nomes de ml_service.FEATURES); None onde não há dado"""
+    return {
+        "ndvi_medio": linha.ndvi_medio if linha else None,
+        "ndre_medio": linha.ndre_medio if linha else None,
+        "msavi_medio": linha.msavi_medio if linha else None,
+        "gdd_acumulado": linha.gdd_acumulado if linha else None,
+        "precipitacao_acumulada": linha.precipitacao_acumulada if linha else None,
+        "area_hectares": talhao.area_hectares
+    }
@@ -1,7 +1,13 @@
 import os
 import random
+import zlib
+import numpy as np
 from typing import Optional, Dict, Any, List
 
+class ErroGEE(Exception):
+    """Falha do Earth Engine com o serviço inicializado (autenticação, cota, limite de pixels)"""
+
+
 class GEEService:
     """Serviço para integração com Google Earth Engine"""
     
@@ -101,6 +107,110 @@ class GEEService:
         
         return None
     
+    def obter_raster_indice(
+        self,
+        talhao_id: str,
+        geometry: Any,
+        data: str,
+        indice: str = "ndvi",
+        escala: int = 10
+    ) -> Dict[str, Any]:
+        """
+        Obtém o índice de vegetação por pixel recortado no talhão
+        
+        Returns:
+            Dict com 'valores' (float32, NaN fora do talhão), 'transform'
+            (x0, largura_pixel, y0, altura_pixel em graus, ou None sem geometria),
+            'escala' (metros por pixel) e 'fonte' ("sentinel-2" ou "simulado")
+        
+        Só simula com o GEE não inicializado; com ele inicializado, falhas
+        levantam ErroGEE e talhão sem geometria levanta ValueError.
+        """
+        if not self.initialized:
+            return self._raster_simulado(talhao_id, geometry, escala)
+        if not geometry:
+            raise ValueError("Talhão sem geometria para recortar o raster")
+        
+        try:
+            return self._raster_indice_gee(geometry, data, indice, escala)
+        except Exception as e:
+            raise ErroGEE(f"Erro ao obter raster GEE: {e}") from e
+    
+    def _raster_indice_gee(self, geometry: Any, data: str, indice: str, escala: int) -> Dict[str, Any]:
+        import ee
+        
+        ee_geometry = ee.Geometry(geometry)
+        imagem = ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED") \
+            .filterBounds(ee_geometry) \
+            .filterDate(data, ee.Date(data).advance(1, 'day')) \
+            .first()
+        
+        if indice == "msavi":
+            banda = imagem.expression(
+                '(2 * NIR + 1 - sqrt((2 * NIR + 1) ** 2 - 8 * (NIR - RED))) / 2',
+                {'NIR': imagem.select('B8').divide(10000), 'RED': imagem.select('B4').divide(10000)}
+            )
+        elif indice == "ndre":
+            banda = imagem.normalizedDifference(['B8', 'B5'])
+        else:
+            banda = imagem.normalizedDifference(['B8', 'B4'])
+        
+        amostra = banda.rename('indice') \
+            .reproject(crs='EPSG:4326', scale=escala) \
+            .sampleRectangle(region=ee_geometry, defaultValue=-9999) \
+            .get('indice') \
+            .getInfo()
+        
+        valores = np.array(amostra, dtype=np.float32)
+        valores[valores == -9999] = np.nan
+        
+        minx, miny, maxx, maxy = self._limites_geometria(geometry)
+        linhas, colunas = valores.shape
+        return {
+            "valores": valores,
+            "transform": (minx, (maxx - minx) / colunas, maxy, (maxy - miny) / linhas),
+            "escala": escala,
+            "fonte": "sentinel-2"
+        }
+    
+    def _raster_simulado(self, talhao_id: str, geometry: Any, escala: int) -> Dict[str, Any]:
+        """Campo sintético espacialmente correlacionado, estável por talhão"""
+        from scipy import ndimage
+        
+        rng = np.random.default_rng(zlib.crc32(talhao_id.encode()))
+        transform = None
+        linhas, colunas = 100, 100
+        
+        if geometry:
+            minx, miny, maxx, maxy = self._limites_geometria(geometry)
+            metros_por_grau = 111320.0
+            largura_m = (maxx - minx) * metros_por_grau * np.cos(np.radians((miny + maxy) / 2))
+            altura_m = (maxy - miny) * metros_por_grau
+            colunas = int(np.clip(largura_m / escala, 1, 2000))
+            linhas = int(np.clip(altura_m / escala, 1, 2000))
+            transform = (minx, (maxx - minx) / colunas, maxy, (maxy - miny) / linhas)
+        
+        campo = ndimage.gaussian_filter(rng.normal(size=(linhas, colunas)), sigma=max(linhas, colunas) / 10)
+        campo = (campo - campo.mean()) / (campo.std() or 1.0)
+        valores = rng.uniform(0.45, 0.75) + 0.1 * campo + rng.normal(0, 0.02, campo.shape)
+        
+        return {
+            "valores": np.clip(valores, -1, 1).astype(np.float32),
+            "transform": transform,
+            "escala": escala,
+            "fonte": "simulado"
+        }
+    
+    def _limites_geometria(self, geometry: Dict[str, Any]):
+        """Retorna (minx, miny, maxx, maxy) de um Polygon/MultiPolygon GeoJSON"""
+        if geometry["type"] == "MultiPolygon":
+            pontos = [p for poligono in geometry["coordinates"] for p in poligono[0]]
+        else:
+            pontos = geometry["coordinates"][0]
+        
+        coords = np.asarray(pontos, dtype=np.float64)
+        return (*coords.min(axis=0)[:2].tolist(), *coords.max(axis=0)[:2].tolist())
+    
     def _fallback_simulado(self) -> Dict[str, Any]:
         return {
             "image_id": "SIMULADO/001",
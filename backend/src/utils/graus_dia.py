@@ -0,0 +1,138 @@
+"""
+Motor de graus-dia (GDD) por cultura.
+
+Cada cultura tem temperatura base, teto e método; os cálculos são vetorizados
+sobre a série inteira (um dia por posição). Métodos:
+
+media: média das temperaturas com a mínima limitada à base e a máxima ao teto
+    (fórmula usada até aqui em /meteorologia/dados e no gdd.service.js)
+seno_simples: curva senoidal entre mínima e máxima com corte horizontal na
+    base e no teto (Baskerville & Emin, 1969)
+seno_duplo: meio dia com a mínima do dia e meio dia com a mínima do dia
+    seguinte; sem o dia seguinte, equivale ao seno simples
+
+Parâmetros podem ser sobrescritos por GDD_PARAMETROS (JSON por cultura) e o
+método padrão por GDD_METODO_PADRAO.
+"""
+import json
+import os
+from typing import Any, Callable, Dict, Optional, Sequence
+
+import numpy as np
+
+METODO_PADRAO = os.getenv("GDD_METODO_PADRAO", "media")
+
+PARAMETROS_PADRAO = {"temperatura_base": 10.0, "temperatura_teto": 30.0}
+
+# Temperatura base (°C) por cultura, mesma tabela do gdd.service.js
+PARAMETROS_CULTURA: Dict[str, Dict[str, Any]] = {
+    "milho": {"temperatura_base": 10.0, "temperatura_teto": 30.0},
+    "soja": {"temperatura_base": 7.0, "temperatura_teto": 30.0},
+    "trigo": {"temperatura_base": 5.0, "temperatura_teto": 30.0},
+    "algodao": {"temperatura_base": 12.0, "temperatura_teto": 32.0},
+    "cana": {"temperatura_base": 18.0, "temperatura_teto": 35.0},
+    "arroz": {"temperatura_base": 10.0, "temperatura_teto": 30.0},
+    "cafe": {"temperatura_base": 8.0, "temperatura_teto": 30.0},
+    "laranja": {"temperatura_base": 12.0, "temperatura_teto": 35.0}
+}
+
+for _cultura, _parametros in json.loads(os.getenv("GDD_PARAMETROS", "{}")).items():
+    PARAMETROS_CULTURA.setdefault(_cultura.lower(), {}).update(_parametros)
+
+METODOS_GDD: Dict[str, Callable[..., np.ndarray]] = {}
+
+
+def registrar_metodo(nome: str):
+    """Registra uma função (temp_max, temp_min, base, teto, temp_min_seguinte) como método"""
+    def decorador(func):
+        METODOS_GDD[nome] = func
+        return func
+    return decorador
+
+
+def parametros(cultura: Optional[str] = None, **sobrescritos) -> Dict[str, Any]:
+    """Base, teto e método da cultura (padrão para cultura desconhecida)"""
+    resultado = {**PARAMETROS_PADRAO, "metodo": METODO_PADRAO}
+    resultado.update(PARAMETROS_CULTURA.get((cultura or "").lower(), {}))
+    resultado.update({k: v for k, v in sobrescritos.items() if v is not None})
+    if resultado["metodo"] not in METODOS_GDD:
+        raise ValueError(f"Método de GDD não suportado. Use: {sorted(METODOS_GDD)}")
+    return resultado
+
+
+@registrar_metodo("media")
+def gdd_media(temp_max, temp_min, base, teto, temp_min_seguinte=None) -> np.ndarray:
+    gdd = (np.minimum(temp_max, teto) + np.maximum(temp_min, base)) / 2 - base
+    return np.maximum(gdd, 0.0)
+
+
+def _seno(temp_max: np.ndarray, temp_min: np.ndarray, base: float, teto: float) -> np.ndarray:
+    """
+    Integral diária da senoide acima da base, cortada no teto. Os casos
+    (abaixo da base, entre limites, acima do teto) saem dos ângulos limitados
+    a [-π/2, π/2].
+    """
+    media = (temp_max + temp_min) / 2
+    amplitude = (temp_max - temp_min) / 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        seno_base = np.nan_to_num((base - media) / amplitude, nan=0.0)
+        seno_teto = np.nan_to_num((teto - media) / amplitude, nan=0.0)
+    theta_base = np.arcsin(np.clip(seno_base, -1.0, 1.0))
+    theta_teto = np.arcsin(np.clip(seno_teto, -1.0, 1.0))
+
+    gdd = (
+        (media - base) * (theta_teto - theta_base)
+        + amplitude * (np.cos(theta_base) - np.cos(theta_teto))
+        + (teto - base) * (np.pi / 2 - theta_teto)
+    ) / np.pi
+    return np.maximum(gdd, 0.0)
+
+
+@registrar_metodo("seno_simples")
+def gdd_seno_simples(temp_max, temp_min, base, teto, temp_min_seguinte=None) -> np.ndarray:
+    return _seno(temp_max, np.minimum(temp_min, temp_max), base, teto)
+
+
+@registrar_metodo("seno_duplo")
+def gdd_seno_duplo(temp_max, temp_min, base, teto, temp_min_seguinte=None) -> np.ndarray:
+    if temp_min_seguinte is None:
+        temp_min_seguinte = temp_min
+    temp_min_seguinte = np.where(np.isnan(temp_min_seguinte), temp_min, temp_min_seguinte)
+    return (
+        _seno(temp_max, np.minimum(temp_min, temp_max), base, teto)
+        + _seno(temp_max, np.minimum(temp_min_seguinte, temp_max), base, teto)
+    ) / 2
+
+
+def calcular_gdd(
+    temp_max: Sequence[float],
+    temp_min: Sequence[float],
+    cultura: Optional[str] = None,
+    datas: Optional[Sequence] = None,
+    metodo: Optional[str] = None,
+    temperatura_base: Optional[float] = None,
+    temperatura_teto: Optional[float] = None
+) -> np.ndarray:
+    """
+    GDD de cada dia da série (NaN onde falta temperatura).
+
+    Com `datas`, o seno duplo só usa a mínima da posição seguinte quando ela é
+    o dia seguinte; sem `datas`, a série é tratada como dias consecutivos.
+    """
+    p = parametros(cultura, metodo=metodo, temperatura_base=temperatura_base,
+                   temperatura_teto=temperatura_teto)
+    temp_max = np.asarray(temp_max, dtype=np.float64)
+    temp_min = np.asarray(temp_min, dtype=np.float64)
+
+    temp_min_seguinte = None
+    if p["metodo"] == "seno_duplo" and temp_min.size:
+        temp_min_seguinte = np.append(temp_min[1:], np.nan)
+        if datas is not None:
+            datas = np.asarray(datas, dtype="datetime64[D]")
+            consecutivo = np.append(np.diff(datas) == np.timedelta64(1, "D"), False)
+            temp_min_seguinte = np.where(consecutivo, temp_min_seguinte, np.nan)
+
+    gdd = METODOS_GDD[p["metodo"]](
+        temp_max, temp_min, p["temperatura_base"], p["temperatura_teto"], temp_min_seguinte
+    )
+    return np.where(np.isnan(temp_max) | np.isnan(temp_min), np.nan, gdd)
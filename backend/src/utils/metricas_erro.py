@@ -0,0 +1,135 @@
+"""
+Métricas de erro das predições acumuladas em O(1) por atualização.
+
+Cada linha de `metricas_erro_modelo` guarda somas do erro e média/M2 da
+produtividade real (Welford) para um escopo: o ModeloML, a cultura na
+fazenda ou a safra. RMSE, MAE, MAPE e R² saem dessas somas sem reler as
+predições. Corrigir uma produtividade real remove a contribuição anterior;
+`contabilizado` marca as predições cujo real já está nas somas.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from sqlalchemy import or_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session, load_only
+
+from src.models import models
+
+
+def chaves_predicao(predicao: models.PredicaoProdutividade, talhao: models.Talhao) -> List[Tuple[str, str]]:
+    """(escopo, chave) das métricas afetadas por uma predição"""
+    chaves = []
+    if predicao.modelo_id:
+        chaves.append(("modelo", str(predicao.modelo_id)))
+    if talhao.cultura:
+        chaves.append(("cultura", f"{talhao.fazenda_id}:{talhao.cultura}"))
+    if predicao.safra_id:
+        chaves.append(("safra", str(predicao.safra_id)))
+    return chaves
+
+
+def acumular(linha: models.MetricaErroModelo, predito: float, real: float, sinal: int = 1) -> None:
+    """Inclui (sinal=1) ou remove (sinal=-1) um par predito/real das somas"""
+    erro = predito - real
+    linha.soma_erro_abs = (linha.soma_erro_abs or 0.0) + sinal * abs(erro)
+    linha.soma_erro_quadrado = (linha.soma_erro_quadrado or 0.0) + sinal * erro ** 2
+    if real:
+        linha.soma_erro_percentual = (linha.soma_erro_percentual or 0.0) + sinal * abs(erro / real)
+        linha.n_percentual = (linha.n_percentual or 0) + sinal
+
+    n = linha.n or 0
+    media = linha.media_real or 0.0
+    m2 = linha.m2_real or 0.0
+    if sinal > 0:
+        n += 1
+        delta = real - media
+        media += delta / n
+        m2 += delta * (real - media)
+    elif n <= 1:
+        n, media, m2 = 0, 0.0, 0.0
+    else:
+        media_anterior = (n * media - real) / (n - 1)
+        m2 -= (real - media_anterior) * (real - media)
+        n -= 1
+        media = media_anterior
+
+    linha.n, linha.media_real, linha.m2_real = n, media, max(m2, 0.0)
+
+
+def resumo(linha: Optional[models.MetricaErroModelo]) -> Optional[Dict[str, Any]]:
+    """Métricas no mesmo formato de MLService.avaliar_modelo"""
+    if linha is None or not linha.n:
+        return None
+    return {
+        "rmse": round((linha.soma_erro_quadrado / linha.n) ** 0.5, 2),
+        "mae": round(linha.soma_erro_abs / linha.n, 2),
+        "r2": round(1 - linha.soma_erro_quadrado / linha.m2_real, 4) if linha.m2_real else None,
+        "mape": round(linha.soma_erro_percentual / linha.n_percentual * 100, 2) if linha.n_percentual else None,
+        "n_amostras": linha.n
+    }
+
+
+def _linha(db: Session, escopo: str, chave: str) -> models.MetricaErroModelo:
+    """Linha do escopo/chave bloqueada para atualização (criada se não existir)"""
+    # ON CONFLICT: dois primeiros reais simultâneos da mesma chave não colidem
+    db.execute(insert(models.MetricaErroModelo).values(
+        id=uuid4(), escopo=escopo, chave=chave, n=0, soma_erro_abs=0.0, soma_erro_quadrado=0.0,
+        soma_erro_percentual=0.0, n_percentual=0, media_real=0.0, m2_real=0.0, updated_at=datetime.utcnow()
+    ).on_conflict_do_nothing(index_elements=["escopo", "chave"]))
+    return db.query(models.MetricaErroModelo).filter(
+        models.MetricaErroModelo.escopo == escopo,
+        models.MetricaErroModelo.chave == chave
+    ).with_for_update().one()
+
+
+def registrar_real(
+    db: Session,
+    predicao: models.PredicaoProdutividade,
+    talhao: models.Talhao,
+    real_anterior: Optional[float] = None
+) -> None:
+    """
+    Atualiza as métricas dos escopos da predição (sem commit). A linha da
+    predição deve estar bloqueada (FOR UPDATE) para não contar o real duas vezes.
+    """
+    for escopo, chave in chaves_predicao(predicao, talhao):
+        linha = _linha(db, escopo, chave)
+
+        # Real gravado antes das métricas nunca entrou nas somas: nada a remover
+        if real_anterior is not None and predicao.contabilizado:
+            acumular(linha, predicao.produtividade_predita, real_anterior, sinal=-1)
+        acumular(linha, predicao.produtividade_predita, predicao.produtividade_real)
+        linha.updated_at = datetime.utcnow()
+    predicao.contabilizado = True
+
+
+def contabilizar_pendentes(db: Session, lote: int = 500) -> int:
+    """Inclui nas métricas os reais ainda não contabilizados; retorna quantos"""
+    P = models.PredicaoProdutividade
+    total = 0
+    while True:
+        pendentes = db.query(P, models.Talhao).join(models.Talhao, models.Talhao.id == P.talhao_id).options(
+            load_only(models.Talhao.fazenda_id, models.Talhao.cultura)
+        ).filter(
+            P.produtividade_real.isnot(None),
+            or_(P.contabilizado.is_(False), P.contabilizado.is_(None))
+        ).limit(lote).with_for_update(of=P, skip_locked=True).all()
+        for predicao, talhao in pendentes:
+            registrar_real(db, predicao, talhao)
+        db.commit()
+        total += len(pendentes)
+        if len(pendentes) < lote:
+            return total
+
+
+def obter(db: Session, escopo: str, chaves: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Resumo das métricas de várias chaves de um escopo numa consulta"""
+    if not chaves:
+        return {}
+    linhas = db.query(models.MetricaErroModelo).filter(
+        models.MetricaErroModelo.escopo == escopo,
+        models.MetricaErroModelo.chave.in_(chaves)
+    ).all()
+    return {linha.chave: resumo(linha) for linha in linhas}
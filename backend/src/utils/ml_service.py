@@ -1,113 +1,251 @@
-import random
+import copy
+import json
+import os
+import socket
+import threading
 import numpy as np
-from typing import Dict, Any, List
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, Any, List, Optional
+
+# Produtividade de referência (kg/ha) por cultura
+PRODUTIVIDADE_BASE = {
+    "soja": 3500,
+    "milho": 12000,
+    "cana": 80000,
+    "algodao": 4500,
+    "cafe": 2000,
+    "trigo": 3000
+}
+
+# Ordem das features no vetor de entrada dos modelos treinados
+FEATURES = [
+    "ndvi_medio",
+    "ndre_medio",
+    "msavi_medio",
+    "gdd_acumulado",
+    "precipitacao_acumulada",
+    "area_hectares"
+]
+
+# Chaves de entrada das predições (na ordem de FEATURES) e casas decimais
+# usadas no arredondamento da chave do memo
+ENTRADAS = [
+    ("ndvi", 4),
+    ("ndre", 4),
+    ("msavi", 4),
+    ("gdd", 1),
+    ("precipitacao", 1),
+    ("area", 2)
+]
+
+# Versão do formato do artefato JSON (incrementar ao mudar os campos)
+FORMATO_ARTEFATO = 1
+
+# Diretório dos artefatos (ModeloML.arquivo_modelo_url aponta para cá)
+MODELOS_DIR = os.getenv(
+    "MODELOS_ML_DIR",
+    os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "modelos_ml"))
+)
+
+TREINO_WORKERS = int(os.getenv("ML_TREINO_WORKERS", "2"))
+# Treinos "treinando" cujo processo dono não existe mais são encerrados na
+# inicialização; os de dono desconhecido (outro host), só após este prazo
+TREINO_TIMEOUT_MINUTOS = float(os.getenv("ML_TREINO_TIMEOUT_MINUTOS", "180"))
+_POOL_TREINAMENTO = None
+_POOL_LOCK = threading.Lock()
+
+# Produtividade real + features na ordem de FEATURES. Features gravadas na
+# predição têm prioridade; senão vêm da feature store do talhão/safra
+# (a mesma linha usada na predição).
+SQL_DADOS_TREINAMENTO = """
+SELECT
+    p.produtividade_real,
+    COALESCE(p.ndvi_medio, f.ndvi_medio),
+    COALESCE(p.ndre_medio, f.ndre_medio),
+    COALESCE(p.msavi_medio, f.msavi_medio),
+    COALESCE(p.gdd_acumulado, f.gdd_acumulado),
+    COALESCE(p.precipitacao_acumulada, f.precipitacao_acumulada),
+    t.area_hectares
+FROM predicoes_produtividade p
+JOIN talhoes t ON t.id = p.talhao_id
+LEFT JOIN features_produtividade f
+    ON f.talhao_id = p.talhao_id AND f.safra_id = COALESCE(p.safra_id, t.safra_id)
+WHERE t.fazenda_id = :fazenda_id
+  AND t.cultura = :cultura
+  AND p.produtividade_real IS NOT NULL
+"""
 
 class MLService:
     """Serviço para Machine Learning de produtividade"""
     
     def __init__(self):
         self.modelo_atual = None
-        self.scaler = None
+        self.modelo_id = None
     
-    def prever_produtividade(self, dados_entrada: Dict[str, Any]) -> Dict[str, Any]:
-        """Realiza predição de produtividade com base nos dados de entrada"""
-        
-        ndvi = dados_entrada.get("ndvi", 0.5)
-        ndre = dados_entrada.get("ndre", 0.4)
-        msavi = dados_entrada.get("msavi", 0.3)
-        gdd = dados_entrada.get("gdd", 1000)
-        area = dados_entrada.get("area", 10)
-        cultura = dados_entrada.get("cultura", "soja")
+    def usar_modelo(self, db, fazenda_id, cultura: str) -> bool:
+        """
+        Seleciona o ModeloML ativo mais recente da fazenda/cultura. Sem modelo
+        treinado, as predições usam a fórmula de referência.
+        """
+        from src.models import models
         
-        # Fórmula simplificada de predição (simulação)
-        # Na implementação real, usar modelo treinado
-        
-        base_produtividade = {
-            "soja": 3500,
-            "milho": 12000,
-            "cana": 80000,
-            "algodao": 4500,
-            "cafe": 2000,
-            "trigo": 3000
-        }
+        self.modelo_atual = self.modelo_id = None
+        registro = db.query(models.ModeloML).filter(
+            models.ModeloML.fazenda_id == fazenda_id,
+            models.ModeloML.cultura == cultura,
+            models.ModeloML.tipo == "produtividade",
+            models.ModeloML.status == "ativo",
+            models.ModeloML.arquivo_modelo_url.isnot(None)
+        ).order_by(models.ModeloML.created_at.desc()).first()
         
-        prod_base = base_produtividade.get(cultura.lower(), 3000)
+        if registro is None or not self.carregar_modelo(registro.arquivo_modelo_url):
+            return False
         
-        # Fatores de ajuste
-        fator_ndvi = 0.5 + (ndvi * 1.5)  # 0.5 a 2.0
-        fator_ndre = 0.8 + (ndre * 0.4)  # 0.8 a 1.2
-        fator_gdd = min(gdd / 1500, 1.2)  # Limitado a 1.2
-        
-        # Variação aleatória para simular modelo real
-        variacao = random.uniform(0.9, 1.1)
-        
-        produtividade = prod_base * fator_ndvi * fator_ndre * fator_gdd * variacao
-        
-        # Confiabilidade baseada nos dados disponíveis
-        confianca = 0.7 + (ndvi * 0.2) + (0.1 if gdd > 500 else 0)
-        confianca = min(confianca, 0.98)
-        
-        return {
-            "produtividade": round(produtividade, 2),
-            "confianca": round(confianca, 2),
-            "unidade": "kg/ha",
-            "fatores": {
-                "ndvi": ndvi,
-                "ndre": ndre,
-                "gdd": gdd,
-                "fator_ndvi": round(fator_ndvi, 2),
-                "fator_ndre": round(fator_ndre, 2),
-                "fator_gdd": round(fator_gdd, 2)
-            }
-        }
+        self.modelo_id = registro.id
+        return True
     
-    def treinar_modelo(self, dados_treinamento: List[Any]) -> Dict[str, Any]:
-        """Treina um novo modelo ML com dados históricos"""
-        
-        # Simulação de treinamento
-        # Na implementação real, usar scikit-learn, TensorFlow, etc.
+    def prever_produtividade(self, dados_entrada: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Realiza predição de produtividade com base nos dados de entrada.
         
-        print(f"Treinando modelo com {len(dados_treinamento)} registros...")
+        Determinística: entradas iguais (arredondadas à precisão gravada no
+        banco) dão o mesmo resultado, memorizado em LRU.
+        """
+        entrada = tuple(
+            None if dados_entrada.get(chave) is None else round(float(dados_entrada[chave]), casas)
+            for chave, casas in ENTRADAS
+        )
+        cultura = (dados_entrada.get("cultura") or "soja").lower()
         
-        # Simular métricas de treinamento
-        acuracia = random.uniform(0.75, 0.95)
+        resultado = copy.deepcopy(_prever_memo(_chave_modelo(self.modelo_atual), cultura, entrada))
+        if self.modelo_id is not None:
+            resultado["modelo_id"] = str(self.modelo_id)
+        return resultado
+    
+    def prever_produtividade_lote(self, entradas: Dict[str, Any]) -> Dict[str, np.ndarray]:
+        """
+        Predição vetorizada para vários talhões de uma vez.
         
-        # Gerar parâmetros do modelo
-        parametros = {
-            "tipo": "random_forest",
-            "n_estimators": 100,
-            "max_depth": 10,
-            "features_utilizadas": [
-                "ndvi_medio",
-                "ndre_medio", 
-                "msavi_medio",
-                "gdd_acumulado",
-                "area_hectares"
-            ],
-            "importancia_features": {
-                "ndvi_medio": random.uniform(0.3, 0.5),
-                "gdd_acumulado": random.uniform(0.2, 0.4),
-                "area_hectares": random.uniform(0.1, 0.2),
-                "ndre_medio": random.uniform(0.05, 0.15),
-                "msavi_medio": random.uniform(0.05, 0.15)
-            }
-        }
+        `entradas` tem sequências alinhadas ndvi, ndre, msavi, gdd,
+        precipitacao, area e cultura; None vira o valor imputado do modelo
+        (ou o padrão da fórmula de referência).
+        """
+        n = len(entradas["ndvi"])
+        X = np.column_stack([
+            np.array(entradas.get(chave, [None] * n), dtype=np.float64) for chave, _ in ENTRADAS
+        ]) if n else np.empty((0, len(ENTRADAS)))
         
-        # Simular métricas de validação
-        validacao = {
-            "rmse": random.uniform(200, 500),
-            "mae": random.uniform(150, 400),
-            "r2": random.uniform(0.7, 0.95)
+        if self.modelo_atual is not None:
+            return _prever_modelo(_parametros_modelo(self.modelo_atual), X)
+        return _prever_referencia(X, entradas["cultura"])
+    
+    def extrair_dados_treinamento(self, db, fazenda_id, cultura: str):
+        """
+        Extrai features e produtividade real das predições da fazenda/cultura
+        numa única consulta (predições + talhão + feature store).
+
+        Returns:
+            (X, y) com X no formato (n, len(FEATURES)); NaN onde faltar dado
+        """
+        from sqlalchemy import text
+
+        linhas = db.execute(text(SQL_DADOS_TREINAMENTO), {
+            "fazenda_id": str(fazenda_id),
+            "cultura": cultura
+        }).all()
+
+        if not linhas:
+            return np.empty((0, len(FEATURES))), np.empty(0)
+
+        dados = np.array([tuple(linha) for linha in linhas], dtype=np.float64)
+        return dados[:, 1:], dados[:, 0]
+
+    def treinar_modelo(
+        self,
+        X: np.ndarray,
+        y: np.ndarray,
+        caminho_artefato: str,
+        k_folds: int = 5,
+        alpha: float = 1.0
+    ) -> Dict[str, Any]:
+        """
+        Treina regressão Ridge com validação cruzada k-fold e salva o artefato.
+
+        Faltantes são imputados pela mediana de cada feature; a normalização é
+        ajustada só no treino de cada fold. As métricas vêm das predições fora
+        do fold e o modelo final é ajustado com todos os registros.
+        """
+        from sklearn.linear_model import Ridge
+        from sklearn.model_selection import KFold
+
+        X = np.asarray(X, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+
+        with np.errstate(all="ignore"):
+            medianas = np.nanmedian(X, axis=0)
+        medianas = np.where(np.isnan(medianas), 0.0, medianas)
+        X = np.where(np.isnan(X), medianas, X)
+
+        def ajustar(X_treino, y_treino):
+            media = X_treino.mean(axis=0)
+            escala = X_treino.std(axis=0)
+            escala[escala == 0] = 1.0
+            regressao = Ridge(alpha=alpha).fit((X_treino - media) / escala, y_treino)
+            return media, escala, regressao
+
+        k_folds = max(2, min(k_folds, len(y)))
+        previsto = np.empty_like(y)
+        for treino, teste in KFold(k_folds, shuffle=True, random_state=42).split(X):
+            media, escala, regressao = ajustar(X[treino], y[treino])
+            previsto[teste] = regressao.predict((X[teste] - media) / escala)
+
+        validacao = self.avaliar_modelo(previsto.tolist(), y.tolist())
+
+        media, escala, regressao = ajustar(X, y)
+        self.modelo_atual = {
+            "versao_formato": FORMATO_ARTEFATO,
+            "tipo": "ridge",
+            "features": FEATURES,
+            "imputacao": medianas.tolist(),
+            "media": media.tolist(),
+            "escala": escala.tolist(),
+            "coeficientes": regressao.coef_.tolist(),
+            "intercepto": float(regressao.intercept_),
+            "alpha": alpha,
+            "k_folds": k_folds,
+            "validacao": validacao,
+            "n_amostras": int(len(y)),
+            "data_treino": datetime.now().isoformat()
         }
-        
+        self.salvar_modelo(caminho_artefato)
+
         return {
             "sucesso": True,
-            "acuracia": round(acuracia, 4),
-            "parametros": parametros,
+            "acuracia": round(min(max(validacao["r2"] or 0.0, 0.0), 1.0), 4),
+            "parametros": {
+                "tipo": "ridge",
+                "alpha": alpha,
+                "k_folds": k_folds,
+                "features_utilizadas": FEATURES,
+                "coeficientes": dict(zip(FEATURES, regressao.coef_.round(4).tolist()))
+            },
             "validacao": validacao,
-            "registros_treinamento": len(dados_treinamento)
+            "registros_treinamento": int(len(y)),
+            "arquivo_modelo": caminho_artefato
         }
-    
+
+    def iniciar_treinamento(self, modelo_id, X: np.ndarray, y: np.ndarray, **config) -> str:
+        """
+        Envia o treino ao pool de processos e retorna o caminho do artefato.
+        O registro ModeloML é atualizado ao final (status ativo ou erro).
+        """
+        caminho = os.path.join(MODELOS_DIR, f"{modelo_id}.json")
+        futuro = _pool_treinamento().submit(_treinar_em_processo, X, y, caminho, config)
+        futuro.add_done_callback(lambda f: _finalizar_treinamento(modelo_id, f))
+        return caminho
+
     def avaliar_modelo(self, predicoes: List[float], reais: List[float]) -> Dict[str, Any]:
         """Avalia performance do modelo"""
         
@@ -123,30 +261,241 @@ class MLService:
         # MAE
         mae = np.mean(np.abs(predicoes_array - reais_array))
         
-        # R²
+        # R² (None com reais constantes)
         ss_res = np.sum((reais_array - predicoes_array) ** 2)
         ss_tot = np.sum((reais_array - np.mean(reais_array)) ** 2)
-        r2 = 1 - (ss_res / ss_tot)
+        r2 = round(float(1 - ss_res / ss_tot), 4) if ss_tot else None
         
-        # Erro percentual médio
-        mape = np.mean(np.abs((reais_array - predicoes_array) / reais_array)) * 100
+        # Erro percentual médio, só com reais diferentes de zero (como em metricas_erro)
+        nao_zero = reais_array != 0
+        mape = round(float(np.mean(
+            np.abs((reais_array[nao_zero] - predicoes_array[nao_zero]) / reais_array[nao_zero])
+        ) * 100), 2) if nao_zero.any() else None
         
         return {
             "rmse": round(rmse, 2),
             "mae": round(mae, 2),
-            "r2": round(r2, 4),
-            "mape": round(mape, 2),
+            "r2": r2,
+            "mape": mape,
             "n_amostras": len(predicoes)
         }
     
     def salvar_modelo(self, caminho: str) -> bool:
-        """Salva o modelo treinado em disco"""
-        # Implementar serialização do modelo
-        print(f"Modelo salvo em: {caminho}")
+        """Salva o modelo treinado em disco (JSON, escrita atômica)"""
+        if self.modelo_atual is None:
+            return False
+
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        temporario = caminho + ".tmp"
+        with open(temporario, "w") as f:
+            json.dump(self.modelo_atual, f)
+        os.replace(temporario, caminho)
         return True
-    
+
     def carregar_modelo(self, caminho: str) -> bool:
-        """Carrega um modelo salvo"""
-        # Implementar desserialização do modelo
-        print(f"Modelo carregado de: {caminho}")
+        """Carrega um modelo salvo (artefatos ficam em cache até o arquivo mudar)"""
+        try:
+            modelo = _ler_artefato(caminho, os.stat(caminho).st_mtime_ns)
+        except (OSError, ValueError) as e:
+            print(f"Erro ao carregar modelo {caminho}: {e}")
+            return False
+
+        if modelo.get("versao_formato") != FORMATO_ARTEFATO:
+            print(f"Formato de modelo não suportado: {modelo.get('versao_formato')}")
+            return False
+
+        self.modelo_atual = modelo
+        return True
+
+
+@lru_cache(maxsize=32)
+def _ler_artefato(caminho: str, mtime_ns: int) -> Dict[str, Any]:
+    with open(caminho) as f:
+        return json.load(f)
+
+
+def _parametros_modelo(modelo: Dict[str, Any]) -> tuple:
+    """Parâmetros do modelo linear como tupla (hashável, usada na chave do memo)"""
+    return (
+        tuple(modelo["imputacao"]),
+        tuple(modelo["media"]),
+        tuple(modelo["escala"]),
+        tuple(modelo["coeficientes"]),
+        float(modelo["intercepto"]),
+        float(modelo.get("validacao", {}).get("rmse", 0.0))
+    )
+
+
+def _chave_modelo(modelo: Optional[Dict[str, Any]]) -> Optional[tuple]:
+    return _parametros_modelo(modelo) if modelo is not None else None
+
+
+def _prever_modelo(parametros: tuple, X: np.ndarray) -> Dict[str, np.ndarray]:
+    """Regressão treinada; confiança = 1 - RMSE da validação cruzada / predição"""
+    imputacao, media, escala, coeficientes, intercepto, rmse = (np.asarray(p) for p in parametros)
+    X = np.where(np.isnan(X), imputacao, X)
+    produtividade = np.maximum(intercepto + ((X - media) / escala) @ coeficientes, 0.0)
+    confianca = np.clip(1 - rmse / np.maximum(produtividade, 1.0), 0.0, 0.98)
+    return {
+        "produtividade": produtividade.round(2),
+        "confianca": confianca.round(2)
+    }
+
+
+def _prever_referencia(X: np.ndarray, culturas) -> Dict[str, np.ndarray]:
+    """Fórmula de referência (sem modelo treinado): base da cultura x fatores"""
+    padroes = np.array([0.5, 0.4, 0.3, 1000, np.nan, 10])
+    X = np.where(np.isnan(X), padroes, X)
+    ndvi, ndre, gdd = X[:, 0], X[:, 1], X[:, 3]
+    
+    unicas, inverso = np.unique([(c or "").lower() for c in culturas], return_inverse=True)
+    prod_base = np.array([PRODUTIVIDADE_BASE.get(c, 3000) for c in unicas])[inverso]
+    
+    # Fatores de ajuste
+    fator_ndvi = 0.5 + (ndvi * 1.5)  # 0.5 a 2.0
+    fator_ndre = 0.8 + (ndre * 0.4)  # 0.8 a 1.2
+    fator_gdd = np.minimum(gdd / 1500, 1.2)  # Limitado a 1.2
+    
+    produtividade = prod_base * fator_ndvi * fator_ndre * fator_gdd
+    
+    # Confiabilidade baseada nos dados disponíveis
+    confianca = np.minimum(0.7 + (ndvi * 0.2) + np.where(gdd > 500, 0.1, 0.0), 0.98)
+    
+    return {
+        "produtividade": produtividade.round(2),
+        "confianca": confianca.round(2),
+        "fator_ndvi": fator_ndvi.round(2),
+        "fator_ndre": fator_ndre.round(2),
+        "fator_gdd": fator_gdd.round(2)
+    }
+
+
+@lru_cache(maxsize=4096)
+def _prever_memo(parametros: Optional[tuple], cultura: str, entrada: tuple) -> Dict[str, Any]:
+    """Predição de um talhão, memorizada pelo modelo e pela entrada arredondada"""
+    X = np.array([entrada], dtype=np.float64)
+    fatores = {chave: valor for (chave, _), valor in zip(ENTRADAS, entrada)}
+    
+    if parametros is not None:
+        lote = _prever_modelo(parametros, X)
+        metodo = "modelo_ml"
+    else:
+        lote = _prever_referencia(X, [cultura])
+        metodo = "referencia"
+        fatores.update({
+            chave: float(lote[chave][0]) for chave in ("fator_ndvi", "fator_ndre", "fator_gdd")
+        })
+    
+    return {
+        "produtividade": float(lote["produtividade"][0]),
+        "confianca": float(lote["confianca"][0]),
+        "unidade": "kg/ha",
+        "metodo": metodo,
+        "fatores": fatores
+    }
+
+
+def _pool_treinamento() -> ProcessPoolExecutor:
+    """Pool de processos compartilhado pelos treinos (criado no primeiro uso)"""
+    global _POOL_TREINAMENTO
+    with _POOL_LOCK:
+        if _POOL_TREINAMENTO is None:
+            _POOL_TREINAMENTO = ProcessPoolExecutor(max_workers=TREINO_WORKERS)
+        return _POOL_TREINAMENTO
+
+
+def _treinar_em_processo(X, y, caminho, config):
+    return MLService().treinar_modelo(X, y, caminho, **config)
+
+
+def _finalizar_treinamento(modelo_id, futuro) -> None:
+    """Grava o resultado do treino no ModeloML (roda na thread do pool)"""
+    from src.config.database import SessionLocal
+    from src.models import models
+
+    db = SessionLocal()
+    try:
+        # Treino já encerrado como interrompido não muda mais de estado
+        modelo = db.query(models.ModeloML).filter(
+            models.ModeloML.id == modelo_id,
+            models.ModeloML.status == "treinando"
+        ).with_for_update().first()
+        if modelo is None:
+            return
+
+        erro = futuro.exception()
+        if erro is not None:
+            modelo.status = "erro"
+            modelo.parametros = {**(modelo.parametros or {}), "erro": str(erro)}
+        else:
+            resultado = futuro.result()
+            modelo.status = "ativo"
+            modelo.acuracia = resultado["acuracia"]
+            modelo.parametros = {**resultado["parametros"], "validacao": resultado["validacao"],
+                                 "registros_treinamento": resultado["registros_treinamento"]}
+            modelo.arquivo_modelo_url = resultado["arquivo_modelo"]
+        db.commit()
+    finally:
+        db.close()
+
+
+def reservar_versao(db, fazenda_id, cultura: str) -> str:
+    """
+    Próxima versão ("N.0") do modelo da fazenda/cultura. Trava a dupla
+    fazenda/cultura até o fim da transação: o ModeloML deve ser inserido e
+    commitado na mesma transação.
+    """
+    from sqlalchemy import Integer, cast, func
+    from src.models import models
+
+    db.execute(func.pg_advisory_xact_lock(func.hashtext(f"modelos_ml:{fazenda_id}:{cultura}")).select())
+    maior = db.query(func.max(cast(func.split_part(models.ModeloML.versao, ".", 1), Integer))).filter(
+        models.ModeloML.fazenda_id == fazenda_id,
+        models.ModeloML.cultura == cultura
+    ).scalar()
+    return f"{(maior or 0) + 1}.0"
+
+
+def dono_treinamento() -> Dict[str, Any]:
+    """Processo que executa o treino (gravado em ModeloML.parametros["dono"])"""
+    return {"host": socket.gethostname(), "pid": os.getpid()}
+
+
+def _dono_ativo(dono: Optional[Dict[str, Any]]) -> Optional[bool]:
+    """O processo dono ainda existe? None quando não dá para saber (outro host, sem dono)"""
+    if not dono or dono.get("host") != socket.gethostname():
+        return None
+    pid = dono.get("pid")
+    if pid == os.getpid():
+        # Este processo está iniciando: não tem treinos próprios (PID reaproveitado)
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
         return True
+    return True
+
+
+def encerrar_treinos_interrompidos(db) -> int:
+    """
+    Marca como erro os ModeloML presos em "treinando" cujo processo dono
+    terminou (ou, com dono desconhecido, após TREINO_TIMEOUT_MINUTOS); retorna quantos
+    """
+    from src.models import models
+
+    limite = datetime.utcnow() - timedelta(minutes=TREINO_TIMEOUT_MINUTOS)
+    treinando = db.query(models.ModeloML).filter(
+        models.ModeloML.status == "treinando"
+    ).with_for_update(skip_locked=True).all()
+    presos = []
+    for modelo in treinando:
+        ativo = _dono_ativo((modelo.parametros or {}).get("dono"))
+        if ativo is False or (ativo is None and modelo.created_at <= limite):
+            presos.append(modelo)
+    for modelo in presos:
+        modelo.status = "erro"
+        modelo.parametros = {**(modelo.parametros or {}), "erro": "treino interrompido (reinício do servidor)"}
+    db.commit()
+    return len(presos)
@@ -0,0 +1,170 @@
+"""
+Resumos meteorológicos pré-agregados por fazenda.
+
+`resumo_meteorologico_diario` guarda, por fazenda e dia, somas, contagens e
+extremos de `dados_meteorologicos`; `resumo_meteorologico_mensal` agrega os
+dias do mês. A ingestão refaz só os dias e meses tocados (INSERT ... SELECT com
+upsert). O resumo de uma janela soma os meses inteiros contidos nela e os dias
+das pontas, em vez de varrer os registros brutos. O histórico anterior aos
+resumos entra uma vez por fazenda, marcado em `agregados_populados`.
+"""
+from datetime import date, timedelta
+from typing import Any, Dict, Optional
+
+from sqlalchemy import Date, and_, cast, exists, func, or_, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from src.models import models
+from src.utils import agregados
+
+AGREGADO = "resumo_meteorologico"
+
+# Colunas somáveis e extremos (com a agregação que os combina)
+SOMAS = ("n_registros", "n_temp_max", "soma_temp_max", "n_temp_min", "soma_temp_min",
+         "n_temp_media", "soma_temp_media", "soma_precipitacao", "n_umidade", "soma_umidade")
+EXTREMOS = {"max_temp_max": func.max, "min_temp_min": func.min}
+
+
+def _agregados_brutos():
+    DM = models.DadosMeteorologicos
+    return [
+        func.count(DM.id).label("n_registros"),
+        func.count(DM.temp_max).label("n_temp_max"),
+        func.coalesce(func.sum(DM.temp_max), 0).label("soma_temp_max"),
+        func.max(DM.temp_max).label("max_temp_max"),
+        func.count(DM.temp_min).label("n_temp_min"),
+        func.coalesce(func.sum(DM.temp_min), 0).label("soma_temp_min"),
+        func.min(DM.temp_min).label("min_temp_min"),
+        func.count(DM.temp_media).label("n_temp_media"),
+        func.coalesce(func.sum(DM.temp_media), 0).label("soma_temp_media"),
+        func.coalesce(func.sum(DM.precipitacao), 0).label("soma_precipitacao"),
+        func.count(DM.umidade_media).label("n_umidade"),
+        func.coalesce(func.sum(DM.umidade_media), 0).label("soma_umidade")
+    ]
+
+
+def _agregados_resumo(tabela):
+    """Mesmas colunas re-agregadas a partir de uma tabela de resumo"""
+    colunas = [func.coalesce(func.sum(getattr(tabela, c)), 0).label(c) for c in SOMAS]
+    colunas += [agregacao(getattr(tabela, c)).label(c) for c, agregacao in EXTREMOS.items()]
+    return colunas
+
+
+def _upsert(tabela, chave: str, consulta):
+    nomes = ["id", "fazenda_id", chave, *SOMAS, *EXTREMOS, "updated_at"]
+    stmt = insert(tabela).from_select(nomes, consulta)
+    return stmt.on_conflict_do_update(
+        index_elements=["fazenda_id", chave],
+        set_={c: stmt.excluded[c] for c in nomes[3:]}
+    )
+
+
+def _colunas_upsert(agregados):
+    """Reordena as colunas agregadas na ordem de _upsert"""
+    por_nome = {c.name: c for c in agregados}
+    return [por_nome[c] for c in (*SOMAS, *EXTREMOS)]
+
+
+def atualizar(db: Session, fazenda_id, data_inicio: Optional[date] = None, data_fim: Optional[date] = None) -> None:
+    """Refaz os resumos diários do intervalo e os mensais dos meses tocados (sem datas: tudo)"""
+    DM = models.DadosMeteorologicos
+    RD = models.ResumoMeteorologicoDiario
+    RM = models.ResumoMeteorologicoMensal
+
+    filtro_bruto = [DM.fazenda_id == fazenda_id]
+    filtro_dia = [RD.fazenda_id == fazenda_id]
+    if data_inicio:
+        filtro_bruto.append(DM.data >= data_inicio)
+        filtro_dia.append(RD.data >= data_inicio)
+    if data_fim:
+        filtro_bruto.append(DM.data <= data_fim)
+        filtro_dia.append(RD.data <= data_fim)
+
+    diario = select(
+        func.uuid_generate_v4(), DM.fazenda_id, DM.data,
+        *_colunas_upsert(_agregados_brutos()), func.now()
+    ).where(*filtro_bruto).group_by(DM.fazenda_id, DM.data)
+    db.execute(_upsert(RD, "data", diario))
+
+    # Dias que ficaram sem registros
+    db.query(RD).filter(*filtro_dia, ~exists().where(and_(
+        DM.fazenda_id == RD.fazenda_id, DM.data == RD.data
+    ))).delete(synchronize_session=False)
+
+    mes = cast(func.date_trunc("month", RD.data), Date)
+    filtro_mes = [RD.fazenda_id == fazenda_id]
+    if data_inicio:
+        filtro_mes.append(RD.data >= data_inicio.replace(day=1))
+    if data_fim:
+        filtro_mes.append(RD.data < (data_fim.replace(day=1) + timedelta(days=32)).replace(day=1))
+
+    mensal = select(
+        func.uuid_generate_v4(), RD.fazenda_id, mes,
+        *_colunas_upsert(_agregados_resumo(RD)), func.now()
+    ).where(*filtro_mes).group_by(RD.fazenda_id, mes)
+    db.execute(_upsert(RM, "mes", mensal))
+
+    filtro_mensal = [RM.fazenda_id == fazenda_id]
+    if data_inicio:
+        filtro_mensal.append(RM.mes >= data_inicio.replace(day=1))
+    if data_fim:
+        filtro_mensal.append(RM.mes <= data_fim)
+    db.query(RM).filter(*filtro_mensal, ~exists().where(and_(
+        RD.fazenda_id == RM.fazenda_id, cast(func.date_trunc("month", RD.data), Date) == RM.mes
+    ))).delete(synchronize_session=False)
+
+    db.commit()
+
+
+def _somar(linhas) -> Dict[str, Any]:
+    total = {c: 0 for c in SOMAS}
+    total.update({c: None for c in EXTREMOS})
+    for linha in linhas:
+        for c in SOMAS:
+            total[c] += getattr(linha, c) or 0
+        if linha.max_temp_max is not None and (total["max_temp_max"] is None or linha.max_temp_max > total["max_temp_max"]):
+            total["max_temp_max"] = linha.max_temp_max
+        if linha.min_temp_min is not None and (total["min_temp_min"] is None or linha.min_temp_min < total["min_temp_min"]):
+            total["min_temp_min"] = linha.min_temp_min
+    return total
+
+
+def resumir(db: Session, fazenda_id, data_inicio: date, data_fim: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Somas e extremos da janela: meses inteiros do resumo mensal e dias das
+    pontas do diário (no máximo duas consultas indexadas).
+    """
+    RD = models.ResumoMeteorologicoDiario
+    RM = models.ResumoMeteorologicoMensal
+    data_fim = data_fim or date.today()
+
+    # Primeiro mês inteiro dentro da janela e início do mês seguinte ao último inteiro
+    primeiro_mes = data_inicio if data_inicio.day == 1 else (data_inicio.replace(day=1) + timedelta(days=32)).replace(day=1)
+    fim_meses = (data_fim + timedelta(days=1)).replace(day=1)
+
+    partes = []
+    if primeiro_mes < fim_meses:
+        partes.append(db.query(*_agregados_resumo(RM)).filter(
+            RM.fazenda_id == fazenda_id, RM.mes >= primeiro_mes, RM.mes < fim_meses
+        ).one())
+        pontas = [(data_inicio, primeiro_mes - timedelta(days=1)), (fim_meses, data_fim)]
+    else:
+        pontas = [(data_inicio, data_fim)]
+
+    pontas = [(a, b) for a, b in pontas if a <= b]
+    if pontas:
+        partes.append(db.query(*_agregados_resumo(RD)).filter(
+            RD.fazenda_id == fazenda_id,
+            or_(*[RD.data.between(a, b) for a, b in pontas])
+        ).one())
+
+    return _somar(partes)
+
+
+def garantir(db: Session, fazenda_id) -> None:
+    """Popula os resumos da fazenda com os dados anteriores a eles (uma vez por fazenda)"""
+    if not agregados.populado(db, AGREGADO, fazenda_id):
+        atualizar(db, fazenda_id)
+        agregados.marcar_populado(db, AGREGADO, fazenda_id)
+        db.commit()
@@ -0,0 +1,150 @@
+"""
+Última imagem de cada talhão com a classe de saúde pelo NDVI.
+
+`ultima_imagem_talhao` guarda uma linha por talhão (com fazenda e safra) e é
+atualizada por upsert a cada imagem gravada; imagens mais antigas que a
+guardada não a substituem. O dashboard de monitoramento conta as classes com
+um GROUP BY indexado por fazenda em vez de varrer `imagens_satelite`. Com
+filtro de safra, a contagem sai das imagens da safra (a tabela só tem a última
+imagem do talhão, que pode ser de outra safra). As imagens anteriores à tabela
+entram uma vez por fazenda (`agregados_populados`).
+"""
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import case, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from src.models import models
+from src.utils import agregados
+
+AGREGADO = "saude_talhoes"
+
+# NDVI acima de SAUDAVEL é saudável; abaixo de CRITICO, crítico; entre os dois, atenção
+NDVI_SAUDAVEL = 0.6
+NDVI_CRITICO = 0.3
+
+STATUS_SAUDE = ("saudavel", "atencao", "critico")
+
+CAMPOS = ("fazenda_id", "safra_id", "imagem_id", "data_imagem", "ndvi_mean",
+          "ndre_mean", "msavi_mean", "status_saude", "updated_at")
+
+
+def classificar_saude(ndvi: Optional[float]) -> Optional[str]:
+    if ndvi is None:
+        return None
+    if ndvi > NDVI_SAUDAVEL:
+        return "saudavel"
+    if ndvi < NDVI_CRITICO:
+        return "critico"
+    return "atencao"
+
+
+def _status_sql(ndvi):
+    """Mesma classificação de classificar_saude, em SQL"""
+    return case(
+        (ndvi > NDVI_SAUDAVEL, "saudavel"),
+        (ndvi < NDVI_CRITICO, "critico"),
+        (ndvi.isnot(None), "atencao"),
+        else_=None
+    )
+
+
+def _upsert(stmt):
+    """ON CONFLICT (talhao_id): só substitui por imagem da mesma data ou mais recente"""
+    tabela = models.UltimaImagemTalhao.__table__
+    return stmt.on_conflict_do_update(
+        index_elements=["talhao_id"],
+        set_={campo: stmt.excluded[campo] for campo in CAMPOS},
+        where=stmt.excluded.data_imagem >= tabela.c.data_imagem
+    )
+
+
+def registrar_imagem(db: Session, imagem: models.ImagemSatelite) -> None:
+    """Atualiza a linha do talhão com uma imagem recém-gravada"""
+    talhao = db.query(models.Talhao.fazenda_id, models.Talhao.safra_id).filter(
+        models.Talhao.id == imagem.talhao_id
+    ).first()
+    if talhao is None:
+        return
+    db.execute(_upsert(insert(models.UltimaImagemTalhao).values(
+        talhao_id=imagem.talhao_id,
+        fazenda_id=talhao.fazenda_id,
+        safra_id=imagem.safra_id or talhao.safra_id,
+        imagem_id=imagem.id,
+        data_imagem=imagem.data_imagem,
+        ndvi_mean=imagem.ndvi_mean,
+        ndre_mean=imagem.ndre_mean,
+        msavi_mean=imagem.msavi_mean,
+        status_saude=classificar_saude(imagem.ndvi_mean),
+        updated_at=datetime.utcnow()
+    )))
+    db.commit()
+
+
+def _ultimas_imagens(fazenda_id=None, safra_id=None, *extras):
+    """Imagem mais recente de cada talhão (só as da safra, se dada) com a classe de saúde"""
+    IS = models.ImagemSatelite
+    T = models.Talhao
+    ordenadas = select(
+        IS.talhao_id, T.fazenda_id, func.coalesce(IS.safra_id, T.safra_id).label("safra_id"),
+        IS.id.label("imagem_id"), IS.data_imagem, IS.ndvi_mean, IS.ndre_mean, IS.msavi_mean,
+        func.row_number().over(
+            partition_by=IS.talhao_id, order_by=(IS.data_imagem.desc(), IS.created_at.desc())
+        ).label("ordem")
+    ).join(T, T.id == IS.talhao_id)
+    if fazenda_id:
+        ordenadas = ordenadas.where(T.fazenda_id == fazenda_id)
+    if safra_id:
+        ordenadas = ordenadas.where(IS.safra_id == safra_id)
+    ordenadas = ordenadas.subquery()
+
+    return select(
+        *[ordenadas.c[campo] for campo in ("talhao_id",) + CAMPOS[:-2]],
+        _status_sql(ordenadas.c.ndvi_mean).label("status_saude"), *extras
+    ).where(ordenadas.c.ordem == 1)
+
+
+def recalcular(db: Session, fazenda_id=None) -> None:
+    """Refaz as linhas a partir de `imagens_satelite` (imagem mais recente de cada talhão)"""
+    ultimas = _ultimas_imagens(fazenda_id, None, func.now())
+    db.execute(_upsert(insert(models.UltimaImagemTalhao).from_select(("talhao_id",) + CAMPOS, ultimas)))
+    db.commit()
+
+
+def garantir(db: Session, fazenda_id=None) -> None:
+    """Popula a tabela com as imagens gravadas antes dela (uma vez por fazenda; sem fazenda, todas)"""
+    fazendas = [fazenda_id] if fazenda_id else [f for (f,) in db.query(models.Fazenda.id)]
+    pendentes = agregados.pendentes(db, AGREGADO, fazendas)
+    for pendente in pendentes:
+        recalcular(db, pendente)
+    if pendentes:
+        agregados.marcar_populado(db, AGREGADO, *pendentes)
+        db.commit()
+
+
+def _fonte(fazenda_id=None, safra_id=None):
+    """Tabela mantida, ou as imagens da safra quando há filtro de safra"""
+    if safra_id:
+        return _ultimas_imagens(fazenda_id, safra_id).subquery().c
+    return models.UltimaImagemTalhao
+
+
+def contar_status(db: Session, fazenda_id=None, safra_id=None) -> Dict[str, int]:
+    """Talhões por classe de saúde (GROUP BY sobre o índice fazenda + status)"""
+    U = _fonte(fazenda_id, safra_id)
+    query = db.query(U.status_saude, func.count()).filter(U.status_saude.isnot(None))
+    if fazenda_id:
+        query = query.filter(U.fazenda_id == fazenda_id)
+    contagens = dict(query.group_by(U.status_saude).all())
+    return {status: contagens.get(status, 0) for status in STATUS_SAUDE}
+
+
+def ultimas_atualizacoes(db: Session, fazenda_id=None, safra_id=None, limite: int = 10) -> List:
+    """Talhões com imagem mais recente primeiro"""
+    U = _fonte(fazenda_id, safra_id)
+    query = db.query(U.talhao_id, U.data_imagem, U.ndvi_mean, U.ndre_mean, U.msavi_mean, U.status_saude)
+    if fazenda_id:
+        query = query.filter(U.fazenda_id == fazenda_id)
+    return query.order_by(U.data_imagem.desc()).limit(limite).all()
@@ -0,0 +1,163 @@
+"""
+Séries temporais dos índices de vegetação em formato colunar compacto.
+
+Uma linha de `series_indices_talhao` por talhão e índice guarda a série
+inteira: `offsets` (int32, dias desde `data_base`) e `valores` (float32),
+ordenados por data. Cada imagem nova acrescenta um ponto ao final em O(1)
+(datas fora de ordem ou repetidas refazem a ordenação da linha), e a leitura
+de uma safra é uma linha lida e fatiada com searchsorted, sem objetos ORM por
+ponto. O primeiro uso de cada talhão refaz as séries com as imagens já
+gravadas (marcado em `agregados_populados`).
+"""
+from datetime import date, datetime
+from typing import Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from src.models import models
+from src.utils import agregados
+from src.utils.feature_store import INDICES
+
+AGREGADO = "series_indices"
+
+TIPO_OFFSET = np.dtype("<i4")
+TIPO_VALOR = np.dtype("<f4")
+
+
+def codificar(dias: np.ndarray, valores: np.ndarray) -> Tuple[date, bytes, bytes]:
+    """(data_base, offsets, valores) a partir de dias (datetime64[D]) ordenados"""
+    base = dias[0]
+    offsets = (dias - base).astype(TIPO_OFFSET)
+    return base.item(), offsets.tobytes(), np.asarray(valores, dtype=TIPO_VALOR).tobytes()
+
+
+def decodificar(data_base: date, offsets: bytes, valores: bytes) -> Tuple[np.ndarray, np.ndarray]:
+    """Datas (datetime64[D]) e valores (float32) da série"""
+    dias = np.datetime64(data_base, "D") + np.frombuffer(offsets, dtype=TIPO_OFFSET)
+    return dias, np.frombuffer(valores, dtype=TIPO_VALOR)
+
+
+def _gravar(linha: models.SerieIndiceTalhao, dias: np.ndarray, valores: np.ndarray) -> None:
+    linha.data_base, linha.offsets, linha.valores = codificar(dias, valores)
+    linha.data_ultima = dias[-1].item()
+    linha.n_pontos = int(dias.size)
+    linha.updated_at = datetime.utcnow()
+
+
+def _linha(db: Session, talhao_id, indice: str) -> Optional[models.SerieIndiceTalhao]:
+    return db.query(models.SerieIndiceTalhao).filter(
+        models.SerieIndiceTalhao.talhao_id == talhao_id,
+        models.SerieIndiceTalhao.indice == indice
+    ).with_for_update().first()
+
+
+def acrescentar(linha: models.SerieIndiceTalhao, data: date, valor: float) -> None:
+    """Acrescenta um ponto; data repetida substitui o valor"""
+    if data > linha.data_ultima:
+        # bytes(): o driver pode devolver BYTEA como memoryview
+        linha.offsets = bytes(linha.offsets) + np.array([(data - linha.data_base).days], dtype=TIPO_OFFSET).tobytes()
+        linha.valores = bytes(linha.valores) + np.array([valor], dtype=TIPO_VALOR).tobytes()
+        linha.data_ultima = data
+        linha.n_pontos = (linha.n_pontos or 0) + 1
+        linha.updated_at = datetime.utcnow()
+        return
+
+    dias, valores = decodificar(linha.data_base, linha.offsets, linha.valores)
+    dia = np.datetime64(data, "D")
+    posicao = int(np.searchsorted(dias, dia))
+    if posicao < dias.size and dias[posicao] == dia:
+        valores = valores.copy()
+        valores[posicao] = valor
+    else:
+        dias = np.insert(dias, posicao, dia)
+        valores = np.insert(valores, posicao, valor)
+    _gravar(linha, dias, valores)
+
+
+def registrar_imagem(db: Session, imagem: models.ImagemSatelite) -> None:
+    """Acrescenta os índices de uma imagem recém-gravada às séries do talhão"""
+    if not agregados.populado(db, AGREGADO, imagem.talhao_id):
+        # Talhão com imagens gravadas antes da tabela de séries: refaz com todas
+        recalcular(db, imagem.talhao_id)
+        return
+    for indice in INDICES:
+        valor = getattr(imagem, f"{indice}_mean")
+        if valor is None:
+            continue
+        linha = _linha(db, imagem.talhao_id, indice)
+        if linha is None:
+            linha = models.SerieIndiceTalhao(talhao_id=imagem.talhao_id, indice=indice)
+            _gravar(linha, np.array([imagem.data_imagem], dtype="datetime64[D]"), np.array([valor]))
+            db.add(linha)
+        else:
+            acrescentar(linha, imagem.data_imagem, valor)
+    db.commit()
+
+
+def recalcular(db: Session, talhao_id) -> None:
+    """Refaz as séries do talhão a partir de `imagens_satelite` (só as colunas dos índices)"""
+    IS = models.ImagemSatelite
+    colunas = [getattr(IS, f"{indice}_mean") for indice in INDICES]
+    linhas = db.query(IS.data_imagem, *colunas).filter(
+        IS.talhao_id == talhao_id
+    ).order_by(IS.data_imagem, IS.created_at).all()
+    agregados.marcar_populado(db, AGREGADO, talhao_id)
+    if not linhas:
+        db.commit()
+        return
+
+    dias = np.array([l[0] for l in linhas], dtype="datetime64[D]")
+    matriz = np.array([l[1:] for l in linhas], dtype=np.float64)
+    # Datas repetidas: vale a imagem gravada por último, como no caminho incremental
+    ultima = np.append(dias[1:] != dias[:-1], True)
+
+    for i, indice in enumerate(INDICES):
+        validos = ultima & ~np.isnan(matriz[:, i])
+        linha = _linha(db, talhao_id, indice)
+        if not validos.any():
+            if linha is not None:
+                db.delete(linha)
+            continue
+        if linha is None:
+            linha = models.SerieIndiceTalhao(talhao_id=talhao_id, indice=indice)
+            db.add(linha)
+        _gravar(linha, dias[validos], matriz[validos, i])
+    db.commit()
+
+
+def _ler(db: Session, talhao_id, indice: str):
+    S = models.SerieIndiceTalhao
+    return db.query(S.data_base, S.offsets, S.valores).filter(
+        S.talhao_id == talhao_id, S.indice == indice
+    ).first()
+
+
+def obter_serie(
+    db: Session,
+    talhao_id,
+    indice: str,
+    data_inicio: Optional[date] = None,
+    data_fim: Optional[date] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Datas e valores do índice no intervalo (uma linha lida; série vazia se não houver)"""
+    if indice in INDICES and not agregados.populado(db, AGREGADO, talhao_id):
+        # Talhão com imagens gravadas antes da tabela de séries
+        recalcular(db, talhao_id)
+    linha = _ler(db, talhao_id, indice)
+    if linha is None:
+        return np.array([], dtype="datetime64[D]"), np.array([], dtype=TIPO_VALOR)
+
+    dias, valores = decodificar(linha.data_base, linha.offsets, linha.valores)
+    inicio = np.searchsorted(dias, np.datetime64(data_inicio, "D")) if data_inicio else 0
+    fim = np.searchsorted(dias, np.datetime64(data_fim, "D"), side="right") if data_fim else dias.size
+    return dias[inicio:fim], valores[inicio:fim]
+
+
+def serie_json(dias: np.ndarray, valores: np.ndarray) -> list:
+    """Pontos {data, valor} com valores arredondados à precisão da tabela de imagens"""
+    return [
+        {"data": d, "valor": v}
+        for d, v in zip(np.datetime_as_string(dias, unit="D").tolist(),
+                        np.round(valores.astype(np.float64), 4).tolist())
+    ]
@@ -0,0 +1,591 @@
+#!/usr/bin/env python3
+"""
+Script de exemplo para testar o serviço de ML de produtividade
+sem precisar da API
+"""
+
+import sys
+import os
+import json
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import numpy as np
+from src.utils.ml_service import MLService, FEATURES, FORMATO_ARTEFATO
+
+def _dados_sinteticos(n=200, semente=11):
+    """Produtividade linear nas features, com ruído e alguns faltantes"""
+    rng = np.random.default_rng(semente)
+    X = np.column_stack([
+        rng.uniform(0.4, 0.9, n),
+        rng.uniform(0.2, 0.6, n),
+        rng.uniform(0.2, 0.7, n),
+        rng.uniform(1000, 2000, n),
+        rng.uniform(300, 800, n),
+        rng.uniform(5, 100, n)
+    ])
+    y = 1000 + 4000 * X[:, 0] + 1.0 * X[:, 3] + 0.5 * X[:, 4] + rng.normal(0, 100, n)
+    X[rng.integers(0, n, 10), 1] = np.nan
+    return X, y
+
+def _gerar_id(mapper, conexao, alvo):
+    """No banco o id vem de uuid_generate_v4(); no SQLite, do Python"""
+    from uuid import uuid4
+    if getattr(alvo, "id", False) is None:
+        alvo.id = uuid4()
+
+def _sessao_sqlite(*tabelas):
+    """Sessão SQLite em memória com as tabelas dadas (UUID como texto)"""
+    from sqlalchemy import create_engine, event
+    from sqlalchemy.dialects.postgresql import JSONB, UUID
+    from sqlalchemy.ext.compiler import compiles
+    from sqlalchemy.orm import Session
+    from src.config.database import Base
+
+    compiles(UUID, "sqlite")(lambda tipo, compilador, **kw: "CHAR(32)")
+    compiles(JSONB, "sqlite")(lambda tipo, compilador, **kw: "JSON")
+    if not event.contains(Base, "before_insert", _gerar_id):
+        event.listen(Base, "before_insert", _gerar_id, propagate=True)
+
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine, tables=[t.__table__ for t in tabelas if hasattr(t, "__table__")])
+    for tabela in tabelas:
+        if not hasattr(tabela, "__table__"):
+            tabela.create(engine)
+    return Session(engine)
+
+def _tabela_minima(nome, **colunas):
+    """Tabela só com id e as colunas dadas (no SQLite, no lugar de tabelas com geometria)"""
+    from sqlalchemy import Column, MetaData, Table
+    from sqlalchemy.dialects.postgresql import UUID
+    return Table(nome, MetaData(), Column("id", UUID(as_uuid=True), primary_key=True),
+                 *[Column(coluna, tipo) for coluna, tipo in colunas.items()])
+
+def testar_treinamento_cv():
+    """Testa treino com validação cruzada e o artefato JSON gerado"""
+
+    print("\n📊 Testando Treinamento com Validação Cruzada...")
+    print("-" * 40)
+
+    X, y = _dados_sinteticos()
+    service = MLService()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        caminho = os.path.join(tmp, "modelo.json")
+        resultado = service.treinar_modelo(X, y, caminho, k_folds=5)
+
+        assert resultado["sucesso"] and resultado["registros_treinamento"] == len(y)
+        assert resultado["validacao"]["r2"] > 0.8
+        assert 0 <= resultado["acuracia"] <= 1
+
+        with open(caminho) as f:
+            artefato = json.load(f)
+        assert artefato["versao_formato"] == FORMATO_ARTEFATO
+        assert artefato["features"] == FEATURES
+        assert len(artefato["coeficientes"]) == len(FEATURES)
+        assert not np.isnan(artefato["imputacao"]).any()
+
+        novo = MLService()
+        assert novo.carregar_modelo(caminho)
+        assert novo.modelo_atual["coeficientes"] == artefato["coeficientes"]
+
+    print(f"✅ R² (validação cruzada): {resultado['validacao']['r2']}")
+    return True
+
+def testar_treinos_interrompidos():
+    """Testa que só treinos de processos encerrados (ou antigos sem dono conhecido) viram erro"""
+
+    print("\n📊 Testando Treinos Interrompidos...")
+    print("-" * 40)
+
+    import subprocess
+    from datetime import datetime, timedelta
+    from uuid import uuid4
+    from src.models import models
+    from src.utils import ml_service
+
+    encerrado = subprocess.Popen([sys.executable, "-c", "pass"])
+    encerrado.wait()
+    vivo = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        db = _sessao_sqlite(models.ModeloML)
+        agora = datetime.utcnow()
+        antigo = agora - timedelta(minutes=ml_service.TREINO_TIMEOUT_MINUTOS + 1)
+        donos = {
+            "encerrado": ({"host": ml_service.socket.gethostname(), "pid": encerrado.pid}, agora),
+            "vivo": ({"host": ml_service.socket.gethostname(), "pid": vivo.pid}, antigo),
+            "outro_host": ({"host": "outro-host", "pid": 1}, agora),
+            "outro_host_antigo": ({"host": "outro-host", "pid": 1}, antigo),
+        }
+        for nome, (dono, criado) in donos.items():
+            db.add(models.ModeloML(id=uuid4(), fazenda_id=uuid4(), nome=nome, tipo="produtividade",
+                                   status="treinando", parametros={"dono": dono}, created_at=criado))
+        db.commit()
+
+        assert ml_service.encerrar_treinos_interrompidos(db) == 2
+        status = {m.nome: m.status for m in db.query(models.ModeloML)}
+        assert status == {"encerrado": "erro", "vivo": "treinando",
+                          "outro_host": "treinando", "outro_host_antigo": "erro"}
+        db.close()
+    finally:
+        vivo.kill()
+        vivo.wait()
+
+    print("✅ Treinos de outros workers em andamento preservados")
+    return True
+
+def testar_feature_store_incremental():
+    """Testa os agregados incrementais da feature store contra o cálculo direto"""
+
+    print("\n📊 Testando Feature Store Incremental...")
+    print("-" * 40)
+
+    from datetime import date, timedelta
+    from src.models import models
+    from src.utils import feature_store
+
+    rng = np.random.default_rng(2)
+    datas = sorted(date(2024, 10, 1) + timedelta(days=int(d))
+                   for d in rng.choice(150, 20, replace=False))
+    ndvi = rng.uniform(0.2, 0.9, len(datas))
+
+    linha = models.FeaturesProdutividade()
+    feature_store._zerar(linha)
+    for data, valor in zip(datas, ndvi):
+        feature_store._acumular_imagem(linha, data, {"ndvi": valor, "ndre": None, "msavi": None})
+
+    dias = np.array([(d - datas[0]).days for d in datas], dtype=float)
+    integral = np.sum(np.diff(dias) * (ndvi[1:] + ndvi[:-1]) / 2)
+    assert linha.n_imagens == len(datas)
+    assert np.isclose(linha.ndvi_medio, ndvi.mean())
+    assert np.isclose(linha.ndvi_pico, ndvi.max())
+    assert np.isclose(linha.ndvi_integral, integral)
+    assert linha.ndre_medio is None and linha.data_ultima_imagem == datas[-1]
+
+    # Índice que só aparece a partir da 6ª imagem: média só sobre os seus pontos
+    ndre = rng.uniform(0.1, 0.5, len(datas))
+    tardia = models.FeaturesProdutividade()
+    feature_store._zerar(tardia)
+    for i, (data, valor) in enumerate(zip(datas, ndre)):
+        feature_store._acumular_imagem(tardia, data, {"ndvi": None, "ndre": valor if i >= 5 else None, "msavi": None})
+    assert tardia.n_ndre == len(datas) - 5 and tardia.n_imagens == len(datas)
+    assert np.isclose(tardia.ndre_medio, ndre[5:].mean())
+
+    # Lacunas no meio: média só das observações; a integral repete o último valor
+    lacunas = [i % 3 != 1 for i in range(len(datas))]
+    linha_lacunas = models.FeaturesProdutividade()
+    feature_store._zerar(linha_lacunas)
+    for data, valor, presente in zip(datas, ndvi, lacunas):
+        feature_store._acumular_imagem(linha_lacunas, data, {"ndvi": valor if presente else None})
+    observados = ndvi[lacunas]
+    preenchido = np.array([ndvi[max(j for j in range(i + 1) if lacunas[j])] for i in range(len(datas))])
+    assert linha_lacunas.n_ndvi == len(observados)
+    assert np.isclose(linha_lacunas.ndvi_medio, observados.mean())
+    assert np.isclose(linha_lacunas.ndvi_integral, np.sum(np.diff(dias) * (preenchido[1:] + preenchido[:-1]) / 2))
+
+    print(f"✅ {len(datas)} imagens: média {linha.ndvi_medio:.3f}, integral {linha.ndvi_integral:.1f}")
+    return True
+
+def testar_feature_store_lote():
+    """Testa no SQLite o cálculo em lote das linhas faltantes contra o caminho incremental"""
+
+    print("\n📊 Testando Feature Store em Lote...")
+    print("-" * 40)
+
+    from datetime import date, datetime, timedelta
+    from uuid import uuid4
+    from src.models import models
+    from src.utils import feature_store
+
+    db = _sessao_sqlite(models.Safra, models.ImagemSatelite, models.DadosMeteorologicos,
+                        models.FeaturesProdutividade)
+    agora = datetime.utcnow()
+    safra = models.Safra(id=uuid4(), fazenda_id=uuid4(), nome="24/25", ano_inicio=2024, ano_fim=2025,
+                         data_inicio=date(2024, 9, 1), data_fim=date(2025, 3, 31), created_at=agora, updated_at=agora)
+    db.add(safra)
+    talhoes = [models.Talhao(id=uuid4(), fazenda_id=safra.fazenda_id, safra_id=safra.id,
+                             data_plantio=date(2024, 10, 1 + i)) for i in range(3)]
+    talhoes.append(models.Talhao(id=uuid4(), fazenda_id=safra.fazenda_id, safra_id=None))
+
+    rng = np.random.default_rng(6)
+    esperadas = {}
+    for t in talhoes[:3]:
+        esperada = models.FeaturesProdutividade()
+        feature_store._zerar(esperada)
+        # Uma imagem antes do plantio (fora da janela) e lacunas de NDRE
+        for dia in [-5] + sorted(rng.choice(150, 8, replace=False).tolist()):
+            data = t.data_plantio + timedelta(days=int(dia))
+            valores = {"ndvi": float(rng.uniform(0.2, 0.9)), "ndre": float(rng.uniform(0.1, 0.5)) if dia % 2 else None}
+            db.add(models.ImagemSatelite(id=uuid4(), talhao_id=t.id, data_imagem=data, created_at=agora,
+                                         ndvi_mean=valores["ndvi"], ndre_mean=valores["ndre"]))
+            if dia >= 0:
+                feature_store._acumular_imagem(esperada, data, valores)
+        for dia in range(-3, 40):
+            db.add(models.DadosMeteorologicos(id=uuid4(), fazenda_id=t.fazenda_id, talhao_id=t.id, created_at=agora,
+                                              data=t.data_plantio + timedelta(days=dia), gdd_dia=10.0, precipitacao=2.0))
+        esperada.gdd_acumulado, esperada.precipitacao_acumulada = 400.0, 80.0
+        esperadas[t.id] = esperada
+    db.commit()
+
+    assert feature_store.recalcular_lote(db, talhoes) == 3
+    obtidas = {f.talhao_id: f for f in db.query(models.FeaturesProdutividade)}
+    assert set(obtidas) == set(esperadas)
+    for talhao_id, esperada in esperadas.items():
+        obtida = obtidas[talhao_id]
+        for campo in ("n_imagens", "n_ndvi", "n_ndre", "data_primeira_imagem", "data_ultima_imagem"):
+            assert getattr(obtida, campo) == getattr(esperada, campo), campo
+        for campo in ("ndvi_medio", "ndvi_integral", "ndre_medio", "ndre_pico", "gdd_acumulado", "precipitacao_acumulada"):
+            assert np.isclose(getattr(obtida, campo), getattr(esperada, campo)), campo
+
+    # _linha: upsert não duplica nem zera a linha existente; cria a que falta
+    existente = feature_store._linha(db, talhoes[0].id, safra.id)
+    assert existente.n_imagens == esperadas[talhoes[0].id].n_imagens
+    nova = feature_store._linha(db, talhoes[3].id, safra.id)
+    assert nova.n_imagens == 0 and nova.gdd_acumulado == 0.0
+    assert db.query(models.FeaturesProdutividade).count() == 4
+    db.close()
+
+    print(f"✅ {len(esperadas)} talhões calculados em lote, iguais ao caminho incremental")
+    return True
+
+def testar_predicao_deterministica():
+    """Testa que a predição é determinística, memorizada e igual à versão em lote"""
+
+    print("\n📊 Testando Predição Determinística...")
+    print("-" * 40)
+
+    from src.utils.ml_service import _prever_memo
+
+    entrada = {"ndvi": 0.71234, "ndre": 0.35, "msavi": None, "gdd": 1500.04,
+               "precipitacao": 620, "area": 42, "cultura": "Soja"}
+
+    service = MLService()
+    referencia = service.prever_produtividade(entrada)
+    assert referencia["metodo"] == "referencia"
+    assert service.prever_produtividade(entrada) == referencia
+
+    X, y = _dados_sinteticos()
+    with tempfile.TemporaryDirectory() as tmp:
+        caminho = os.path.join(tmp, "modelo.json")
+        MLService().treinar_modelo(X, y, caminho)
+        assert service.carregar_modelo(caminho)
+
+    _prever_memo.cache_clear()
+    primeira = service.prever_produtividade(entrada)
+    segunda = service.prever_produtividade({**entrada, "ndvi": 0.71231})
+    assert primeira == segunda and primeira["metodo"] == "modelo_ml"
+    assert _prever_memo.cache_info().hits == 1
+
+    arredondada = {**entrada, "ndvi": 0.7123, "gdd": 1500.0}
+    lote = service.prever_produtividade_lote({
+        chave: [arredondada[chave]] for chave in ("ndvi", "ndre", "msavi", "gdd", "precipitacao", "area", "cultura")
+    })
+    assert np.isclose(lote["produtividade"][0], primeira["produtividade"], atol=0.01)
+
+    print(f"✅ Referência {referencia['produtividade']} kg/ha, modelo {primeira['produtividade']} kg/ha")
+    return True
+
+def testar_metricas_erro_incrementais():
+    """Testa as métricas acumuladas (inclusão e correção) contra avaliar_modelo"""
+
+    print("\n📊 Testando Métricas de Erro Incrementais...")
+    print("-" * 40)
+
+    from src.models import models
+    from src.utils import metricas_erro
+
+    rng = np.random.default_rng(8)
+    reais = rng.uniform(2000, 5000, 300)
+    preditos = reais + rng.normal(0, 250, 300)
+
+    linha = models.MetricaErroModelo(n=0)
+    for predito, real in zip(preditos, reais):
+        metricas_erro.acumular(linha, predito, real)
+
+    # Corrigir algumas produtividades reais: remove a anterior e inclui a nova
+    for i in range(0, 300, 7):
+        metricas_erro.acumular(linha, preditos[i], reais[i], sinal=-1)
+        reais[i] *= 1.05
+        metricas_erro.acumular(linha, preditos[i], reais[i])
+
+    esperado = MLService().avaliar_modelo(preditos.tolist(), reais.tolist())
+    obtido = metricas_erro.resumo(linha)
+    for chave in ("rmse", "mae", "r2", "mape", "n_amostras"):
+        assert np.isclose(obtido[chave], esperado[chave], atol=0.011), chave
+
+    print(f"✅ RMSE {obtido['rmse']}, R² {obtido['r2']} conferem com avaliar_modelo")
+
+    # Reais zerados ficam fora do MAPE; sem nenhum real válido, MAPE e R² são nulos
+    avaliacao = MLService().avaliar_modelo([100.0, 50.0], [0.0, 100.0])
+    assert avaliacao["mape"] == 50.0
+    avaliacao = MLService().avaliar_modelo([10.0, 20.0], [0.0, 0.0])
+    assert avaliacao["mape"] is None and avaliacao["r2"] is None
+    print("✅ MAPE ignora reais zerados (sem inf nas métricas)")
+    return True
+
+def testar_metricas_reais_legados():
+    """Testa que reais gravados antes das métricas não são subtraídos e entram pelo backfill"""
+
+    print("\n📊 Testando Métricas com Reais Legados...")
+    print("-" * 40)
+
+    from datetime import datetime
+    from uuid import uuid4
+    from src.models import models
+    from src.utils import metricas_erro
+
+    from sqlalchemy import String
+    from sqlalchemy.dialects.postgresql import UUID
+    talhoes = _tabela_minima("talhoes", fazenda_id=UUID(as_uuid=True), cultura=String(100))
+    db = _sessao_sqlite(models.PredicaoProdutividade, models.MetricaErroModelo, talhoes)
+    talhao = models.Talhao(id=uuid4(), fazenda_id=uuid4(), cultura="soja")
+    modelo_id = uuid4()
+    agora = datetime.utcnow()
+    legados = [
+        models.PredicaoProdutividade(id=uuid4(), modelo_id=modelo_id, talhao_id=talhao.id,
+                                     produtividade_predita=3000.0 + i * 100, produtividade_real=3100.0 + i * 50,
+                                     data_predicao=agora, created_at=agora)
+        for i in range(3)
+    ]
+    db.add_all(legados)
+    db.commit()
+
+    # Correção de um real legado: nada a remover, só inclui o novo
+    legados[0].produtividade_real, anterior = 2900.0, legados[0].produtividade_real
+    metricas_erro.registrar_real(db, legados[0], talhao, anterior)
+    db.commit()
+    linha = db.query(models.MetricaErroModelo).filter_by(escopo="modelo").one()
+    assert linha.n == 1 and linha.soma_erro_abs == 100.0 and legados[0].contabilizado
+
+    # Backfill dos demais
+    db.execute(talhoes.insert().values(id=talhao.id, fazenda_id=talhao.fazenda_id, cultura="soja"))
+    assert metricas_erro.contabilizar_pendentes(db) == 2
+    assert metricas_erro.contabilizar_pendentes(db) == 0
+
+    linhas = {l.escopo: l for l in db.query(models.MetricaErroModelo)}
+    assert set(linhas) == {"modelo", "cultura"} and all(l.n == 3 for l in linhas.values())
+    reais = np.array([p.produtividade_real for p in legados])
+    preditos = np.array([p.produtividade_predita for p in legados])
+    assert np.isclose(linhas["modelo"].soma_erro_abs, np.abs(preditos - reais).sum())
+    assert np.isclose(linhas["modelo"].m2_real, ((reais - reais.mean()) ** 2).sum())
+    db.close()
+
+    print("✅ Reais legados contabilizados uma vez, sem somas negativas")
+    return True
+
+def testar_saude_talhoes():
+    """Testa a classificação de saúde (Python e SQL) e o upsert da última imagem"""
+
+    print("\n📊 Testando Saúde dos Talhões...")
+    print("-" * 40)
+
+    from sqlalchemy import column, select
+    from sqlalchemy.dialects import postgresql
+    from sqlalchemy.dialects.postgresql import insert
+    from src.models import models
+    from src.utils import saude_talhoes
+
+    casos = {0.85: "saudavel", 0.6: "atencao", 0.45: "atencao", 0.3: "atencao", 0.1: "critico", None: None}
+    for ndvi, esperado in casos.items():
+        assert saude_talhoes.classificar_saude(ndvi) == esperado, ndvi
+
+    ndvi = column("ndvi")
+    sql = str(saude_talhoes._status_sql(ndvi).compile(
+        dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+    assert "ndvi > 0.6" in sql and "ndvi < 0.3" in sql and "ndvi IS NOT NULL" in sql
+
+    upsert = str(saude_talhoes._upsert(insert(models.UltimaImagemTalhao).from_select(
+        ("talhao_id",) + saude_talhoes.CAMPOS, select(*[column(c) for c in ("talhao_id",) + saude_talhoes.CAMPOS])
+    )).compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (talhao_id) DO UPDATE" in upsert
+    assert "WHERE excluded.data_imagem >= ultima_imagem_talhao.data_imagem" in upsert
+
+    print("✅ Limites 0.3/0.6 do dashboard preservados; imagem antiga não substitui a última")
+    return True
+
+def testar_saude_talhoes_backfill():
+    """Testa no SQLite a ordem entre upsert da ingestão e backfill das imagens antigas"""
+
+    print("\n📊 Testando Backfill da Saúde dos Talhões...")
+    print("-" * 40)
+
+    from datetime import date, datetime
+    from uuid import uuid4
+    from sqlalchemy.dialects.postgresql import UUID
+    from src.models import models
+    from src.utils import saude_talhoes
+
+    talhoes = _tabela_minima("talhoes", fazenda_id=UUID(as_uuid=True), safra_id=UUID(as_uuid=True))
+    fazendas = _tabela_minima("fazendas")
+    db = _sessao_sqlite(models.ImagemSatelite, models.UltimaImagemTalhao, models.AgregadoPopulado,
+                        talhoes, fazendas)
+    fazenda_a, fazenda_b = uuid4(), uuid4()
+    talhao_a, talhao_b = uuid4(), uuid4()
+    db.execute(fazendas.insert(), [{"id": fazenda_a}, {"id": fazenda_b}])
+    db.execute(talhoes.insert(), [{"id": talhao_a, "fazenda_id": fazenda_a},
+                                  {"id": talhao_b, "fazenda_id": fazenda_b}])
+
+    def gravar(talhao_id, dia, ndvi, safra_id=None, mes=11):
+        imagem = models.ImagemSatelite(id=uuid4(), talhao_id=talhao_id, safra_id=safra_id,
+                                       data_imagem=date(2024, mes, dia), ndvi_mean=ndvi,
+                                       created_at=datetime.utcnow())
+        db.add(imagem)
+        db.commit()
+        return imagem
+
+    def ultima(talhao_id):
+        db.expire_all()
+        return db.get(models.UltimaImagemTalhao, talhao_id)
+
+    # Imagens gravadas antes da tabela
+    gravar(talhao_a, 1, 0.8)
+    gravar(talhao_a, 20, 0.2)
+    gravar(talhao_b, 5, 0.7)
+
+    # Ingestão de uma imagem intermediária cria a linha do talhão antes do backfill
+    saude_talhoes.registrar_imagem(db, gravar(talhao_a, 10, 0.5))
+    assert ultima(talhao_a).data_imagem == date(2024, 11, 10)
+
+    # A linha já existente não impede o backfill da fazenda; a imagem mais recente vence
+    saude_talhoes.garantir(db, fazenda_a)
+    assert (ultima(talhao_a).data_imagem, ultima(talhao_a).status_saude) == (date(2024, 11, 20), "critico")
+    assert ultima(talhao_b) is None
+
+    # Imagem antiga não substitui; a do mesmo dia ou mais nova, sim
+    saude_talhoes.registrar_imagem(db, gravar(talhao_a, 15, 0.9))
+    assert ultima(talhao_a).data_imagem == date(2024, 11, 20)
+    saude_talhoes.registrar_imagem(db, gravar(talhao_a, 20, 0.9))
+    assert ultima(talhao_a).status_saude == "saudavel"
+
+    # Sem fazenda: popula só as pendentes, uma vez
+    saude_talhoes.garantir(db)
+    assert ultima(talhao_b).status_saude == "saudavel"
+    assert ultima(talhao_a).status_saude == "saudavel"
+    assert saude_talhoes.contar_status(db) == {"saudavel": 2, "atencao": 0, "critico": 0}
+    assert db.query(models.AgregadoPopulado).count() == 2
+
+    # Safra passada: conta a última imagem do talhão naquela safra, não a última geral
+    safra_passada = uuid4()
+    gravar(talhao_a, 1, 0.2, safra_passada, mes=3)
+    gravar(talhao_a, 20, 0.5, safra_passada, mes=3)
+    gravar(talhao_b, 10, 0.1, safra_passada, mes=3)
+    assert saude_talhoes.contar_status(db, fazenda_a, safra_passada) == {"saudavel": 0, "atencao": 1, "critico": 0}
+    assert saude_talhoes.contar_status(db, None, safra_passada) == {"saudavel": 0, "atencao": 1, "critico": 1}
+    ultimas = saude_talhoes.ultimas_atualizacoes(db, None, safra_passada)
+    assert [(u.talhao_id, u.data_imagem) for u in ultimas] == [(talhao_a, date(2024, 3, 20)),
+                                                                (talhao_b, date(2024, 3, 10))]
+    assert saude_talhoes.contar_status(db, fazenda_a) == {"saudavel": 1, "atencao": 0, "critico": 0}
+    db.close()
+
+    print("✅ Backfill por fazenda, sem regredir a última imagem gravada pela ingestão")
+    print("✅ Filtro de safra pelas imagens da safra")
+    return True
+
+def testar_serie_compacta_indices():
+    """Testa a série colunar (offsets int32 + float32): acréscimo, fora de ordem e recorte"""
+
+    print("\n📊 Testando Série Compacta de Índices...")
+    print("-" * 40)
+
+    from datetime import date, timedelta
+    from src.models import models
+    from src.utils import series_indices
+
+    rng = np.random.default_rng(4)
+    inicio = date(2024, 10, 1)
+    pontos = {inicio + timedelta(days=int(d)): float(v)
+              for d, v in zip(rng.choice(200, 40, replace=False), rng.uniform(0.2, 0.9, 40))}
+    ordem = list(pontos.items())
+    rng.shuffle(ordem)
+
+    linha = models.SerieIndiceTalhao()
+    primeira_data, primeiro_valor = ordem[0]
+    series_indices._gravar(linha, np.array([primeira_data], dtype="datetime64[D]"), np.array([primeiro_valor]))
+    for data, valor in ordem[1:]:
+        series_indices.acrescentar(linha, data, valor)
+    # Data repetida substitui o valor
+    series_indices.acrescentar(linha, ordem[5][0], 0.5)
+    pontos[ordem[5][0]] = 0.5
+
+    datas = sorted(pontos)
+    dias, valores = series_indices.decodificar(linha.data_base, linha.offsets, linha.valores)
+    assert linha.n_pontos == len(datas) and linha.data_ultima == datas[-1]
+    assert dias.tolist() == datas
+    assert np.allclose(valores, [pontos[d] for d in datas], atol=1e-6)
+    assert len(linha.offsets) == len(linha.valores) == 4 * len(datas)
+
+    serie = series_indices.serie_json(dias[:3], valores[:3])
+    assert serie[0] == {"data": datas[0].isoformat(), "valor": round(pontos[datas[0]], 4)}
+
+    print(f"✅ {len(datas)} pontos em {len(linha.offsets) + len(linha.valores)} bytes, ordenados e sem duplicatas")
+    return True
+
+def testar_series_backfill():
+    """Testa no SQLite que a primeira imagem ingerida traz o histórico do talhão para a série"""
+
+    print("\n📊 Testando Backfill das Séries de Índices...")
+    print("-" * 40)
+
+    from datetime import date, datetime
+    from uuid import uuid4
+    from src.models import models
+    from src.utils import series_indices
+
+    db = _sessao_sqlite(models.ImagemSatelite, models.SerieIndiceTalhao, models.AgregadoPopulado)
+    talhao_a, talhao_b = uuid4(), uuid4()
+
+    def gravar(talhao_id, dia, ndvi, ndre=None):
+        imagem = models.ImagemSatelite(id=uuid4(), talhao_id=talhao_id, data_imagem=date(2024, 11, dia),
+                                       ndvi_mean=ndvi, ndre_mean=ndre, created_at=datetime.utcnow())
+        db.add(imagem)
+        db.commit()
+        return imagem
+
+    # Imagens gravadas antes da tabela de séries
+    gravar(talhao_a, 1, 0.3)
+    gravar(talhao_a, 8, 0.4, 0.2)
+    gravar(talhao_b, 3, 0.6)
+
+    # A primeira ingestão cria as linhas com o histórico, não só com a imagem nova
+    series_indices.registrar_imagem(db, gravar(talhao_a, 15, 0.5, 0.25))
+    dias, valores = series_indices.obter_serie(db, talhao_a, "ndvi")
+    assert [d.day for d in dias.tolist()] == [1, 8, 15]
+    assert np.allclose(valores, [0.3, 0.4, 0.5])
+    assert series_indices.obter_serie(db, talhao_a, "ndre")[0].size == 2
+
+    # Depois, caminho incremental
+    series_indices.registrar_imagem(db, gravar(talhao_a, 22, 0.6))
+    assert series_indices.obter_serie(db, talhao_a, "ndvi")[0].size == 4
+
+    # Leitura de talhão ainda não ingerido também traz o histórico
+    dias, valores = series_indices.obter_serie(db, talhao_b, "ndvi")
+    assert [d.day for d in dias.tolist()] == [3] and np.isclose(valores[0], 0.6)
+    assert series_indices.obter_serie(db, uuid4(), "ndvi")[0].size == 0
+    db.close()
+
+    print("✅ Histórico incluído na primeira ingestão ou leitura de cada talhão")
+    return True
+
+def main():
+    resultados = [
+        ("Treinamento com Validação Cruzada", testar_treinamento_cv()),
+        ("Treinos Interrompidos", testar_treinos_interrompidos()),
+        ("Feature Store Incremental", testar_feature_store_incremental()),
+        ("Feature Store em Lote", testar_feature_store_lote()),
+        ("Predição Determinística", testar_predicao_deterministica()),
+        ("Métricas de Erro Incrementais", testar_metricas_erro_incrementais()),
+        ("Métricas com Reais Legados", testar_metricas_reais_legados()),
+        ("Saúde dos Talhões", testar_saude_talhoes()),
+        ("Backfill da Saúde dos Talhões", testar_saude_talhoes_backfill()),
+        ("Série Compacta de Índices", testar_serie_compacta_indices()),
+        ("Backfill das Séries de Índices", testar_series_backfill()),
+    ]
+
+    for nome, sucesso in resultados:
+        status = "✅ PASSOU" if sucesso else "❌ FALHOU"
+        print(f"{nome}: {status}")
+
+    return 0 if all(r[1] for r in resultados) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
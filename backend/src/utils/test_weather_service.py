@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+"""
+Script de exemplo para testar o serviço de clima
+sem precisar da API
+"""
+
+import sys
+import os
+import time
+import asyncio
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import httpx
+from src.utils.weather_service import WeatherService
+
+def _resposta_clima(temp=25.0):
+    return {
+        "main": {"temp": temp, "temp_max": temp + 3, "temp_min": temp - 3,
+                 "humidity": 60, "pressure": 1013},
+        "wind": {"speed": 3.5, "deg": 90},
+        "weather": [{"description": "céu limpo", "icon": "01d"}],
+        "sys": {"sunrise": 1700000000, "sunset": 1700043200}
+    }
+
+def _resposta_previsao(dias=5):
+    itens = []
+    for i in range(dias * 8):
+        dia, hora = divmod(i, 8)
+        itens.append({
+            "dt": 1704844800 + i * 10800,
+            "dt_txt": f"2024-01-{dia + 10:02d} {hora * 3:02d}:00:00",
+            "main": {"temp": 20 + hora, "humidity": 50 + hora},
+            "weather": [{"description": "nublado" if hora % 3 else "chuva leve", "icon": f"0{hora % 4 + 1}d"}],
+            "pop": hora / 10,
+            "rain": {"3h": 1.5} if hora % 3 == 0 else {}
+        })
+    return {"list": itens}
+
+def _servico_contando(chamadas):
+    """WeatherService com transporte local que conta as requisições"""
+    async def responder(request):
+        chamadas.append(request.url.path)
+        await asyncio.sleep(0.01)
+        if request.url.path.endswith("/forecast"):
+            return httpx.Response(200, json=_resposta_previsao())
+        return httpx.Response(200, json=_resposta_clima())
+
+    service = WeatherService(transport=httpx.MockTransport(responder))
+    service.api_key = "teste"
+    return service
+
+def testar_cache_e_requisicao_unica():
+    """Testa requisição única para chamadas simultâneas e validade do cache"""
+
+    print("\n📊 Testando Cache e Requisição Única...")
+    print("-" * 40)
+
+    chamadas = []
+    service = _servico_contando(chamadas)
+
+    async def cenario():
+        # 20 requisições simultâneas da mesma fazenda: uma chamada à API
+        resultados = await asyncio.gather(
+            *[service.obter_clima_atual(-15.7801, -47.9292) for _ in range(20)]
+        )
+        assert len(chamadas) == 1
+        assert all(r == resultados[0] for r in resultados)
+        assert resultados[0]["temperatura"] == 25.0
+
+        # Dentro do TTL: cache
+        await service.obter_clima_atual(-15.7801, -47.9292)
+        assert len(chamadas) == 1
+
+        # Previsão tem chave e TTL próprios
+        previsao = await service.obter_previsao(-15.7801, -47.9292, dias=3)
+        await service.obter_previsao(-15.7801, -47.9292, dias=5)
+        assert len(previsao) == 3
+        assert len(chamadas) == 2
+
+        # TTL expirado: nova requisição
+        service.ttl_clima_atual = 0
+        service._cache.clear()
+        await service.obter_clima_atual(-15.7801, -47.9292)
+        await service.obter_clima_atual(-15.7801, -47.9292)
+        assert len(chamadas) == 4
+
+        await service.fechar()
+
+    asyncio.run(cenario())
+    print(f"✅ {len(chamadas)} requisições para 25 consultas")
+
+    return True
+
+def testar_falha_sem_cache():
+    """Testa que erro da API cai no simulado e não fica em cache"""
+
+    print("\n📊 Testando Falha da API...")
+    print("-" * 40)
+
+    chamadas = []
+
+    def responder(request):
+        chamadas.append(request.url.path)
+        return httpx.Response(503)
+
+    service = WeatherService(transport=httpx.MockTransport(responder))
+    service.api_key = "teste"
+
+    async def cenario():
+        for _ in range(2):
+            clima = await service.obter_clima_atual(-15.78, -47.93)
+            assert clima["fonte"] == "simulado"
+        await service.fechar()
+
+    asyncio.run(cenario())
+    assert len(chamadas) == 2 and not service._em_andamento
+    print("✅ Erro não reaproveitado do cache")
+
+    return True
+
+def testar_grade_compartilhada():
+    """Testa fazendas vizinhas compartilhando a consulta da célula da grade"""
+
+    print("\n📊 Testando Grade de Cache...")
+    print("-" * 40)
+
+    chamadas = []
+    service = _servico_contando(chamadas)
+    service.grade_graus = 0.05
+
+    # Duas fazendas a ~1 km na mesma célula e uma a ~20 km
+    vizinhas = [(-15.7801, -47.9292), (-15.7712, -47.9203)]
+    distante = (-15.9600, -47.9292)
+
+    chave_a, lat_a, lon_a = service.celula(*vizinhas[0])
+    chave_b, _, _ = service.celula(*vizinhas[1])
+    assert chave_a == chave_b and service.celula(*distante)[0] != chave_a
+    assert abs(lat_a - vizinhas[0][0]) <= 0.025 and abs(lon_a - vizinhas[0][1]) <= 0.025
+
+    async def cenario():
+        await asyncio.gather(*[service.obter_clima_atual(lat, lon) for lat, lon in vizinhas * 5])
+        assert len(chamadas) == 1
+        await service.obter_clima_atual(*distante)
+        assert len(chamadas) == 2
+
+        # Grade desligada: coordenada exata
+        service.grade_graus = 0
+        await service.obter_clima_atual(*vizinhas[0])
+        await service.obter_clima_atual(*vizinhas[1])
+        assert len(chamadas) == 4
+        await service.fechar()
+
+    asyncio.run(cenario())
+    print(f"✅ Célula de {vizinhas[0]}: centro ({lat_a:.3f}, {lon_a:.3f})")
+
+    return True
+
+def testar_agregacao_previsoes():
+    """Testa a agregação por dia de vários payloads contra o cálculo direto"""
+
+    print("\n📊 Testando Agregação das Previsões...")
+    print("-" * 40)
+
+    from collections import Counter
+    from src.utils.weather_service import agregar_previsoes
+
+    payloads = [_resposta_previsao(5), {}, _resposta_previsao(3)]
+    payloads[2]["list"][4]["main"]["temp"] = 40.0
+    resultado = agregar_previsoes(payloads, dias=4)
+
+    assert [len(r) for r in resultado] == [4, 0, 3]
+    for payload, dias in zip(payloads, resultado):
+        for dia in dias:
+            itens = [i for i in payload["list"] if i["dt_txt"].startswith(dia["data_previsao"])]
+            temps = [i["main"]["temp"] for i in itens]
+            descricoes = Counter(i["weather"][0]["description"] for i in itens)
+            assert dia["temp_max"] == max(temps) and dia["temp_min"] == min(temps)
+            assert dia["umidade"] == sum(i["main"]["humidity"] for i in itens) / len(itens)
+            assert dia["descricao"] == descricoes.most_common(1)[0][0]
+            assert dia["icone"] == itens[len(itens) // 2]["weather"][0]["icon"]
+            assert dia["precipitacao_volume"] == sum(i.get("rain", {}).get("3h", 0) for i in itens)
+
+    assert resultado[2][0]["temp_max"] == 40.0
+    assert resultado[0][0]["precipitacao_volume"] == 4.5
+
+    print(f"✅ {sum(len(r) for r in resultado)} dias de {len(payloads)} payloads")
+
+    return True
+
+def testar_atualizacao_previsoes():
+    """Testa a busca em lote das previsões e o upsert por fazenda/dia"""
+
+    print("\n📊 Testando Atualização das Previsões...")
+    print("-" * 40)
+
+    from collections import namedtuple
+    from uuid import uuid4
+    from sqlalchemy.dialects import postgresql
+    from src.utils import atualizacao_previsao
+
+    Fazenda = namedtuple("Fazenda", "id latitude longitude")
+    fazendas = [Fazenda(uuid4(), -15.78 + i * 0.001, -47.93) for i in range(4)]
+    fazendas += [Fazenda(uuid4(), -12.5, -55.7 + i * 0.001) for i in range(3)]
+
+    chamadas = []
+    service = _servico_contando(chamadas)
+
+    async def cenario():
+        linhas = await atualizacao_previsao.buscar_previsoes(fazendas, service, dias=5, concorrencia=3)
+        await service.fechar()
+        return linhas
+
+    linhas = asyncio.run(cenario())
+    assert len(chamadas) == 2
+    assert len(linhas) == len(fazendas) * 5
+    assert len({(l["fazenda_id"], l["data_previsao"]) for l in linhas}) == len(linhas)
+
+    sql = str(atualizacao_previsao.montar_upsert(linhas[:2]).compile(dialect=postgresql.dialect()))
+    assert "ON CONFLICT (fazenda_id, data_previsao) DO UPDATE" in sql
+    assert "temp_max = excluded.temp_max" in sql
+
+    # Falha da API com chave configurada: nada é gravado por cima
+    def indisponivel(request):
+        return httpx.Response(503)
+
+    service = WeatherService(transport=httpx.MockTransport(indisponivel))
+    service.api_key = "teste"
+    assert asyncio.run(atualizacao_previsao.buscar_previsoes(fazendas[:2], service)) == []
+
+    # Sem chave: previsão simulada nunca é gravada e o job não é iniciado
+    service = WeatherService(transport=httpx.MockTransport(indisponivel))
+    service.api_key = ""
+    assert asyncio.run(atualizacao_previsao.buscar_previsoes(fazendas[:2], service)) == []
+    assert not atualizacao_previsao.job_ativo(service)
+
+    print(f"✅ {len(linhas)} dias de {len(fazendas)} fazendas em {len(chamadas)} requisições")
+
+    return True
+
+def _serie_sintetica(anos=10, semente=5):
+    """Temperaturas diárias com sazonalidade (verão em janeiro) e ruído"""
+    import numpy as np
+
+    rng = np.random.default_rng(semente)
+    datas = np.arange(np.datetime64("2010-01-01"), np.datetime64(f"{2010 + anos}-01-01"))
+    fase = 2 * np.pi * (datas - datas[0]).astype(float) / 365.25
+    media = 24 + 4 * np.cos(fase)
+    return {
+        "data": datas,
+        "temp_max": media + 5 + rng.normal(0, 1, datas.size),
+        "temp_min": media - 5 + rng.normal(0, 1, datas.size),
+        "precipitacao": rng.gamma(0.5, 8, datas.size)
+    }
+
+def testar_metodos_gdd():
+    """Testa os métodos de GDD contra a integração numérica da senoide"""
+
+    print("\n📊 Testando Métodos de GDD...")
+    print("-" * 40)
+
+    import numpy as np
+    from src.utils import graus_dia
+
+    # Método media: mesma fórmula usada até aqui no POST /dados (base 10, teto 30)
+    gdd = graus_dia.calcular_gdd([32.0, 25.0, 12.0, np.nan], [18.0, 8.0, 5.0, 15.0])
+    assert np.allclose(gdd[:3], [14.0, 7.5, 1.0]) and np.isnan(gdd[3])
+
+    def integral_senoide(t_max, t_min, base, teto):
+        t = np.linspace(-np.pi, np.pi, 200001)
+        temperatura = (t_max + t_min) / 2 + (t_max - t_min) / 2 * np.sin(t)
+        return np.mean(np.clip(temperatura, base, teto) - base)
+
+    # Todos os casos: abaixo da base, cruzando a base, entre limites, cruzando o teto, acima do teto
+    temp_max = np.array([8.0, 18.0, 28.0, 36.0, 40.0, 20.0, 33.0])
+    temp_min = np.array([2.0, 4.0, 14.0, 22.0, 32.0, 20.0, 6.0])
+    esperado = [integral_senoide(tx, tn, 10.0, 30.0) for tx, tn in zip(temp_max, temp_min)]
+    obtido = graus_dia.calcular_gdd(temp_max, temp_min, cultura="milho", metodo="seno_simples")
+    assert np.allclose(obtido, esperado, atol=1e-3)
+
+    # Seno duplo: média das metades com a mínima do dia e a do dia seguinte
+    datas = np.array(["2024-01-01", "2024-01-02", "2024-01-04"], dtype="datetime64[D]")
+    duplo = graus_dia.calcular_gdd([30.0, 28.0, 31.0], [12.0, 18.0, 15.0], cultura="milho",
+                                   datas=datas, metodo="seno_duplo")
+    meia = integral_senoide(30.0, 12.0, 10.0, 30.0), integral_senoide(30.0, 18.0, 10.0, 30.0)
+    assert np.isclose(duplo[0], sum(meia) / 2, atol=1e-3)
+    # 02/01 -> 04/01 não é consecutivo: seno simples
+    assert np.isclose(duplo[1], integral_senoide(28.0, 18.0, 10.0, 30.0), atol=1e-3)
+
+    p = graus_dia.parametros("Soja", temperatura_teto=28.0)
+    assert p["temperatura_base"] == 7.0 and p["temperatura_teto"] == 28.0
+    assert graus_dia.parametros("desconhecida")["temperatura_base"] == 10.0
+    try:
+        graus_dia.parametros("milho", metodo="inexistente")
+        raise AssertionError("Método inexistente deveria falhar")
+    except ValueError:
+        pass
+
+    n = 1_000_000
+    rng = np.random.default_rng(1)
+    inicio = time.perf_counter()
+    graus_dia.calcular_gdd(rng.uniform(20, 38, n), rng.uniform(5, 22, n), "milho", metodo="seno_duplo")
+    duracao = time.perf_counter() - inicio
+    assert duracao < 2.0
+
+    print(f"✅ Métodos {sorted(graus_dia.METODOS_GDD)}; 1 milhão de dias (seno duplo) em {duracao * 1000:.0f} ms")
+
+    return True
+
+def testar_climatologia_gdd():
+    """Testa GDD vetorizado, normais por dia do ano e projeção da maturação"""
+
+    print("\n📊 Testando Climatologia e GDD...")
+    print("-" * 40)
+
+    import numpy as np
+    from datetime import date
+    from src.utils import climatologia
+
+    indices = climatologia.dia_do_ano(np.array(["2024-02-28", "2024-02-29", "2024-03-01",
+                                                "2023-03-01", "2024-12-31"], dtype="datetime64[D]"))
+    assert indices.tolist() == [58, 58, 59, 59, 364]
+
+    serie = _serie_sintetica()
+    serie["temp_max"][100:130] = np.nan
+    normais = climatologia.calcular_normais(serie, "milho")
+    gdd_normal = normais["gdd_normal"]
+    assert normais["n_anos"] == 10 and gdd_normal.shape == (365,)
+    assert np.isfinite(gdd_normal).all()
+    # Janeiro mais quente que julho
+    assert gdd_normal[:31].mean() > gdd_normal[181:212].mean()
+
+    # Projeção: soma da normal a partir do dia seguinte até atingir o requerido
+    data_maturacao, dias = climatologia.projetar_maturacao(gdd_normal, 400.0, 1400.0, date(2024, 11, 1))
+    inicio = climatologia.dia_do_ano(np.datetime64("2024-11-02"))
+    acumulado = 400 + np.cumsum(np.roll(gdd_normal, -int(inicio)).tolist() * 2)
+    assert dias == int(np.argmax(acumulado >= 1400)) + 1
+    assert (data_maturacao - date(2024, 11, 1)).days == dias
+    assert climatologia.projetar_maturacao(gdd_normal, 1500.0, 1400.0, date(2024, 11, 1)) == (date(2024, 11, 1), 0)
+    assert climatologia.projetar_maturacao(np.zeros(365), 0.0, 1400.0, date(2024, 11, 1)) == (None, None)
+
+    print(f"✅ Normal de {normais['n_anos']} anos; maturação do milho em {data_maturacao} ({dias} dias)")
+
+    return True
+
+def testar_leitura_csv_historico():
+    """Testa leitura do CSV com aliases, vírgula decimal e Kelvin"""
+
+    print("\n📊 Testando Leitura do Histórico em CSV...")
+    print("-" * 40)
+
+    import io
+    import numpy as np
+    from src.utils import climatologia
+
+    inmet = io.StringIO(
+        "Data;Tmax;Tmin;Chuva\n"
+        "2020-01-01;31,2;19,8;12,4\n"
+        "2020-01-02;30,0;20,1;\n"
+        "invalida;1;1;1\n"
+    )
+    serie = climatologia.ler_csv(inmet)
+    assert serie["data"].tolist()[0].isoformat() == "2020-01-01" and serie["data"].size == 2
+    assert np.allclose(serie["temp_max"], [31.2, 30.0])
+    assert serie["precipitacao"][0] == 12.4 and np.isnan(serie["precipitacao"][1])
+
+    era5 = io.StringIO("time,t2m_max,t2m_min,tp\n2020-01-01,304.35,293.15,0.5\n")
+    serie = climatologia.ler_csv(era5)
+    assert np.allclose([serie["temp_max"][0], serie["temp_min"][0]], [31.2, 20.0])
+
+    try:
+        climatologia.ler_csv(io.StringIO("data,chuva\n2020-01-01,3\n"))
+        raise AssertionError("CSV sem temperaturas deveria falhar")
+    except ValueError:
+        pass
+
+    print("✅ INMET (;) e ERA5 (K) lidos")
+
+    return True
+
+def testar_resumos_meteorologicos():
+    """Testa upsert dos resumos, divisão da janela em meses e pontas e combinação"""
+
+    print("\n📊 Testando Resumos Meteorológicos...")
+    print("-" * 40)
+
+    from datetime import date
+    from types import SimpleNamespace
+    from uuid import uuid4
+    from sqlalchemy.dialects import postgresql
+    from src.models import models
+    from src.utils import resumo_meteorologico as resumos
+
+    consultas = []
+
+    class Consulta:
+        def __init__(self, colunas):
+            self.colunas = colunas
+
+        def filter(self, *criterios):
+            consultas.append(" ".join(
+                str(c.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+                for c in criterios
+            ))
+            return self
+
+        def one(self):
+            tabela = "mensal" if "resumo_meteorologico_mensal" in consultas[-1] else "diario"
+            n = 30 if tabela == "mensal" else 5
+            return SimpleNamespace(**{c: n for c in resumos.SOMAS},
+                                   max_temp_max=0.0 if tabela == "mensal" else -1.0,
+                                   min_temp_min=0.0 if tabela == "mensal" else 2.0)
+
+    db = SimpleNamespace(query=lambda *colunas: Consulta(colunas))
+    total = resumos.resumir(db, uuid4(), date(2024, 1, 20), date(2024, 3, 10))
+    assert len(consultas) == 2
+    assert "'2024-02-01'" in consultas[0] and "'2024-03-01'" in consultas[0]
+    assert "'2024-01-20' AND '2024-01-31'" in consultas[1] and "'2024-03-01' AND '2024-03-10'" in consultas[1]
+    assert total["n_registros"] == 35
+    assert total["max_temp_max"] == 0.0 and total["min_temp_min"] == 0.0
+    print("✅ Janela dividida em meses inteiros e pontas; extremos em 0 °C preservados")
+
+    consultas.clear()
+    resumos.resumir(db, uuid4(), date(2024, 2, 3), date(2024, 2, 20))
+    assert len(consultas) == 1 and "resumo_meteorologico_diario" in consultas[0]
+
+    upsert = str(resumos._upsert(models.ResumoMeteorologicoDiario, "data", resumos.select(
+        resumos.func.uuid_generate_v4(), models.DadosMeteorologicos.fazenda_id, models.DadosMeteorologicos.data,
+        *resumos._colunas_upsert(resumos._agregados_brutos()), resumos.func.now()
+    ).group_by(models.DadosMeteorologicos.fazenda_id, models.DadosMeteorologicos.data)).compile(
+        dialect=postgresql.dialect()))
+    assert "ON CONFLICT (fazenda_id, data) DO UPDATE" in upsert and "GROUP BY" in upsert
+    print("✅ INSERT ... SELECT com upsert por (fazenda_id, data)")
+
+    return True
+
+def testar_gdd_historico_e_resumo():
+    """Testa gdd_dia do histórico pela cultura e GDD até a data pelo resumo diário"""
+
+    print("\n📊 Testando GDD do Histórico e do Resumo Diário...")
+    print("-" * 40)
+
+    import numpy as np
+    from datetime import date, datetime
+    from uuid import uuid4
+    from sqlalchemy import String
+    from sqlalchemy.dialects.postgresql import UUID
+    from src.models import models
+    from src.utils import climatologia, resumo_meteorologico
+    from src.utils.test_ml_service import _sessao_sqlite, _tabela_minima
+
+    talhoes = _tabela_minima("talhoes", fazenda_id=UUID(as_uuid=True), cultura=String(100))
+    db = _sessao_sqlite(models.DadosMeteorologicos, models.ResumoMeteorologicoDiario,
+                        models.ClimatologiaFazenda, models.AgregadoPopulado, talhoes)
+    fazenda_id = uuid4()
+    db.execute(talhoes.insert(), [{"id": uuid4(), "fazenda_id": fazenda_id, "cultura": c}
+                                  for c in ("soja", "soja", "milho", None)])
+    cultura = climatologia.cultura_principal(db, fazenda_id)
+    assert cultura == "soja"
+
+    # Base da soja (7 °C), não a padrão (10 °C)
+    serie = {"data": np.array(["2024-01-01", "2024-01-02"], dtype="datetime64[D]"),
+             "temp_max": np.array([25.0, 30.0]), "temp_min": np.array([12.0, 14.0])}
+    resultado = climatologia.importar_historico(db, fazenda_id, serie, cultura=cultura)
+    assert resultado == {"importados": 2, "ignorados": 0}
+    gdd = [g for (g,) in db.query(models.DadosMeteorologicos.gdd_dia).order_by(models.DadosMeteorologicos.data)]
+    assert gdd == [11.5, 15.0]
+    print(f"✅ gdd_dia importado com a base da {cultura}: {gdd}")
+
+    # Resumo diário já populado: dia com temperaturas, dia só com chuva e dia sem registro
+    db.add(models.AgregadoPopulado(agregado=resumo_meteorologico.AGREGADO, chave=fazenda_id,
+                                   populado_em=datetime.utcnow()))
+    db.add_all([
+        models.ResumoMeteorologicoDiario(id=uuid4(), fazenda_id=fazenda_id, data=date(2024, 6, 1),
+                                         n_temp_max=2, soma_temp_max=60.0, n_temp_min=2, soma_temp_min=40.0,
+                                         updated_at=datetime.utcnow()),
+        models.ResumoMeteorologicoDiario(id=uuid4(), fazenda_id=fazenda_id, data=date(2024, 6, 2),
+                                         n_temp_max=0, soma_temp_max=0, n_temp_min=0, soma_temp_min=0,
+                                         soma_precipitacao=5.0, updated_at=datetime.utcnow()),
+        models.ClimatologiaFazenda(id=uuid4(), fazenda_id=fazenda_id, cultura="milho",
+                                   gdd_normal=[1.0] * 365, updated_at=datetime.utcnow())
+    ])
+    db.commit()
+    resultado = climatologia.gdd_ate_data(db, fazenda_id, "milho", date(2024, 6, 1), date(2024, 6, 3))
+    assert resultado["gdd_acumulado"] == 17.0
+    assert (resultado["dias_observados"], resultado["dias_climatologia"]) == (1, 2)
+    db.close()
+
+    print("✅ GDD até a data pelo resumo diário, completado pela normal")
+    return True
+
+def main():
+    resultados = [
+        ("Cache e Requisição Única", testar_cache_e_requisicao_unica()),
+        ("Falha da API", testar_falha_sem_cache()),
+        ("Grade de Cache", testar_grade_compartilhada()),
+        ("Agregação das Previsões", testar_agregacao_previsoes()),
+        ("Atualização das Previsões", testar_atualizacao_previsoes()),
+        ("Métodos de GDD", testar_metodos_gdd()),
+        ("Climatologia e GDD", testar_climatologia_gdd()),
+        ("Leitura do Histórico em CSV", testar_leitura_csv_historico()),
+        ("Resumos Meteorológicos", testar_resumos_meteorologicos()),
+        ("GDD do Histórico e do Resumo Diário", testar_gdd_historico_e_resumo()),
+    ]
+
+    for nome, sucesso in resultados:
+        status = "✅ PASSOU" if sucesso else "❌ FALHOU"
+        print(f"{nome}: {status}")
+
+    return 0 if all(r[1] for r in resultados) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""
+Script de exemplo para testar o motor de zoneamento (zonas de manejo)
+sem precisar da API
+"""
+
+import sys
+import os
+import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import numpy as np
+from src.utils.zoneamento import zonear, METODOS_ZONEAMENTO
+from src.utils.delineamento_service import DelineamentoService
+
+def _raster_tres_niveis(linhas=1000, colunas=1000):
+    """Talhão com três níveis de NDVI bem separados e borda sem dado"""
+    rng = np.random.default_rng(7)
+    raster = np.empty((linhas, colunas), dtype=np.float32)
+    raster[:, :colunas // 4] = 0.3
+    raster[:, colunas // 4:colunas * 3 // 4] = 0.55
+    raster[:, colunas * 3 // 4:] = 0.8
+    raster += rng.normal(0, 0.02, raster.shape).astype(np.float32)
+    raster[:5, :] = np.nan
+    return raster
+
+def testar_metodos_zoneamento():
+    """Testa kmeans, quantil e jenks num raster de 1 milhão de pixels"""
+
+    print("\n📊 Testando Métodos de Zoneamento...")
+    print("-" * 40)
+
+    raster = _raster_tres_niveis()
+
+    for metodo in ("kmeans", "quantil", "jenks"):
+        inicio = time.perf_counter()
+        resultado = zonear(raster, num_zonas=3, metodo=metodo)
+        duracao = time.perf_counter() - inicio
+
+        assert resultado["n_pixels_validos"] == np.isfinite(raster).sum()
+        assert resultado["n_pixels"].sum() == resultado["n_pixels_validos"]
+        assert np.all(resultado["raster_zonas"][:5] == -1)
+        assert duracao < 1.0, f"{metodo} levou {duracao:.2f}s"
+
+        if metodo != "quantil":
+            # Níveis bem separados: as zonas recuperam as três faixas
+            assert np.allclose(resultado["media"], [0.3, 0.55, 0.8], atol=0.01)
+            assert np.allclose(resultado["n_pixels"] / resultado["n_pixels_validos"],
+                               [0.25, 0.5, 0.25], atol=0.01)
+
+        print(f"✅ {metodo}: limites {np.round(resultado['limites'], 3)} em {duracao * 1000:.0f} ms")
+
+    resultado = zonear(raster, metodo="limiares", limiares=[0.7, 0.4])
+    assert np.allclose(resultado["limites"], [0.4, 0.7])
+    assert set(METODOS_ZONEAMENTO) >= {"kmeans", "quantil", "jenks", "limiares"}
+
+    return True
+
+def testar_delineamento_com_geometria():
+    """Testa zonas com percentuais reais e polígonos georreferenciados"""
+
+    print("\n📊 Testando Delineamento com Geometria...")
+    print("-" * 40)
+
+    raster = _raster_tres_niveis(200, 200)
+    service = DelineamentoService()
+    resultado = service.gerar_delineamento(
+        talhao_id="teste",
+        raster=raster,
+        num_zonas=3,
+        metodo="jenks",
+        transform=(-47.0, 0.0001, -15.0, 0.0001),
+        area_pixel_ha=0.01
+    )
+
+    zonas = resultado["zonas"]
+    assert len(zonas) == 3
+    assert abs(sum(z["area_percentual"] for z in zonas) - 100) < 0.5
+    assert resultado["estatisticas"]["coeficiente_variacao"] > 0
+
+    geometria = resultado["geometria"]
+    assert geometria is not None
+    assert all(parte.is_valid for parte in geometria.geoms)
+    minx, miny, maxx, maxy = geometria.bounds
+    assert -47.0 <= minx and maxx <= -46.98 and -15.02 <= miny and maxy <= -15.0
+    assert zonas[-1]["partes"][1] == len(geometria.geoms)
+
+    print(f"✅ {len(geometria.geoms)} polígono(s) para {len(zonas)} zonas")
+    for z in zonas:
+        print(f"   {z['nome']}: {z['area_percentual']}% ({z['area_hectares']} ha)")
+
+    return True
+
+def testar_exportacao_prescricao():
+    """Testa exportação com taxas por zona e reaproveitamento do cache"""
+
+    print("\n📊 Testando Exportação de Prescrição...")
+    print("-" * 40)
+
+    import json
+    import tempfile
+    import zipfile
+    from shapely.geometry import mapping
+    from src.utils import exportacao_prescricao
+
+    service = DelineamentoService()
+    resultado = service.gerar_delineamento(
+        talhao_id="teste",
+        raster=_raster_tres_niveis(200, 200),
+        metodo="jenks",
+        transform=(-47.0, 0.0001, -15.0, 0.0001),
+        area_pixel_ha=0.01
+    )
+    partes = [mapping(p) for p in resultado["geometria"].geoms]
+
+    def partes_indisponiveis():
+        raise AssertionError("Cache deveria evitar a leitura das partes")
+        yield
+
+    cache_original = exportacao_prescricao.CACHE_DIR
+    limite_original = exportacao_prescricao.CACHE_MAX_MB
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            exportacao_prescricao.CACHE_DIR = tmp
+            for formato in ("geojson", "csv", "kml", "shapefile"):
+                exportacao = service.exportar_prescricao(
+                    "d1", formato, resultado["estatisticas"], iter(partes), versao="v1"
+                )
+                assert not exportacao["cache"] and os.path.getsize(exportacao["caminho"]) > 0
+
+                repetida = service.exportar_prescricao(
+                    "d1", formato, resultado["estatisticas"], partes_indisponiveis(), versao="v1"
+                )
+                assert repetida["cache"] and repetida["caminho"] == exportacao["caminho"]
+                print(f"✅ {formato}: {os.path.getsize(exportacao['caminho'])} bytes")
+
+            with open(service.exportar_prescricao("d1", "geojson", resultado["estatisticas"],
+                                                  versao="v1")["caminho"]) as f:
+                colecao = json.load(f)
+            assert len(colecao["features"]) == len(partes)
+
+            # Cada parte leva a própria área: a soma por zona bate com os pixels da zona
+            # (contornos vetorizados diferem da contagem de pixels na borda)
+            import math
+            pixel_ha = (0.0001 * 111320.0) ** 2 * math.cos(math.radians(-15.01)) / 10000
+            for zona in resultado["estatisticas"]["zonas"]:
+                soma = sum(f["properties"]["area_ha"] for f in colecao["features"]
+                           if f["properties"]["zona_id"] == zona["zona_id"])
+                esperado = zona["n_pixels"] * pixel_ha
+                assert abs(soma - esperado) <= 0.05 * esperado, zona["zona_id"]
+
+            # Estratégia compensatória: zona de menor índice recebe a maior taxa
+            taxas = exportacao["taxas"]
+            assert taxas[1] > taxas[2] > taxas[3]
+
+            with zipfile.ZipFile(exportacao["caminho"]) as zf:
+                assert {"prescricao.shp", "prescricao.dbf", "prescricao.prj"} <= set(zf.namelist())
+
+            # Acima do limite, sai o artefato de uso mais antigo e fica o que está sendo servido
+            antigo = os.path.join(tmp, "antigo.geojson")
+            with open(antigo, "w") as f:
+                f.write("{}")
+            os.utime(antigo, (0, 0))
+            exportacao_prescricao.CACHE_MAX_MB = 0
+            novo = service.exportar_prescricao("d1", "geojson", resultado["estatisticas"],
+                                               iter(partes), versao="v2")
+            assert os.listdir(tmp) == [os.path.basename(novo["caminho"])]
+            print("✅ Cache limitado: artefatos antigos removidos")
+    finally:
+        exportacao_prescricao.CACHE_DIR = cache_original
+        exportacao_prescricao.CACHE_MAX_MB = limite_original
+    return True
+
+def testar_variabilidade_lote():
+    """Testa momentos por segmento (offsets + buffer) contra scipy.stats"""
+
+    print("\n📊 Testando Variabilidade em Lote...")
+    print("-" * 40)
+
+    from scipy import stats
+
+    rng = np.random.default_rng(3)
+    conjuntos = [rng.gamma(2.0, 0.1, size=n) for n in (500, 0, 20000, 1, 75)]
+    conjuntos[2][:10] = np.nan
+
+    service = DelineamentoService()
+    offsets, valores = service.montar_segmentos(conjuntos)
+    lote = service.analisar_variabilidade_lote(offsets, valores)
+
+    for i, conjunto in enumerate(conjuntos):
+        conjunto = conjunto[np.isfinite(conjunto)]
+        assert lote["n"][i] == len(conjunto)
+        if len(conjunto) < 2:
+            continue
+        esperado = [conjunto.mean(), conjunto.std(), conjunto.min(), conjunto.max(),
+                    stats.skew(conjunto), stats.kurtosis(conjunto)]
+        obtido = [lote[c][i] for c in ("media", "desvio_padrao", "minimo", "maximo",
+                                        "assimetria", "curtose")]
+        assert np.allclose(obtido, esperado)
+
+    assert np.isnan(lote["media"][1])
+
+    # Último segmento vazio ou só com NaN (data toda nublada) não corta o anterior
+    for ultimo in ([], [np.nan, np.nan]):
+        offsets, valores = service.montar_segmentos([[1.0, 2.0, 3.0, 10.0], ultimo])
+        lote = service.analisar_variabilidade_lote(offsets, valores)
+        assert lote["media"][0] == 4.0 and lote["maximo"][0] == 10.0 and lote["minimo"][0] == 1.0
+        assert lote["n"][1] == 0 and np.isnan(lote["media"][1])
+    print(f"✅ {len(conjuntos)} segmentos conferem com scipy.stats")
+
+    return True
+
+def testar_raster_gee_sem_simulacao_silenciosa():
+    """Testa que falha do GEE inicializado vira erro e só o modo offline simula"""
+
+    print("\n📊 Testando Raster GEE sem Simulação Silenciosa...")
+    print("-" * 40)
+
+    from src.utils.gee_service import GEEService, ErroGEE
+
+    gee = GEEService()
+    gee.initialized = False
+    raster = gee.obter_raster_indice("talhao-1", None, "2024-01-10")
+    assert raster["fonte"] == "simulado" and raster["valores"].dtype == np.float32
+
+    def falhar(*args, **kwargs):
+        raise RuntimeError("User memory limit exceeded")
+
+    gee.initialized = True
+    gee._raster_indice_gee = falhar
+    geometria = {"type": "Polygon", "coordinates": [[[0, 0], [0.01, 0], [0.01, 0.01], [0, 0.01], [0, 0]]]}
+    try:
+        gee.obter_raster_indice("talhao-1", geometria, "2024-01-10")
+        raise AssertionError("falha do GEE deveria levantar ErroGEE")
+    except ErroGEE as e:
+        assert "memory limit" in str(e)
+    try:
+        gee.obter_raster_indice("talhao-1", None, "2024-01-10")
+        raise AssertionError("talhão sem geometria deveria levantar ValueError")
+    except ValueError:
+        pass
+
+    print("✅ Offline: simulado marcado; GEE com falha: ErroGEE (502), sem geometria: ValueError")
+    return True
+
+def main():
+    resultados = [
+        ("Métodos de Zoneamento", testar_metodos_zoneamento()),
+        ("Delineamento com Geometria", testar_delineamento_com_geometria()),
+        ("Exportação de Prescrição", testar_exportacao_prescricao()),
+        ("Variabilidade em Lote", testar_variabilidade_lote()),
+        ("Raster GEE sem Simulação Silenciosa", testar_raster_gee_sem_simulacao_silenciosa()),
+    ]
+
+    for nome, sucesso in resultados:
+        status = "✅ PASSOU" if sucesso else "❌ FALHOU"
+        print(f"{nome}: {status}")
+
+    return 0 if all(r[1] for r in resultados) else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,23 +1,81 @@
+import asyncio
+import math
 import os
-import requests
-from typing import Dict, Any, List
+import time
+import httpx
+import numpy as np
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime, date
 
+# Validade das respostas em cache (segundos)
+TTL_CLIMA_ATUAL = int(os.getenv("WEATHER_TTL_ATUAL", "600"))
+TTL_PREVISAO = int(os.getenv("WEATHER_TTL_PREVISAO", "3600"))
+
+# Lado da célula da grade (graus) em que as coordenadas são agrupadas;
+# fazendas na mesma célula compartilham a consulta. 0 usa a coordenada exata.
+GRADE_GRAUS = float(os.getenv("WEATHER_GRADE_GRAUS", "0.05"))
+
+# Entradas acima deste número disparam a limpeza das expiradas
+CACHE_MAXIMO = 4096
+
 class WeatherService:
     """Serviço para integração com APIs de clima"""
     
-    def __init__(self):
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None):
         self.api_key = os.getenv("OPENWEATHER_API_KEY", "")
         self.base_url = "https://api.openweathermap.org/data/2.5"
+        self.ttl_clima_atual = TTL_CLIMA_ATUAL
+        self.ttl_previsao = TTL_PREVISAO
+        self.grade_graus = GRADE_GRAUS
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._cache: Dict[Tuple, Tuple[float, Dict[str, Any]]] = {}
+        self._em_andamento: Dict[Tuple, asyncio.Task] = {}
     
-    def obter_clima_atual(self, lat: float, lon: float) -> Dict[str, Any]:
-        """Obtém condições climáticas atuais"""
-        
-        if not self.api_key:
-            return self._simular_clima_atual()
+    def _cliente(self) -> httpx.AsyncClient:
+        """Cliente com conexões keep-alive, criado no loop da aplicação"""
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=10,
+                limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+                transport=self._transport
+            )
+        return self._client
+    
+    async def fechar(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    def celula(self, lat: float, lon: float) -> Tuple[Tuple, float, float]:
+        """Chave da célula da grade e coordenada (centro) usada na consulta"""
+        if self.grade_graus <= 0:
+            return (round(lat, 4), round(lon, 4)), lat, lon
+        i = math.floor(lat / self.grade_graus)
+        j = math.floor(lon / self.grade_graus)
+        return (self.grade_graus, i, j), (i + 0.5) * self.grade_graus, (j + 0.5) * self.grade_graus
+    
+    async def _consultar(self, recurso: str, lat: float, lon: float, ttl: float) -> Dict[str, Any]:
+        """
+        Resposta da API para o recurso na célula da coordenada, com cache por
+        TTL. Chamadas simultâneas para a mesma célula aguardam a mesma requisição.
+        """
+        celula, lat, lon = self.celula(lat, lon)
+        chave = (recurso,) + celula
+        em_cache = self._cache.get(chave)
+        if em_cache and em_cache[0] > time.monotonic():
+            return em_cache[1]
         
+        tarefa = self._em_andamento.get(chave)
+        if tarefa is None:
+            tarefa = asyncio.create_task(self._buscar(chave, recurso, lat, lon, ttl))
+            self._em_andamento[chave] = tarefa
+        # shield: o cancelamento de um chamador não derruba a busca compartilhada
+        return await asyncio.shield(tarefa)
+    
+    async def _buscar(self, chave: Tuple, recurso: str, lat: float, lon: float, ttl: float) -> Dict[str, Any]:
         try:
-            url = f"{self.base_url}/weather"
             params = {
                 "lat": lat,
                 "lon": lon,
@@ -25,10 +83,27 @@ class WeatherService:
                 "units": "metric",
                 "lang": "pt_br"
             }
-            
-            response = requests.get(url, params=params, timeout=10)
+            response = await self._cliente().get(f"/{recurso}", params=params)
+            response.raise_for_status()
             data = response.json()
             
+            agora = time.monotonic()
+            if len(self._cache) >= CACHE_MAXIMO:
+                self._cache = {k: v for k, v in self._cache.items() if v[0] > agora}
+            self._cache[chave] = (agora + ttl, data)
+            return data
+        finally:
+            self._em_andamento.pop(chave, None)
+    
+    async def obter_clima_atual(self, lat: float, lon: float) -> Dict[str, Any]:
+        """Obtém condições climáticas atuais"""
+        
+        if not self.api_key:
+            return self._simular_clima_atual()
+        
+        try:
+            data = await self._consultar("weather", lat, lon, self.ttl_clima_atual)
+            
             return {
                 "temperatura": data["main"]["temp"],
                 "temperatura_max": data["main"]["temp_max"],
@@ -46,64 +121,42 @@ class WeatherService:
             print(f"Erro ao obter clima: {e}")
             return self._simular_clima_atual()
     
-    def obter_previsao(self, lat: float, lon: float, dias: int = 7) -> List[Dict[str, Any]]:
+    async def obter_previsao(self, lat: float, lon: float, dias: int = 7) -> List[Dict[str, Any]]:
         """Obtém previsão do tempo para os próximos dias"""
+        return (await self.obter_previsoes([(lat, lon)], dias))[0]
+    
+    async def obter_previsoes(
+        self,
+        coordenadas: List[Tuple[float, float]],
+        dias: int = 7,
+        concorrencia: int = 10
+    ) -> List[List[Dict[str, Any]]]:
+        """Previsão de várias coordenadas, agregadas por dia numa única passada"""
         
         if not self.api_key:
-            return self._simular_previsao(dias)
+            return [self._simular_previsao(dias) for _ in coordenadas]
         
+        semaforo = asyncio.Semaphore(concorrencia)
+        
+        async def consultar(lat, lon):
+            async with semaforo:
+                try:
+                    return await self._consultar("forecast", lat, lon, self.ttl_previsao)
+                except Exception as e:
+                    print(f"Erro ao obter previsão: {e}")
+                    return None
+        
+        payloads = await asyncio.gather(*[consultar(lat, lon) for lat, lon in coordenadas])
         try:
-            url = f"{self.base_url}/forecast"
-            params = {
-                "lat": lat,
-                "lon": lon,
-                "appid": self.api_key,
-                "units": "metric",
-                "lang": "pt_br"
-            }
-            
-            response = requests.get(url, params=params, timeout=10)
-            data = response.json()
-            
-            # Agrupar por dia
-            previsao_por_dia = {}
-            for item in data.get("list", [])[:dias * 8]:  # 8 medições por dia
-                data_str = item["dt_txt"][:10]
-                
-                if data_str not in previsao_por_dia:
-                    previsao_por_dia[data_str] = {
-                        "temps": [],
-                        "humidades": [],
-                        "descricoes": [],
-                        "icones": [],
-                        "chuva_prob": []
-                    }
-                
-                previsao_por_dia[data_str]["temps"].append(item["main"]["temp"])
-                previsao_por_dia[data_str]["humidades"].append(item["main"]["humidity"])
-                previsao_por_dia[data_str]["descricoes"].append(item["weather"][0]["description"])
-                previsao_por_dia[data_str]["icones"].append(item["weather"][0]["icon"])
-                previsao_por_dia[data_str]["chuva_prob"].append(item.get("pop", 0))
-            
-            resultado = []
-            for data_str, dados in list(previsao_por_dia.items())[:dias]:
-                resultado.append({
-                    "data_previsao": data_str,
-                    "hora_previsao": datetime.strptime(data_str, "%Y-%m-%d"),
-                    "temp_max": max(dados["temps"]),
-                    "temp_min": min(dados["temps"]),
-                    "umidade": sum(dados["humidades"]) / len(dados["humidades"]),
-                    "descricao": max(set(dados["descricoes"]), key=dados["descricoes"].count),
-                    "icone": dados["icones"][len(dados["icones"]) // 2],
-                    "precipitacao_probabilidade": max(dados["chuva_prob"]),
-                    "precipitacao_volume": 0  # Calcular se disponível
-                })
-            
-            return resultado
-            
+            agregadas = agregar_previsoes([p or {} for p in payloads], dias)
         except Exception as e:
-            print(f"Erro ao obter previsão: {e}")
-            return self._simular_previsao(dias)
+            print(f"Erro ao agregar previsão: {e}")
+            agregadas = [[] for _ in payloads]
+        
+        return [
+            previsao if previsao else self._simular_previsao(dias)
+            for previsao in agregadas
+        ]
     
     def _simular_clima_atual(self) -> Dict[str, Any]:
         import random
@@ -145,3 +198,106 @@ class WeatherService:
             })
         
         return resultado
+
+def agregar_previsoes(payloads: List[Dict[str, Any]], dias: int = 7) -> List[List[Dict[str, Any]]]:
+    """
+    Agrega as previsões de 3 em 3 horas (/forecast) de várias fazendas por dia.
+
+    Os itens de todos os payloads viram colunas e cada (payload, dia) é um
+    grupo contíguo: extremos saem de `reduceat`, médias e somas de `bincount`
+    e a descrição mais frequente de uma contagem por (grupo, descrição).
+    Retorna uma lista de dias por payload, na ordem de entrada.
+    """
+    listas = [data.get("list", [])[:dias * 8] for data in payloads]  # 8 medições por dia
+    itens = [item for lista in listas for item in lista]
+    
+    resultado = [[] for _ in payloads]
+    if not itens:
+        return resultado
+    
+    origem = np.repeat(np.arange(len(payloads)), [len(lista) for lista in listas])
+    # Dia UTC do timestamp (mesmo dia de dt_txt)
+    dias_medicao = np.asarray([item["dt"] for item in itens], dtype=np.int64) // 86400
+    temps = [item["main"]["temp"] for item in itens]
+    umidades = [item["main"]["humidity"] for item in itens]
+    chuva_prob = [item.get("pop", 0) for item in itens]
+    chuva_mm = [(item.get("rain") or {}).get("3h", 0) for item in itens]
+    codigos: Dict[str, int] = {}
+    codigo = [codigos.setdefault(item["weather"][0]["description"], len(codigos)) for item in itens]
+    icones = [item["weather"][0]["icon"] for item in itens]
+    
+    ordem = np.lexsort((dias_medicao, origem))
+    chave = origem[ordem] * 1_000_000 + dias_medicao[ordem]
+    
+    inicios = np.flatnonzero(np.r_[True, chave[1:] != chave[:-1]])
+    n_grupos = len(inicios)
+    n_medicoes = np.diff(np.r_[inicios, len(chave)])
+    grupo = np.repeat(np.arange(n_grupos), n_medicoes)
+    
+    temps = np.asarray(temps, dtype=np.float64)[ordem]
+    umidades = np.asarray(umidades, dtype=np.float64)[ordem]
+    chuva_prob = np.asarray(chuva_prob, dtype=np.float64)[ordem]
+    chuva_mm = np.asarray(chuva_mm, dtype=np.float64)[ordem]
+    
+    temp_max = np.maximum.reduceat(temps, inicios)
+    temp_min = np.minimum.reduceat(temps, inicios)
+    prob_max = np.maximum.reduceat(chuva_prob, inicios)
+    umidade = np.bincount(grupo, weights=umidades, minlength=n_grupos) / n_medicoes
+    volume = np.bincount(grupo, weights=chuva_mm, minlength=n_grupos)
+    
+    # Moda da descrição: maior contagem no grupo, empate pela primeira ocorrência
+    nomes = np.asarray(list(codigos), dtype=object)
+    par = grupo * len(nomes) + np.asarray(codigo, dtype=np.int64)[ordem]
+    pares, primeira, contagem = np.unique(par, return_index=True, return_counts=True)
+    grupo_par = pares // len(nomes)
+    escolhido = np.lexsort((primeira, -contagem, grupo_par))
+    primeiro_do_grupo = np.r_[True, grupo_par[escolhido][1:] != grupo_par[escolhido][:-1]]
+    descricao = nomes[pares[escolhido][primeiro_do_grupo] % len(nomes)]
+    
+    icones = np.asarray(icones, dtype=object)[ordem]
+    icone = icones[inicios + n_medicoes // 2]
+    
+    origem_grupo = origem[ordem][inicios]
+    dia_grupo = dias_medicao[ordem][inicios].astype("datetime64[D]")
+    colunas = zip(
+        origem_grupo.tolist(),
+        dia_grupo.astype(str).tolist(),
+        dia_grupo.astype("datetime64[us]").tolist(),
+        temp_max.tolist(),
+        temp_min.tolist(),
+        umidade.tolist(),
+        descricao.tolist(),
+        icone.tolist(),
+        prob_max.tolist(),
+        np.round(volume, 2).tolist()
+    )
+    for indice, data_str, hora, t_max, t_min, umid, desc, ic, prob, vol in colunas:
+        dias_payload = resultado[indice]
+        if len(dias_payload) < dias:
+            dias_payload.append({
+                "data_previsao": data_str,
+                "hora_previsao": hora,
+                "temp_max": t_max,
+                "temp_min": t_min,
+                "umidade": umid,
+                "descricao": desc,
+                "icone": ic,
+                "precipitacao_probabilidade": prob,
+                "precipitacao_volume": vol
+            })
+    
+    return resultado
+
+# Instância única da aplicação: pool de conexões e cache compartilhados
+_servico: Optional[WeatherService] = None
+
+def obter_weather_service() -> WeatherService:
+    global _servico
+    if _servico is None:
+        _servico = WeatherService()
+    return _servico
+
+async def fechar_weather_service():
+    """Fecha o pool de conexões (shutdown da aplicação)"""
+    if _servico is not None:
+        await _servico.fechar()
@@ -0,0 +1,259 @@
+"""
+Motor de zoneamento (zonas de manejo) sobre o raster de índice do talhão.
+
+Cada método recebe os valores válidos do raster (1D) e o número de zonas e
+devolve os limites entre zonas (num_zonas - 1 valores crescentes). Como o
+índice é escalar, toda zona é um intervalo e a atribuição dos pixels é um
+único `np.searchsorted`. Métodos novos entram com `registrar_metodo`.
+"""
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional, Sequence
+from scipy import ndimage
+
+# OpenCV e Shapely só são necessários para vetorizar as zonas
+try:
+    import cv2
+    from shapely.affinity import affine_transform
+    from shapely.geometry import MultiPolygon, Polygon
+    from shapely.ops import unary_union
+    VETORIZACAO_DISPONIVEL = True
+except ImportError:
+    VETORIZACAO_DISPONIVEL = False
+
+METODOS_ZONEAMENTO: Dict[str, Callable[..., np.ndarray]] = {}
+
+
+def registrar_metodo(nome: str):
+    """Registra uma função de limites como método de zoneamento"""
+    def decorador(func):
+        METODOS_ZONEAMENTO[nome] = func
+        return func
+    return decorador
+
+
+@registrar_metodo("quantil")
+def limites_quantil(valores: np.ndarray, num_zonas: int, **_) -> np.ndarray:
+    """Zonas com a mesma quantidade de pixels"""
+    return np.quantile(valores, np.linspace(0, 1, num_zonas + 1)[1:-1])
+
+
+@registrar_metodo("kmeans")
+def limites_kmeans(
+    valores: np.ndarray,
+    num_zonas: int,
+    tamanho_lote: int = 2048,
+    iteracoes: int = 100,
+    semente: int = 42,
+    **_
+) -> np.ndarray:
+    """K-means mini-batch (Sculley) em 1D; limites são os pontos médios entre centros"""
+    rng = np.random.default_rng(semente)
+    centros = np.quantile(valores, (np.arange(num_zonas) + 0.5) / num_zonas)
+    contagens = np.zeros(num_zonas)
+
+    for _ in range(iteracoes):
+        lote = valores[rng.integers(0, len(valores), tamanho_lote)]
+        rotulos = np.abs(lote[:, None] - centros[None, :]).argmin(axis=1)
+        n_lote = np.bincount(rotulos, minlength=num_zonas)
+        soma_lote = np.bincount(rotulos, weights=lote, minlength=num_zonas)
+
+        # Taxa de aprendizado 1/contagem por centro, aplicada ao lote inteiro
+        contagens += n_lote
+        com_pixels = n_lote > 0
+        centros[com_pixels] += (
+            soma_lote[com_pixels] - n_lote[com_pixels] * centros[com_pixels]
+        ) / contagens[com_pixels]
+
+    centros.sort()
+    return (centros[:-1] + centros[1:]) / 2
+
+
+@registrar_metodo("jenks")
+def limites_jenks(
+    valores: np.ndarray,
+    num_zonas: int,
+    classes_histograma: int = 256,
+    **_
+) -> np.ndarray:
+    """Quebras naturais de Jenks (programação dinâmica de Fisher) sobre o histograma"""
+    contagem, bordas = np.histogram(valores, bins=classes_histograma)
+    soma, _ = np.histogram(valores, bins=bordas, weights=valores)
+    soma2, _ = np.histogram(valores, bins=bordas, weights=valores ** 2)
+
+    ocupados = np.flatnonzero(contagem)
+    n = len(ocupados)
+    if n <= num_zonas:
+        return bordas[ocupados[1:]]
+
+    # Somas acumuladas para a soma de quadrados de qualquer faixa i..j em O(1)
+    W = np.concatenate(([0.0], np.cumsum(contagem[ocupados])))
+    S = np.concatenate(([0.0], np.cumsum(soma[ocupados])))
+    S2 = np.concatenate(([0.0], np.cumsum(soma2[ocupados])))
+
+    i = np.arange(n)[:, None]
+    j = np.arange(n)[None, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        peso = W[j + 1] - W[i]
+        custo = S2[j + 1] - S2[i] - (S[j + 1] - S[i]) ** 2 / peso
+    custo = np.where(j >= i, custo, np.inf)
+
+    # erro[j]: menor soma de quadrados das faixas 0..j com k classes
+    erro = custo[0].copy()
+    inicios = []
+    for _ in range(1, num_zonas):
+        candidatos = np.full((n, n), np.inf)
+        candidatos[1:] = erro[:-1, None] + custo[1:]
+        inicio = candidatos.argmin(axis=0)
+        erro = candidatos[inicio, np.arange(n)]
+        inicios.append(inicio)
+
+    # Reconstruir as quebras a partir da última faixa
+    quebras = []
+    fim = n - 1
+    for inicio in reversed(inicios):
+        fim = inicio[fim]
+        quebras.append(bordas[ocupados[fim]])
+        fim -= 1
+
+    return np.array(sorted(quebras))
+
+
+@registrar_metodo("limiares")
+def limites_fixos(
+    valores: np.ndarray,
+    num_zonas: int,
+    limiares: Optional[Sequence[float]] = None,
+    **_
+) -> np.ndarray:
+    """Limiares configurados explicitamente (ex.: [0.4, 0.7])"""
+    if not limiares:
+        raise ValueError("Método 'limiares' requer a lista de limiares")
+    return np.sort(np.asarray(limiares, dtype=np.float64))
+
+
+def zonear(
+    raster: np.ndarray,
+    num_zonas: int = 3,
+    metodo: str = "kmeans",
+    **config
+) -> Dict[str, Any]:
+    """
+    Classifica os pixels do raster em zonas e calcula as estatísticas por zona.
+
+    Pixels NaN (fora do talhão, nuvem) são ignorados e recebem zona -1.
+    """
+    if metodo not in METODOS_ZONEAMENTO:
+        raise ValueError(
+            f"Método de zoneamento não suportado. Use: {sorted(METODOS_ZONEAMENTO)}"
+        )
+
+    raster = np.asarray(raster, dtype=np.float64)
+    validos = np.isfinite(raster)
+    valores = raster[validos]
+    if valores.size == 0:
+        raise ValueError("Raster sem pixels válidos")
+
+    limites = np.unique(METODOS_ZONEAMENTO[metodo](valores, num_zonas, **config))
+    n_zonas = len(limites) + 1
+    rotulos = np.searchsorted(limites, valores, side="right")
+
+    n_pixels = np.bincount(rotulos, minlength=n_zonas)
+    soma = np.bincount(rotulos, weights=valores, minlength=n_zonas)
+    soma2 = np.bincount(rotulos, weights=valores ** 2, minlength=n_zonas)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        media = soma / n_pixels
+        desvio = np.sqrt(np.maximum(soma2 / n_pixels - media ** 2, 0))
+
+    indices = np.arange(n_zonas)
+    minimo = np.asarray(ndimage.minimum(valores, rotulos, indices), dtype=np.float64)
+    maximo = np.asarray(ndimage.maximum(valores, rotulos, indices), dtype=np.float64)
+
+    raster_zonas = np.full(raster.shape, -1, dtype=np.int16)
+    raster_zonas[validos] = rotulos
+
+    media_geral = float(valores.mean())
+    desvio_geral = float(valores.std())
+
+    return {
+        "limites": limites,
+        "raster_zonas": raster_zonas,
+        "n_pixels": n_pixels,
+        "media": media,
+        "desvio_padrao": desvio,
+        "minimo": minimo,
+        "maximo": maximo,
+        "media_geral": media_geral,
+        "desvio_padrao_geral": desvio_geral,
+        "coeficiente_variacao": desvio_geral / media_geral if media_geral else 0.0,
+        "n_pixels_validos": int(valores.size)
+    }
+
+
+def vetorizar_zonas(
+    raster_zonas: np.ndarray,
+    transform: Sequence[float],
+    n_zonas: Optional[int] = None,
+    area_minima_pixels: int = 4,
+    tolerancia_pixels: float = 1.0
+) -> Optional[List[Optional["MultiPolygon"]]]:
+    """
+    Converte o raster de zonas em um MultiPolygon válido por zona (ou None se
+    vazia).
+
+    `transform` é (x0, largura_pixel, y0, altura_pixel) do canto superior
+    esquerdo, com o norte para cima. Um filtro de mediana 3x3 remove pixels
+    isolados antes de traçar os contornos.
+    """
+    if not VETORIZACAO_DISPONIVEL:
+        return None
+
+    x0, dx, y0, dy = transform
+    n_zonas = n_zonas or int(raster_zonas.max()) + 1
+    suavizado = ndimage.median_filter(raster_zonas, size=3, mode="nearest")
+    suavizado[raster_zonas < 0] = -1
+
+    # Coordenadas de pixel (centro) -> coordenadas do mapa, descontando a borda
+    matriz = [dx, 0, 0, -dy, x0 - 0.5 * dx, y0 + 0.5 * dy]
+
+    geometrias = []
+    for zona in range(n_zonas):
+        mascara = np.pad(suavizado == zona, 1).astype(np.uint8)
+        contornos, hierarquia = cv2.findContours(mascara, cv2.RETR_CCOMP,
+                                                 cv2.CHAIN_APPROX_SIMPLE)
+        if hierarquia is None:
+            geometrias.append(None)
+            continue
+
+        aneis = [
+            cv2.approxPolyDP(c, tolerancia_pixels, True).reshape(-1, 2)
+            for c in contornos
+        ]
+        poligonos = []
+        for idx, (_, _, filho, pai) in enumerate(hierarquia[0]):
+            if pai != -1 or len(aneis[idx]) < 3:
+                continue
+            if cv2.contourArea(contornos[idx]) < area_minima_pixels:
+                continue
+
+            furos = []
+            while filho != -1:
+                if len(aneis[filho]) >= 3:
+                    furos.append(aneis[filho])
+                filho = hierarquia[0][filho][0]
+
+            poligono = Polygon(aneis[idx], furos)
+            if not poligono.is_valid:
+                poligono = poligono.buffer(0)
+            if not poligono.is_empty:
+                poligonos.extend(getattr(poligono, "geoms", [poligono]))
+
+        if not poligonos:
+            geometrias.append(None)
+            continue
+
+        # A simplificação pode sobrepor partes vizinhas; a união mantém a zona válida
+        zona_unida = unary_union(poligonos)
+        partes = list(getattr(zona_unida, "geoms", [zona_unida]))
+        geometrias.append(affine_transform(MultiPolygon(partes), matriz))
+
+    return geometrias
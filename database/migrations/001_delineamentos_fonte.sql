@@ -0,0 +1,3 @@
+-- Origem do raster dos delineamentos (sentinel-2 ou simulado).
+-- Idempotente: psql "$DATABASE_URL" -f database/migrations/001_delineamentos_fonte.sql
+ALTER TABLE delineamentos ADD COLUMN IF NOT EXISTS fonte VARCHAR(50);
@@ -0,0 +1,22 @@
+-- Feature store: contagem por índice e média/integral em ponto flutuante.
+-- Idempotente: psql "$DATABASE_URL" -f database/migrations/002_features_produtividade_medias.sql
+ALTER TABLE features_produtividade ADD COLUMN IF NOT EXISTS n_ndvi INTEGER DEFAULT 0;
+ALTER TABLE features_produtividade ADD COLUMN IF NOT EXISTS n_ndre INTEGER DEFAULT 0;
+ALTER TABLE features_produtividade ADD COLUMN IF NOT EXISTS n_msavi INTEGER DEFAULT 0;
+
+-- Linhas antigas foram acumuladas com arredondamento e com o último valor
+-- repetido na média: apagadas uma vez, são recalculadas na próxima leitura
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'features_produtividade' AND column_name = 'ndvi_medio') = 'numeric' THEN
+        ALTER TABLE features_produtividade
+            ALTER COLUMN ndvi_medio TYPE DOUBLE PRECISION,
+            ALTER COLUMN ndvi_integral TYPE DOUBLE PRECISION,
+            ALTER COLUMN ndre_medio TYPE DOUBLE PRECISION,
+            ALTER COLUMN ndre_integral TYPE DOUBLE PRECISION,
+            ALTER COLUMN msavi_medio TYPE DOUBLE PRECISION,
+            ALTER COLUMN msavi_integral TYPE DOUBLE PRECISION;
+        DELETE FROM features_produtividade;
+    END IF;
+END $$;
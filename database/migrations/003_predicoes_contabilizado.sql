@@ -0,0 +1,5 @@
+-- Predições cujo real já entrou em metricas_erro_modelo. Os reais antigos
+-- ficam FALSE e são somados por metricas_erro.contabilizar_pendentes na
+-- inicialização da API.
+-- Idempotente: psql "$DATABASE_URL" -f database/migrations/003_predicoes_contabilizado.sql
+ALTER TABLE predicoes_produtividade ADD COLUMN IF NOT EXISTS contabilizado BOOLEAN DEFAULT FALSE;
@@ -0,0 +1,29 @@
+-- Uma previsão por fazenda e dia: chave única usada pelo upsert
+-- ON CONFLICT (fazenda_id, data_previsao) do job de previsão e de /previsao.
+-- Idempotente: psql "$DATABASE_URL" -f database/migrations/004_previsao_tempo_unica.sql
+BEGIN;
+
+-- Duplicadas: mantém a gravada por último em cada fazenda/dia
+DELETE FROM previsao_tempo p
+USING previsao_tempo q
+WHERE p.fazenda_id = q.fazenda_id
+  AND p.data_previsao = q.data_previsao
+  AND (COALESCE(p.created_at, '-infinity'), p.id) < (COALESCE(q.created_at, '-infinity'), q.id);
+
+DO $$
+BEGIN
+    -- Bancos criados pelo schema.sql já têm a chave (com este nome ou o gerado pelo Postgres)
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'previsao_tempo'::regclass
+          AND conname IN ('uix_previsao_fazenda_data', 'previsao_tempo_fazenda_id_data_previsao_key')
+    ) THEN
+        ALTER TABLE previsao_tempo
+            ADD CONSTRAINT uix_previsao_fazenda_data UNIQUE (fazenda_id, data_previsao);
+    END IF;
+END $$;
+
+-- O índice da chave única começa por fazenda_id
+DROP INDEX IF EXISTS idx_previsao_fazenda;
+
+COMMIT;
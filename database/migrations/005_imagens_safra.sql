@@ -0,0 +1,6 @@
+-- Contagem de saúde por safra lida de imagens_satelite (a última imagem do
+-- talhão pode ser de outra safra); o índice por safra de ultima_imagem_talhao
+-- deixa de ser usado.
+-- Idempotente: psql "$DATABASE_URL" -f database/migrations/005_imagens_safra.sql
+CREATE INDEX IF NOT EXISTS idx_imagens_safra_talhao ON imagens_satelite(safra_id, talhao_id, data_imagem DESC);
+DROP INDEX IF EXISTS idx_ultima_imagem_safra_status;
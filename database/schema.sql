@@ -189,6 +189,48 @@ CREATE TABLE imagens_satelite (
 
 CREATE INDEX idx_imagens_talhao ON imagens_satelite(talhao_id);
 CREATE INDEX idx_imagens_data ON imagens_satelite(data_imagem);
+-- Dashboard filtrado por safra: última imagem de cada talhão na safra
+CREATE INDEX idx_imagens_safra_talhao ON imagens_satelite(safra_id, talhao_id, data_imagem DESC);
+
+-- Última imagem de cada talhão, com a classe de saúde (mantida na ingestão)
+CREATE TABLE ultima_imagem_talhao (
+    talhao_id UUID PRIMARY KEY REFERENCES talhoes(id) ON DELETE CASCADE,
+    fazenda_id UUID NOT NULL REFERENCES fazendas(id) ON DELETE CASCADE,
+    safra_id UUID REFERENCES safras(id) ON DELETE SET NULL,
+    imagem_id UUID NOT NULL REFERENCES imagens_satelite(id) ON DELETE CASCADE,
+    data_imagem DATE NOT NULL,
+    ndvi_mean DECIMAL(5, 4),
+    ndre_mean DECIMAL(5, 4),
+    msavi_mean DECIMAL(5, 4),
+    status_saude VARCHAR(20),  -- saudavel, atencao, critico
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_ultima_imagem_fazenda_status ON ultima_imagem_talhao(fazenda_id, status_saude);
+
+-- Série de cada índice por talhão em formato colunar compacto:
+-- offsets int32 (dias desde data_base) e valores float32, little-endian
+CREATE TABLE series_indices_talhao (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    talhao_id UUID NOT NULL REFERENCES talhoes(id) ON DELETE CASCADE,
+    indice VARCHAR(20) NOT NULL,  -- ndvi, ndre, msavi
+    data_base DATE NOT NULL,
+    data_ultima DATE NOT NULL,
+    n_pontos INTEGER DEFAULT 0,
+    offsets BYTEA NOT NULL,
+    valores BYTEA NOT NULL,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (talhao_id, indice)
+);
+
+-- Fazendas/talhões cujas tabelas derivadas (agregado) já foram populadas com
+-- os dados gravados antes delas; a ingestão só atualiza incrementalmente depois
+CREATE TABLE agregados_populados (
+    agregado VARCHAR(50) NOT NULL,  -- resumo_meteorologico, saude_talhoes, series_indices
+    chave UUID NOT NULL,            -- fazenda_id ou talhao_id, conforme o agregado
+    populado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (agregado, chave)
+);
 
 -- =============================================
 -- 3. CONTROLE FINANCEIRO
@@ -450,6 +492,48 @@ CREATE TABLE dados_meteorologicos (
 CREATE INDEX idx_meteo_fazenda ON dados_meteorologicos(fazenda_id);
 CREATE INDEX idx_meteo_data ON dados_meteorologicos(data);
 
+-- Resumos meteorológicos pré-agregados (somas e contagens de
+-- dados_meteorologicos por fazenda e dia/mês), atualizados na ingestão
+CREATE TABLE resumo_meteorologico_diario (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    fazenda_id UUID NOT NULL REFERENCES fazendas(id) ON DELETE CASCADE,
+    data DATE NOT NULL,
+    n_registros INTEGER DEFAULT 0,
+    n_temp_max INTEGER DEFAULT 0,
+    soma_temp_max DOUBLE PRECISION DEFAULT 0,
+    max_temp_max DECIMAL(5, 2),
+    n_temp_min INTEGER DEFAULT 0,
+    soma_temp_min DOUBLE PRECISION DEFAULT 0,
+    min_temp_min DECIMAL(5, 2),
+    n_temp_media INTEGER DEFAULT 0,
+    soma_temp_media DOUBLE PRECISION DEFAULT 0,
+    soma_precipitacao DOUBLE PRECISION DEFAULT 0,
+    n_umidade INTEGER DEFAULT 0,
+    soma_umidade DOUBLE PRECISION DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (fazenda_id, data)
+);
+
+CREATE TABLE resumo_meteorologico_mensal (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    fazenda_id UUID NOT NULL REFERENCES fazendas(id) ON DELETE CASCADE,
+    mes DATE NOT NULL,
+    n_registros INTEGER DEFAULT 0,
+    n_temp_max INTEGER DEFAULT 0,
+    soma_temp_max DOUBLE PRECISION DEFAULT 0,
+    max_temp_max DECIMAL(5, 2),
+    n_temp_min INTEGER DEFAULT 0,
+    soma_temp_min DOUBLE PRECISION DEFAULT 0,
+    min_temp_min DECIMAL(5, 2),
+    n_temp_media INTEGER DEFAULT 0,
+    soma_temp_media DOUBLE PRECISION DEFAULT 0,
+    soma_precipitacao DOUBLE PRECISION DEFAULT 0,
+    n_umidade INTEGER DEFAULT 0,
+    soma_umidade DOUBLE PRECISION DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (fazenda_id, mes)
+);
+
 -- Previsão do Tempo
 CREATE TABLE previsao_tempo (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -464,11 +548,29 @@ CREATE TABLE previsao_tempo (
     descricao VARCHAR(255),
     icone VARCHAR(50),
     vento_velocidade DECIMAL(5, 2),
-    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    CONSTRAINT uix_previsao_fazenda_data UNIQUE (fazenda_id, data_previsao)
 );
 
+-- Removido por migrations/004_previsao_tempo_unica.sql (coberto pela chave única)
 CREATE INDEX idx_previsao_fazenda ON previsao_tempo(fazenda_id);
 
+-- Normais climatológicas por fazenda e cultura (365 valores por dia do ano,
+-- 29/02 somado a 28/02), calculadas do histórico de dados_meteorologicos
+CREATE TABLE climatologia_fazenda (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    fazenda_id UUID NOT NULL REFERENCES fazendas(id) ON DELETE CASCADE,
+    cultura VARCHAR(100) NOT NULL,
+    temperatura_base DECIMAL(5, 2),
+    gdd_normal JSONB,
+    precipitacao_normal JSONB,
+    n_anos INTEGER,
+    data_inicio DATE,
+    data_fim DATE,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (fazenda_id, cultura)
+);
+
 -- =============================================
 -- 8. PRODUTIVIDADE E DELINEAMENTO
 -- =============================================
@@ -509,11 +611,68 @@ CREATE TABLE predicoes_produtividade (
     -- Comparação
     produtividade_real DECIMAL(10, 2),
     erro_absoluto DECIMAL(10, 2),
+    -- Real já incluído em metricas_erro_modelo
+    contabilizado BOOLEAN DEFAULT FALSE,
     
     data_predicao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Erro acumulado das predições (Welford) por modelo, cultura e safra.
+-- chave: modelo_id, "fazenda_id:cultura" ou safra_id, conforme o escopo
+CREATE TABLE metricas_erro_modelo (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    escopo VARCHAR(20) NOT NULL,
+    chave VARCHAR(150) NOT NULL,
+    n INTEGER DEFAULT 0,
+    soma_erro_abs DOUBLE PRECISION DEFAULT 0,
+    soma_erro_quadrado DOUBLE PRECISION DEFAULT 0,
+    soma_erro_percentual DOUBLE PRECISION DEFAULT 0,
+    n_percentual INTEGER DEFAULT 0,
+    media_real DOUBLE PRECISION DEFAULT 0,
+    m2_real DOUBLE PRECISION DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (escopo, chave)
+);
+
+-- Feature store das predições (uma linha por talhão e safra, atualizada
+-- a cada nova imagem ou dado meteorológico)
+CREATE TABLE features_produtividade (
+    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    talhao_id UUID NOT NULL REFERENCES talhoes(id) ON DELETE CASCADE,
+    safra_id UUID NOT NULL REFERENCES safras(id) ON DELETE CASCADE,
+    
+    -- Índices (média, pico e integral no tempo em índice·dia); média e
+    -- integral acumuladas a cada imagem ficam em ponto flutuante, sem arredondar
+    n_imagens INTEGER DEFAULT 0,
+    -- Imagens com cada índice (as que entram na média)
+    n_ndvi INTEGER DEFAULT 0,
+    n_ndre INTEGER DEFAULT 0,
+    n_msavi INTEGER DEFAULT 0,
+    data_primeira_imagem DATE,
+    data_ultima_imagem DATE,
+    ndvi_medio DOUBLE PRECISION,
+    ndvi_pico DECIMAL(5, 4),
+    ndvi_integral DOUBLE PRECISION,
+    ndvi_ultimo DECIMAL(5, 4),
+    ndre_medio DOUBLE PRECISION,
+    ndre_pico DECIMAL(5, 4),
+    ndre_integral DOUBLE PRECISION,
+    ndre_ultimo DECIMAL(5, 4),
+    msavi_medio DOUBLE PRECISION,
+    msavi_pico DECIMAL(5, 4),
+    msavi_integral DOUBLE PRECISION,
+    msavi_ultimo DECIMAL(5, 4),
+    
+    -- Clima acumulado desde o plantio
+    gdd_acumulado DECIMAL(8, 2) DEFAULT 0,
+    precipitacao_acumulada DECIMAL(8, 2) DEFAULT 0,
+    data_ultimo_clima DATE,
+    
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE (talhao_id, safra_id)
+);
+
 -- Delineamentos (Zonas de Manejo)
 CREATE TABLE delineamentos (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
@@ -532,7 +691,8 @@ CREATE TABLE delineamentos (
     -- Estatísticas
     estatisticas_zonas JSONB,
     
-    -- Status
+    -- Status (fonte do raster: sentinel-2 ou simulado)
+    fonte VARCHAR(50),
     processado BOOLEAN DEFAULT FALSE,
     url_visualizacao TEXT,
     
@@ -32,6 +32,25 @@ module.exports = {
       listen_timeout: 10000,
       // Configurações de saúde
       health_check_grace_period: 30000,
+    },
+    {
+      name: 'agrofocus-predicao',
+      script: './src/ml/servidor_predicao.py',
+      interpreter: 'python3',
+      cwd: '/home/clawdbot_user/clawd/booster_agro/backend',
+      instances: 1,
+      exec_mode: 'fork',
+      env: {
+        AGROFOCUS_PREDICAO_HOST: '127.0.0.1',
+        AGROFOCUS_PREDICAO_PORTA: 8765
+      },
+      out_file: '/home/clawdbot_user/.pm2/logs/agrofocus-predicao-out.log',
+      error_file: '/home/clawdbot_user/.pm2/logs/agrofocus-predicao-error.log',
+      log_date_format: 'YYYY-MM-DD HH:mm:ss Z',
+      max_memory_restart: '500M',
+      restart_delay: 3000,
+      max_restarts: 10,
+      autorestart: true
     }
   ]
 };
\ No newline at end of file